@@ -32,6 +32,10 @@ Codacy: https://app.codacy.com/app/willforde/script.module.codequick/dashboard
 
 from __future__ import absolute_import
 
+# Start the import profiler, if enabled, before anything else is imported
+from codequick.profiler import start_import_profiler
+start_import_profiler()
+
 # Package imports
 from codequick.support import run
 from codequick.resolver import Resolver
@@ -2,7 +2,8 @@
 from __future__ import absolute_import
 
 # Standard Library Imports
-from time import strptime, strftime
+from time import strptime
+import datetime
 import logging
 import os
 import re
@@ -22,10 +23,28 @@ from codequick.utils import ensure_unicode, ensure_native_str, unicode_type, PY3
 if PY3:
     # noinspection PyUnresolvedReferences, PyCompatibility
     from collections.abc import MutableMapping, MutableSequence
+    MappingBase = MutableMapping
 else:
     # noinspection PyUnresolvedReferences, PyCompatibility
     from collections import MutableMapping, MutableSequence
 
+    def slotted_abc(abc):
+        """
+        Return a copy of a python 2 abstract base class, that has an empty __slots__.
+
+        The python 2 abstract base classes have no __slots__, so every subclass would still get a __dict__.
+        The copy has all the mixin methods and is registered as a virtual subclass, so isinstance still works.
+        """
+        skip = ("__dict__", "__weakref__", "__metaclass__", "__abstractmethods__", "__subclasshook__")
+        namespace = {key: value for cls in reversed(abc.__mro__[:-1]) for key, value in vars(cls).items()
+                     if key not in skip and not key.startswith("_abc_")}
+        namespace.update(__slots__=(), __module__=__name__)
+        base = type(abc.__name__, (object,), namespace)
+        abc.register(base)
+        return base
+
+    MappingBase = slotted_abc(MutableMapping)
+
 __all__ = ["Listitem"]
 
 # Logger specific to this module
@@ -86,6 +105,18 @@ quality_map = ((768, 576), (1280, 720), (1920, 1080), (3840, 2160))  # SD, 720p,
 # Re.sub to remove formatting from label strings
 strip_formatting = re.compile(r"\[[^\]]+?\]").sub
 
+# Matches ISO-8601 dates e.g. "2017-06-27", the most common date format
+iso_date = re.compile(r"(\d{4})-(\d\d)-(\d\d)$").match
+
+# Directives that don't affect the date, or can be used to calculate the date, when parsing with a compiled format
+date_directives = frozenset(("Y", "y", "m", "b", "B", "d", "H", "I", "M", "S", "f", "p", "z", "Z", "a", "A"))
+
+# Compiled date format parsers, None if the format is not supported and strptime must be used
+date_parsers = {}
+
+# Parsed dates, listings often contain the same date many times
+parsed_dates = {}
+
 # Localized string Constants
 RELATED_VIDEOS = 32201
 RECENT_VIDEOS = 32002
@@ -97,7 +128,13 @@ SEARCH_PLOT = 32006
 SEARCH = 137
 
 
-class Params(MutableMapping):
+# Stream details that are set on every video listitem, when no stream details are given
+default_stream = ({"channels": 2}, {}, {})
+
+
+class Params(MappingBase):
+    __slots__ = ("raw_dict",)
+
     def __init__(self):
         self.raw_dict = {}
 
@@ -167,7 +204,9 @@ class Art(Params):
         >>> item.art.local_thumb("thumbnail.png")
     """
 
-    def __init__(self, listitem):  # type: (xbmcgui.ListItem) -> None
+    __slots__ = ("_listitem",)
+
+    def __init__(self, listitem=None):  # type: (xbmcgui.ListItem) -> None
         super(Art, self).__init__()
         self._listitem = listitem
 
@@ -243,7 +282,9 @@ class Info(Params):
         >>> item.info['size'] = 256816
     """
 
-    def __init__(self, listitem):  # type: (xbmcgui.ListItem) -> None
+    __slots__ = ("_listitem",)
+
+    def __init__(self, listitem=None):  # type: (xbmcgui.ListItem) -> None
         super(Info, self).__init__()
         self._listitem = listitem
 
@@ -269,17 +310,8 @@ class Info(Params):
                     raise TypeError(msg % (value, key, type_converter))
                 else:
                     self.raw_dict[key] = value
-
-            elif isinstance(value, str):
-                self.raw_dict[key] = value
-            elif isinstance(value, unicode_type):
-                # Only executes on python 2
-                self.raw_dict[key] = value.encode("utf8")
-            elif isinstance(value, bytes):
-                # Only executes on python 3
-                self.raw_dict[key] = value.decode("utf8")
             else:
-                self.raw_dict[key] = value
+                self.raw_dict[key] = native_value(value)
 
             if sort_type:
                 # Set the associated sort method for this infolabel
@@ -300,13 +332,49 @@ class Info(Params):
             >>> item = Listitem()
             >>> item.info.date('june 27, 2017', '%B %d, %Y')
         """
-        converted_date = strptime(ensure_native_str(date), date_format)
-        self.raw_dict["date"] = strftime("%d.%m.%Y", converted_date)  # 27.06.2017
-        self.raw_dict["aired"] = strftime("%Y-%m-%d", converted_date)  # 2017-06-27
-        self.raw_dict["year"] = strftime("%Y", converted_date)  # 2017
+        # e.g. 27.06.2017, 2017-06-27, 2017
+        self.raw_dict["date"], self.raw_dict["aired"], self.raw_dict["year"] = parse_date(date, date_format)
         auto_sort_add(xbmcplugin.SORT_METHOD_VIDEO_YEAR)
         auto_sort_add(xbmcplugin.SORT_METHOD_DATE)
 
+    @staticmethod
+    def _column(key, values):  # type: (str, list) -> list
+        """
+        Convert a column of values for the given infolabel, the same way as setting each value would.
+
+        Empty values are returned as None. The related sort method is only added once.
+        """
+        if key == "duration":
+            converter, sort_type = Info._duration, xbmcplugin.SORT_METHOD_VIDEO_RUNTIME
+        else:
+            converter, sort_type = infolable_map.get(key, (None, None))
+            if converter is None:
+                converter = native_value
+
+        converted = []
+        for value in values:
+            if value is None or value == "":
+                converted.append(None)
+            else:
+                try:
+                    converted.append(converter(value))
+                except ValueError:
+                    msg = "value of '%s' for infolabel '%s', is not of type '%s'"
+                    raise TypeError(msg % (value, key, converter))
+
+        if sort_type and any(value is not None for value in converted):
+            auto_sort_add(sort_type)
+        return converted
+
+    @staticmethod
+    def _date_column(values, date_format):  # type: (list, str) -> list
+        """Convert a column of dates into (date, aired, year) tuples, empty values are returned as None."""
+        converted = [parse_date(value, date_format) if value else None for value in values]
+        if any(converted):
+            auto_sort_add(xbmcplugin.SORT_METHOD_VIDEO_YEAR)
+            auto_sort_add(xbmcplugin.SORT_METHOD_DATE)
+        return converted
+
     @staticmethod
     def _duration(duration):
         """Converts duration from a string of 'hh:mm:ss' into seconds."""
@@ -338,8 +406,118 @@ class Info(Params):
         self._listitem.setInfo(content_type, raw_dict)
 
 
+def parse_date(date, date_format):  # type: (str, str) -> tuple
+    """
+    Parse the date and return it as a tuple of ("dd.mm.yyyy", "yyyy-mm-dd", "yyyy") strings.
+
+    This gives the same result as using strptime and strftime, but much faster. ISO-8601 dates ("%Y-%m-%d")
+    are parsed with a simple regex, other formats are compiled once to a regex using the same patterns
+    that strptime uses. Formats that need more than the matched values to calculate the date, e.g. "%j",
+    will fallback to strptime.
+
+    :param str date: The date to parse.
+    :param str date_format: The format of the date as a strftime directive.
+    :raises ValueError: If the date does not match the format.
+    """
+    key = (date, date_format)
+    try:
+        return parsed_dates[key]
+    except KeyError:
+        pass
+
+    date = ensure_native_str(date)
+    match = iso_date(date) if date_format == "%Y-%m-%d" else None
+    if match:
+        year, month, day = map(int, match.groups())
+    else:
+        try:
+            parser = date_parsers[date_format]
+        except KeyError:
+            parser = date_parsers[date_format] = compile_date_format(date_format)
+
+        if parser is None:
+            converted = strptime(date, date_format)
+            year, month, day = converted.tm_year, converted.tm_mon, converted.tm_mday
+        else:
+            year, month, day = parser(date, date_format)
+
+    # Validate the date, e.g. the 30th of February
+    datetime.date(year, month, day)
+
+    # Listings are small, but dates are never cleared otherwise
+    if len(parsed_dates) > 1000:
+        parsed_dates.clear()
+
+    parsed_dates[key] = result = ("%02d.%02d.%04d" % (day, month, year), "%04d-%02d-%02d" % (year, month, day),
+                                  "%04d" % year)
+    return result
+
+
+def compile_date_format(date_format):
+    """
+    Compile the date format to a parser function, using the same regex patterns as strptime.
+    Returns None if the format is not supported.
+    """
+    time_re = _strptime._TimeRE_cache
+    try:
+        regex = time_re.compile(date_format)
+    except (KeyError, ValueError, re.error):
+        return None
+
+    if not set(regex.groupindex).issubset(date_directives):
+        return None
+
+    months = [name.lower() for name in time_re.locale_time.f_month]
+    abbr_months = [name.lower() for name in time_re.locale_time.a_month]
+
+    def parser(date, fmt):
+        found = regex.match(date)
+        if not found or found.end() != len(date):
+            raise ValueError("time data %r does not match format %r" % (date, fmt))
+
+        values = found.groupdict()
+        if values.get("Y"):
+            year = int(values["Y"])
+        elif values.get("y"):
+            # Same as strptime, values 69-99 are mapped to 1969-1999 and values 0-68 are mapped to 2000-2068
+            year = int(values["y"])
+            year += 1900 if year >= 69 else 2000
+        else:
+            year = 1900
+
+        if values.get("m"):
+            month = int(values["m"])
+        elif values.get("B"):
+            month = months.index(values["B"].lower())
+        elif values.get("b"):
+            month = abbr_months.index(values["b"].lower())
+        else:
+            month = 1
+
+        day = int(values["d"]) if values.get("d") else 1
+        return year, month, day
+
+    return parser
+
+
+def native_value(value):
+    """Convert text to the native str type, any other type is returned as is."""
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, unicode_type):
+        # Only executes on python 2
+        return value.encode("utf8")
+    elif isinstance(value, bytes):
+        # Only executes on python 3
+        return value.decode("utf8")
+    else:
+        return value
+
+
 class Property(Params):
-    def __init__(self, listitem):  # type: (xbmcgui.ListItem) -> None
+    __slots__ = ("_listitem",)
+
+    def __init__(self, listitem=None):  # type: (xbmcgui.ListItem) -> None
         super(Property, self).__init__()
         self._listitem = listitem
 
@@ -378,7 +556,9 @@ class Stream(Params):
         >>> item.stream['audio_codec'] = 'aac'
     """
 
-    def __init__(self, listitem):  # type: (xbmcgui.ListItem) -> None
+    __slots__ = ("_listitem",)
+
+    def __init__(self, listitem=None):  # type: (xbmcgui.ListItem) -> None
         super(Stream, self).__init__()
         self._listitem = listitem
 
@@ -436,7 +616,24 @@ class Stream(Params):
         elif self.raw_dict["height"] >= 720:
             self.raw_dict["aspect"] = 1.78
 
-    def _close(self):
+    @staticmethod
+    def _column(key, values):  # type: (str, list) -> list
+        """Convert a column of values for the given stream detail, empty values are returned as None."""
+        converter = stream_type_map.get(key, ensure_native_str)
+        converted = []
+        for value in values:
+            if not value:
+                converted.append(None)
+            else:
+                try:
+                    converted.append(converter(value))
+                except ValueError:
+                    msg = "Value of '%s' for stream info '%s', is not of type '%s'"
+                    raise TypeError(msg % (value, key, converter))
+        return converted
+
+    def _details(self):  # type: () -> tuple
+        """Return the stream details as a tuple of (audio, video, subtitle) dictionaries."""
         video = {}
         subtitle = {}
         audio = {"channels": 2}
@@ -452,12 +649,20 @@ class Stream(Params):
             else:
                 raise KeyError("unknown stream detail key: '{}'".format(key))
 
-        # Now we are ready to send the stream info to kodi
-        self._listitem.addStreamInfo("audio", audio)
-        if video:
-            self._listitem.addStreamInfo("video", video)
-        if subtitle:
-            self._listitem.addStreamInfo("subtitle", subtitle)
+        return audio, video, subtitle
+
+    def _close(self):
+        add_stream_info(self._listitem, self._details())
+
+
+def add_stream_info(listitem, details):  # type: (xbmcgui.ListItem, tuple) -> None
+    """Send the (audio, video, subtitle) stream details to kodi."""
+    audio, video, subtitle = details
+    listitem.addStreamInfo("audio", audio)
+    if video:
+        listitem.addStreamInfo("video", video)
+    if subtitle:
+        listitem.addStreamInfo("subtitle", subtitle)
 
 
 class Context(list):
@@ -473,7 +678,9 @@ class Context(list):
                  http://kodi.wiki/view/List_of_Built_In_Functions
     """
 
-    def __init__(self, listitem):  # type: (xbmcgui.ListItem) -> None
+    __slots__ = ("_listitem",)
+
+    def __init__(self, listitem=None):  # type: (xbmcgui.ListItem) -> None
         super(Context, self).__init__()
         self._listitem = listitem
 
@@ -526,12 +733,44 @@ class Context(list):
             self._listitem.addContextMenuItems(self)
 
 
+class LazyAttribute(object):
+    """
+    Descriptor for a slotted attribute, where the value is only created the first time it's accessed.
+
+    :param str name: Name of the slot that stores the value.
+    :param factory: Callable that returns the initial value.
+    :param str doc: The docstring of the attribute.
+    """
+
+    def __init__(self, name, factory, doc=None):
+        self.name = name
+        self.factory = factory
+        self.__doc__ = doc
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = getattr(instance, self.name)
+        if value is None:
+            value = self.factory()
+            setattr(instance, self.name, value)
+        return value
+
+    def __set__(self, instance, value):
+        setattr(instance, self.name, value)
+
+
 class Listitem(object):
     """
     The “listitem” control is used for the creating "folder" or "video" items within Kodi.
 
     :param str content_type: [opt] Type of content been listed. e.g. "video", "music", "pictures".
     """
+    # Listings can have thousands of listitems, so the sub objects are only created when used.
+    # The __dict__ slot keeps support for custom attributes, the dict is only created when first used.
+    __slots__ = ("_content_type", "is_playable", "is_folder", "_args", "path", "_label", "_listitem",
+                 "_subtitles", "_info", "_art", "_stream", "_context", "_params", "_property", "__dict__")
 
     def __init__(self, content_type="video"):
         self._content_type = content_type
@@ -539,48 +778,66 @@ class Listitem(object):
         self.is_folder = False
         self._args = None
         self.path = ""
+        self._label = u""
+        self._listitem = self._subtitles = None
+        self._info = self._art = self._stream = self._context = self._params = self._property = None
 
-        #: The underlining kodi listitem object, for advanced use.
-        self.listitem = listitem = xbmcgui.ListItem()
-
-        #: List of paths to subtitle files.
-        self.subtitles = []
+    @property
+    def label(self):  # type: () -> str
+        """
+        The listitem label property.
 
-        self.info = Info(listitem)
+        :example:
+            >>> item = Listitem()
+            >>> item.label = "Video Title"
         """
+        # Label may have been set directly on the kodi listitem
+        label = (self._listitem is not None and self._listitem.getLabel()) or self._label
+        return label.decode("utf8") if isinstance(label, bytes) else label
+
+    @label.setter
+    def label(self, label):  # type: (str) -> None
+        self._label = label
+        if self._listitem is not None:
+            self._listitem.setLabel(label)
+        unformatted_label = strip_formatting("", label)
+        self.params["_title_"] = unformatted_label
+        self.info["title"] = unformatted_label
+
+    listitem = LazyAttribute("_listitem", xbmcgui.ListItem, "The underlining kodi listitem object, for advanced use.")
+
+    subtitles = LazyAttribute("_subtitles", list, "List of paths to subtitle files.")
+
+    info = LazyAttribute("_info", Info, """
         Dictionary like object for adding "infoLabels".
         See :class:`listing.Info<codequick.listing.Info>` for more details.
-        """
+        """)
 
-        self.art = Art(listitem)
-        """
+    art = LazyAttribute("_art", Art, """
         Dictionary like object for adding "listitem art".
         See :class:`listing.Art<codequick.listing.Art>` for more details.
-        """
+        """)
 
-        self.stream = Stream(listitem)
-        """
+    stream = LazyAttribute("_stream", Stream, """
         Dictionary like object for adding "stream details".
         See :class:`listing.Stream<codequick.listing.Stream>` for more details.
-        """
+        """)
 
-        self.context = Context(listitem)
-        """
+    context = LazyAttribute("_context", Context, """
         List object for "context menu" items.
         See :class:`listing.Context<codequick.listing.Context>` for more details.
-        """
+        """)
 
-        self.params = Params()
-        """
+    params = LazyAttribute("_params", Params, """
         Dictionary like object for parameters that will be passed to the "callback" function.
 
         :example:
             >>> item = Listitem()
             >>> item.params['videoid'] = 'kqmdIV_gBfo'
-        """
+        """)
 
-        self.property = Property(listitem)
-        """
+    # This shadows the builtin 'property' within the class body, so it must come after any use of @property
+    property = LazyAttribute("_property", Property, """
         Dictionary like object that allows you to add "listitem properties". e.g. "StartOffset".
 
         Some of these are processed internally by Kodi, such as the "StartOffset" property,
@@ -590,26 +847,7 @@ class Listitem(object):
         :examples:
             >>> item = Listitem()
             >>> item.property['StartOffset'] = '256.4'
-        """
-
-    @property
-    def label(self):  # type: () -> str
-        """
-        The listitem label property.
-
-        :example:
-            >>> item = Listitem()
-            >>> item.label = "Video Title"
-        """
-        label = self.listitem.getLabel()
-        return label.decode("utf8") if isinstance(label, bytes) else label
-
-    @label.setter
-    def label(self, label):  # type: (str) -> None
-        self.listitem.setLabel(label)
-        unformatted_label = strip_formatting("", label)
-        self.params["_title_"] = unformatted_label
-        self.info["title"] = unformatted_label
+        """)
 
     def set_callback(self, callback, *args, **kwargs):
         """
@@ -651,7 +889,8 @@ class Listitem(object):
             isfolder = path.route.is_folder
             listitem.setProperty("isplayable", str(path.route.is_playable).lower())
             listitem.setProperty("folder", str(path.route.is_folder).lower())
-            path = build_path(path, self._args, self.params.raw_dict)
+            query = self.params.raw_dict if self._args or self._params else None
+            path = build_path(path, self._args, query)
         elif not path:
             listitem.setProperty("isplayable", "false")
             listitem.setProperty("folder", "false")
@@ -667,30 +906,77 @@ class Listitem(object):
                 self.info.raw_dict["mediatype"] = self._content_type
 
             # Set the listitem subtitles
-            if self.subtitles:
-                self.listitem.setSubtitles(self.subtitles)
+            if self._subtitles:
+                listitem.setSubtitles(self._subtitles)
 
             # Add Video Specific Context menu items
             self.context.append(("$LOCALIZE[13347]", "XBMC.Action(Queue)"))
             self.context.append(("$LOCALIZE[13350]", "XBMC.ActivateWindow(videoplaylist)"))
 
             # Close video related datasets
-            self.stream._close()
+            if self._stream:
+                self._stream._listitem = listitem
+                self._stream._close()
+            else:
+                add_stream_info(listitem, default_stream)
 
-        # Set label to UNKNOWN if unset
-        if not self.label:  # pragma: no branch
-            self.label = u"UNKNOWN"
+        # Set label to UNKNOWN if unset, a label set directly on the kodi listitem still needs the title info
+        label = self.label or u"UNKNOWN"
+        if label != self._label:  # pragma: no branch
+            self.label = label
 
-        # Close common datasets
+        # Close common datasets, the sub objects are only closed if they were used
+        listitem.setLabel(label)
         listitem.setPath(path)
-        self.property._close()
-        self.context._close()
-        self.info._close(self._content_type)
-        self.art._close(isfolder)
+        if self._property:
+            self._property._listitem = listitem
+            self._property._close()
+        if self._context:
+            self._context._listitem = listitem
+            self._context._close()
+
+        info = self.info
+        info._listitem = listitem
+        info._close(self._content_type)
+        art = self.art
+        art._listitem = listitem
+        art._close(isfolder)
 
         # Return a tuple compatible with 'xbmcplugin.addDirectoryItems'
         return path, listitem, isfolder
 
+    def _snapshot(self, path, isfolder):  # type: (str, bool) -> tuple
+        """
+        Return the closed listitem as a tuple of plain data, so the listitem can be cached.
+        The listitem can be recreated using :meth:`Listitem._restore<codequick.listing.Listitem._restore>`.
+        """
+        properties = dict(self._property.raw_dict) if self._property else {}
+        properties["isplayable"] = self.listitem.getProperty("isplayable")
+        properties["folder"] = self.listitem.getProperty("folder")
+        stream = self._stream._details() if self._stream else default_stream
+        return (path, isfolder, self.label, self._content_type, dict(self.art.raw_dict), dict(self.info.raw_dict),
+                None if isfolder else stream, properties, list(self._context or ()),
+                None if isfolder else self._subtitles)
+
+    @staticmethod
+    def _restore(snapshot):  # type: (tuple) -> tuple
+        """Recreate a closed listitem from a snapshot, returning a tuple compatible with 'addDirectoryItems'."""
+        path, isfolder, label, content_type, art, info, stream, properties, context, subtitles = snapshot
+        listitem = xbmcgui.ListItem()
+        listitem.setLabel(label)
+        listitem.setPath(path)
+        for key, value in properties.items():
+            listitem.setProperty(key, value)
+        if context:
+            listitem.addContextMenuItems(context)
+        if stream:
+            add_stream_info(listitem, stream)
+        if subtitles:
+            listitem.setSubtitles(subtitles)
+        listitem.setInfo(content_type, info)
+        listitem.setArt(art)
+        return path, listitem, isfolder
+
     @classmethod
     def from_dict(
             cls,
@@ -749,6 +1035,115 @@ class Listitem(object):
 
         return item
 
+    @classmethod
+    def bulk(cls, callback, rows, mapping=None, content_type="video"):
+        """
+        Constructor to create "listitems" in bulk, from row data.
+
+        This is faster than creating each listitem with :meth:`from_dict<codequick.listing.Listitem.from_dict>`,
+        as the values are validated and converted one column at a time, and the related sort methods are
+        only detected once for the whole listing.
+
+        The mapping links listitem fields to the keys of the rows. The supported fields are.
+            * ``label``         - The listitem's label.
+            * ``callback``      - Per row "callback" function or playable URL, overrides the callback argument.
+            * ``date``          - A tuple of (key, date_format), see :meth:`Info.date<codequick.listing.Info.date>`.
+            * ``info.<name>``   - The "infoLabel" called <name>.
+            * ``art.<name>``    - The "art" image called <name>.
+            * ``stream.<name>`` - The "stream detail" called <name>.
+            * ``property.<name>`` - The "listitem property" called <name>.
+            * ``params.<name>`` - The parameter called <name> that will be passed to the "callback" function.
+
+        :param callback: The "callback" function or playable URL.
+        :param rows: List of dictionaries, one per listitem. Or a dictionary of columns, e.g. lists of titles and urls.
+        :param dict mapping: [opt] Mapping of listitem fields to row keys. Defaults to using the row keys as fields.
+        :param str content_type: [opt] Type of content been listed. e.g. "video", "music", "pictures".
+        :returns: A generator of listitem objects.
+        :raises TypeError: If a value can't be converted to the type required by the field.
+        :raises ValueError: If the mapping contains an unknown listitem field.
+
+        :example:
+            >>> rows = [{"title": "Video Title", "url": "http://example.com/video", "thumb": "image.jpg"}]
+            >>> mapping = {"label": "title", "params.url": "url", "art.thumb": "thumb"}
+            >>> for item in Listitem.bulk(play_video, rows, mapping):
+            >>>     yield item
+        """
+        # Convert rows into columns
+        if hasattr(rows, "keys"):
+            columns = rows
+        else:
+            rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+            keys = mapping.values() if mapping else set(key for row in rows for key in row)
+            keys = [key[0] if isinstance(key, tuple) else key for key in keys]
+            columns = {key: [row.get(key) for row in rows] for key in keys}
+
+        mapping = mapping if mapping else {key: key for key in columns}
+        count = max(len(column) for column in columns.values()) if columns else 0
+
+        def column(key):
+            values = columns[key]
+            return values if len(values) == count else list(values) + [None] * (count - len(values))
+
+        # Validate and convert each column
+        labels = callbacks = dates = None
+        fields = {"info": [], "art": [], "stream": [], "property": [], "params": []}
+        for field, key in mapping.items():
+            if field == "label":
+                labels = column(key)
+            elif field == "callback":
+                callbacks = column(key)
+            elif field == "date":
+                key, date_format = key
+                dates = Info._date_column(column(key), date_format)
+            else:
+                group, _, name = field.partition(".")
+                if group not in fields or not name:
+                    raise ValueError("unknown listitem field: '{}'".format(field))
+                elif group == "info":
+                    values = Info._column(name, column(key))
+                elif group == "art":
+                    values = [ensure_native_str(value) if value else None for value in column(key)]
+                elif group == "stream":
+                    values = Stream._column(name, column(key))
+                elif group == "property":
+                    values = [ensure_unicode(value) if value else None for value in column(key)]
+                else:
+                    values = [value.decode("utf8") if isinstance(value, bytes) else value for value in column(key)]
+                fields[group].append((name, values))
+
+        # Same as what set_callback and the label setter would do for each listitem
+        registered_routes = dispatcher.registered_routes
+        if callbacks:
+            callbacks = [registered_routes[path].callback if path in registered_routes else path or None
+                         for path in callbacks]
+        callback = registered_routes[callback].callback if callback in registered_routes else callback
+        titles = [strip_formatting("", label) if label else None for label in labels] if labels else None
+
+        def listitems():
+            for index in range(count):
+                item = cls(content_type)
+                item.path = callbacks[index] or callback if callbacks else callback
+                item._args = ()
+                if titles and titles[index] is not None:
+                    item._label = labels[index]
+                    item.params.raw_dict["_title_"] = item.info.raw_dict["title"] = titles[index]
+
+                for group, group_fields in fields.items():
+                    if group_fields:
+                        raw_dict = getattr(item, group).raw_dict
+                        for name, values in group_fields:
+                            value = values[index]
+                            if value is not None:
+                                raw_dict[name] = value
+
+                if dates and dates[index]:
+                    raw_dict = item.info.raw_dict
+                    raw_dict["date"], raw_dict["aired"], raw_dict["year"] = dates[index]
+                yield item
+
+        # The values are converted before returning, so invalid rows or mappings fail straight away
+        return listitems()
+
     @classmethod
     def next_page(cls, *args, **kwargs):
         """
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+# Standard Library Imports
+import importlib
+import logging
+import cProfile
+import pstats
+import time
+import sys
+import re
+import os
+
+try:
+    # noinspection PyUnresolvedReferences
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import builtins
+except ImportError:  # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    import __builtin__ as builtins
+
+# Kodi imports
+import xbmc
+
+__all__ = ["ImportProfiler", "import_profiler", "RouteProfiler", "route_profiler"]
+
+# Environment variable that will enable the import profiler if set to "1" or "true"
+ENV_IMPORT_PROFILER = "CODEQUICK_PROFILE_IMPORTS"
+
+# Add-on setting that will enable the import profiler if set to "true"
+SETTING_IMPORT_PROFILER = "codequick_profile_imports"
+
+# Environment variable that will enable the route profiler if set to "1" or "true"
+ENV_ROUTE_PROFILER = "CODEQUICK_PROFILE_ROUTES"
+
+# Add-on setting that will enable the route profiler if set to "true"
+SETTING_ROUTE_PROFILER = "codequick_profile_routes"
+
+# Max number of route profiles to keep in the profile directory
+MAX_ROUTE_PROFILES = 10
+
+# Number of functions to include in the route profile log summary
+ROUTE_PROFILE_SUMMARY = 20
+
+# Highest resolution timer available
+timer = getattr(time, "perf_counter", time.time)
+
+# Default import level of __import__, python 2 uses -1 to try an implicit relative import first
+PY3 = sys.version_info[0] >= 3
+DEFAULT_LEVEL = 0 if PY3 else -1
+
+
+class ImportProfiler(object):
+    """
+    Profile the time it takes to import each module during add-on startup.
+
+    Two times are recorded for every module. The import time, which includes the time spent importing
+    any modules that the module imports. And the self time, which is the time spent executing the module level
+    code of the module itself, e.g. calls to ``Script.get_info`` or the creation of ``xbmcaddon.Addon`` objects.
+
+    Modules that are imported using "from package import module" are included in the time of the package.
+    Modules imported using :func:`importlib.import_module`, like route modules, are profiled too. On python 2
+    import_module goes through __import__, so only __import__ is patched.
+
+    :ivar list records: List of (module, import time, self time) tuples, times are in seconds.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._stack = []
+        self._org_import = None
+        self._org_import_module = None
+        self._start_time = 0.0
+        self.total_time = 0.0
+
+    @property
+    def running(self):  # type: () -> bool
+        """True if the profiler is running, else False."""
+        return self._org_import is not None
+
+    def start(self):
+        """Start profiling all imports."""
+        if not self.running:
+            self._org_import = builtins.__import__
+            self._start_time = timer()
+            builtins.__import__ = self._import
+            if PY3:
+                self._org_import_module = importlib.import_module
+                importlib.import_module = self._import_module
+
+    def stop(self):
+        """Stop profiling imports."""
+        if self.running:
+            builtins.__import__ = self._org_import
+            if self._org_import_module is not None:
+                importlib.import_module = self._org_import_module
+            self._org_import = self._org_import_module = None
+            self.total_time = timer() - self._start_time
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=DEFAULT_LEVEL):
+        # Resolve explicit relative imports to the full module name, implicit
+        # relative imports of python 2 (level -1) are recorded by the given name
+        if level > 0 and globals:
+            package = globals.get("__package__") or globals.get("__name__", "")
+            package = package.rsplit(".", level - 1)[0] if level > 1 else package
+            fullname = "{}.{}".format(package, name) if name else package
+        else:
+            fullname = name
+        return self._timed(fullname, self._org_import, name, globals, locals, fromlist, level)
+
+    def _import_module(self, name, package=None):
+        # On python 3 importlib.import_module does not go through __import__
+        fullname = package + name if package and name.startswith(".") else name
+        return self._timed(fullname, self._org_import_module, name, package)
+
+    def _timed(self, fullname, import_func, *args):
+        # Modules that are already imported are of no interest
+        if fullname in sys.modules:
+            return import_func(*args)
+
+        self._stack.append(0.0)
+        start = timer()
+        try:
+            return import_func(*args)
+        finally:
+            elapsed = timer() - start
+            child_time = self._stack.pop()
+            self.records.append((fullname, elapsed, elapsed - child_time))
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def report(self, limit=25):  # type: (int) -> list
+        """
+        Return a report of the slowest modules, ranked by self time.
+
+        :param int limit: [opt] Max number of modules to include in the report.
+        :returns: List of report lines.
+        """
+        lines = ["Import profile: {} modules imported in {:.1f}ms".format(len(self.records), self.total_time * 1000),
+                 "{:>10} {:>10}  {}".format("self (ms)", "total (ms)", "module")]
+        for name, elapsed, self_time in sorted(self.records, key=lambda record: record[2], reverse=True)[:limit]:
+            lines.append("{:>10.2f} {:>10.2f}  {}".format(self_time * 1000, elapsed * 1000, name))
+        return lines
+
+    def write_report(self, limit=25):
+        """Stop the profiler and write the report to the kodi log and a file in the add-on profile directory."""
+        self.stop()
+        from codequick.support import logger_id
+        logger = logging.getLogger("%s.profiler" % logger_id)
+
+        lines = self.report(limit)
+        for line in lines:
+            logger.info(line)
+
+        # Full report, with every module, is saved to the profile directory
+        profile = profile_dir()
+        filepath = os.path.join(profile, u"_import_profile.txt")
+        try:
+            if not os.path.exists(profile):
+                os.makedirs(profile)
+            with open(filepath, "w") as stream:
+                stream.write("\n".join(self.report(len(self.records))))
+        except (IOError, OSError) as e:
+            logger.debug("Unable to save import profile: %s", e)
+
+
+class RouteProfiler(object):
+    """
+    Profile the execution of a route using cProfile.
+
+    The profile covers the callback, the processing of the results and the delayed callbacks.
+    The stats are saved as a ".pstats" file in the add-on profile directory, only the most recent
+    profiles are kept. A summary of the most expensive functions is also written to the kodi log.
+
+    The ".pstats" files can be inspected using :mod:`pstats` or tools like snakeviz.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def enable(self):
+        """Start collecting profiling data."""
+        self.profile.enable()
+
+    def disable(self):
+        """Stop collecting profiling data."""
+        self.profile.disable()
+
+    def summary(self, limit=ROUTE_PROFILE_SUMMARY):  # type: (int) -> str
+        """
+        Return a summary of the functions with the highest cumulative time.
+
+        :param int limit: [opt] Max number of functions to include in the summary.
+        """
+        stream = StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def write_report(self, path, limit=ROUTE_PROFILE_SUMMARY):  # type: (str, int) -> str
+        """
+        Stop the profiler, save the stats file and log a summary.
+
+        :param str path: The route path that was profiled.
+        :param int limit: [opt] Max number of functions to include in the log summary.
+        :returns: The path to the saved stats file.
+        """
+        self.disable()
+        from codequick.support import logger_id
+        logger = logging.getLogger("%s.profiler" % logger_id)
+        logger.info("Route profile: %s\n%s", path, self.summary(limit))
+
+        directory = os.path.join(profile_dir(), u"_route_profiles")
+        name = re.sub(r"[^\w.-]+", "_", path).strip("_") or "root"
+        filepath = os.path.join(directory, u"{}-{}.pstats".format(int(time.time() * 1000), name))
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.profile.dump_stats(filepath)
+            rotate(directory, MAX_ROUTE_PROFILES)
+        except (IOError, OSError) as e:
+            logger.debug("Unable to save route profile: %s", e)
+        else:
+            logger.info("Route profile saved to: %s", filepath)
+        return filepath
+
+
+def rotate(directory, keep):  # type: (str, int) -> None
+    """Remove the oldest ".pstats" files from directory, keeping only the given amount."""
+    # Filenames start with a timestamp, so sorting by name is sorting by age
+    filenames = sorted(name for name in os.listdir(directory) if name.endswith(".pstats"))
+    for filename in filenames[:-keep]:
+        os.remove(os.path.join(directory, filename))
+
+
+def profile_dir():  # type: () -> str
+    """Return the add-on profile directory."""
+    from codequick.support import addon_data
+    profile = xbmc.translatePath(addon_data.getAddonInfo("profile"))
+    return profile.decode("utf8") if isinstance(profile, bytes) else profile
+
+
+def enabled(env=ENV_IMPORT_PROFILER, setting=SETTING_IMPORT_PROFILER, addon=None):
+    # type: (str, str, object) -> bool
+    """
+    Return True if a profiler was enabled using the environment variable or add-on setting.
+
+    The add-on setting is only checked when an addon object is given, so that checking the environment
+    variable never requires the creation of an addon object.
+    """
+    if os.environ.get(env, "").lower() in ("1", "true"):
+        return True
+    return addon is not None and addon.getSetting(setting) == "true"
+
+
+#: The import profiler, only set when the profiler is enabled.
+import_profiler = None
+
+
+def start_import_profiler(addon=None):
+    """
+    Start the import profiler if it's enabled.
+
+    This is called before anything else is imported, when only the environment variable can be checked.
+    And again once the add-on data is loaded, to check the add-on setting. When enabled using the setting,
+    only the modules imported after codequick itself are profiled.
+
+    :param addon: [opt] The addon object, used to check the add-on setting.
+    """
+    global import_profiler
+    if import_profiler is None and enabled(addon=addon):
+        import_profiler = ImportProfiler()
+        import_profiler.start()
+
+
+def stop_import_profiler():
+    """Stop the import profiler, if running, and write the report."""
+    if import_profiler is not None and import_profiler.running:
+        import_profiler.write_report()
+
+
+#: The route profiler of the current invocation, only set when the profiler is enabled.
+route_profiler = None
+
+
+def start_route_profiler(addon):
+    """
+    Start profiling the route, if the route profiler is enabled.
+
+    :param addon: The addon object, used to check the add-on setting.
+    """
+    global route_profiler
+    if enabled(ENV_ROUTE_PROFILER, SETTING_ROUTE_PROFILER, addon):
+        route_profiler = RouteProfiler()
+        route_profiler.enable()
+    else:
+        route_profiler = None
+
+
+def stop_route_profiler(path):
+    """
+    Stop the route profiler, if running, and write the report.
+
+    :param str path: The route path that was profiled.
+    """
+    global route_profiler
+    if route_profiler is not None:
+        profiler, route_profiler = route_profiler, None
+        profiler.write_report(path)
@@ -3,17 +3,24 @@ from __future__ import absolute_import
 
 # Standard Library Imports
 from collections import defaultdict
+from hashlib import sha1
 import logging
 import inspect
+import pickle
+import time
 import re
+import os
 
 # Kodi imports
 import xbmcplugin
 
 # Package imports
 from codequick.script import Script
-from codequick.support import logger_id, auto_sort
+from codequick.listing import Listitem
+from codequick.support import logger_id, auto_sort, encode_params
 from codequick.utils import ensure_native_str
+from codequick.tracing import span, timer
+from codequick import tracing
 
 __all__ = ["Route", "validate_listitems"]
 _UNSET = object()
@@ -25,6 +32,87 @@ logger = logging.getLogger("%s.route" % logger_id)
 SELECT_PLAYBACK_ITEM = 25006
 NO_DATA = 33077
 
+# Max number of listings to keep in the route cache
+MAX_CACHED_LISTINGS = 200
+
+
+class ListingSnapshot(object):
+    """
+    Finalized listing of a route callback, that can be cached and replayed without calling the callback.
+
+    :param list items: List of listitem snapshots.
+    :param Route parent: The route that produced the listing.
+    """
+    __slots__ = ("items", "manual_sort", "auto_sort", "autosort", "content_type", "category", "update_listing",
+                 "cache_to_disc", "redirect_single_item")
+
+    def __init__(self, items, parent):
+        self.items = items
+        self.manual_sort = list(parent._manual_sort)
+        self.auto_sort = sorted(auto_sort)
+        self.autosort = parent.autosort
+        self.content_type = None if parent.content_type is _UNSET else (parent.content_type,)
+        # The default category comes from the title of the parent listitem, so only a custom category is cached
+        self.category = None if parent.category == title_category(parent._title) else parent.category
+        self.update_listing = parent.update_listing
+        self.cache_to_disc = parent.cache_to_disc
+        self.redirect_single_item = parent.redirect_single_item
+
+    def __getstate__(self):
+        return [getattr(self, key) for key in self.__slots__]
+
+    def __setstate__(self, state):
+        if len(state) != len(self.__slots__):
+            raise ValueError("snapshot was created by a different version of codequick")
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+
+def cache_dir():  # type: () -> str
+    """Return the directory where cached listings are stored."""
+    path = os.path.join(Script.get_info("profile"), u".route_cache")
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def prune_cache(route, keep=MAX_CACHED_LISTINGS):
+    """Remove the expired listings of the route, and the oldest listings when there are more than keep."""
+    directory = cache_dir()
+    prefix = cache_key(route.path, None).rsplit(u"-", 1)[0]
+    now = time.time()
+    listings = []
+    for filename in os.listdir(directory):
+        filepath = os.path.join(directory, filename)
+        try:
+            mtime = os.stat(filepath).st_mtime
+            if filename.startswith(prefix) and now - mtime >= route.cache_ttl:
+                os.remove(filepath)
+            else:
+                listings.append((mtime, filepath))
+        except OSError:  # pragma: no cover
+            pass
+
+    # Listings of other routes are only known by there age
+    listings.sort()
+    for _, filepath in listings[:-keep]:
+        try:
+            os.remove(filepath)
+        except OSError:  # pragma: no cover
+            pass
+
+
+def title_category(title):  # type: (str) -> str
+    """Return the default category for a listing, the listitem title without the item count."""
+    return re.sub(u"\(\d+\)$", u"", title).strip()
+
+
+def cache_key(path, params):  # type: (str, dict) -> str
+    """Return the cache filename for the route path and callback params."""
+    path_hash = sha1(path.encode("utf8")).hexdigest()[:16]
+    params_hash = sha1(encode_params(params).encode("utf8")).hexdigest()[:16] if params else u"none"
+    return u"{}-{}.pickle".format(path_hash, params_hash)
+
 
 def validate_listitems(raw_listitems):
     """Check if listitems are valid"""
@@ -83,15 +171,89 @@ class Route(Script):
     def __init__(self):
         super(Route, self).__init__()
         self.update_listing = self.params.get(u"_updatelisting_", False)
-        self.category = re.sub(u"\(\d+\)$", u"", self._title).strip()
+        self.category = title_category(self._title)
         self.cache_to_disc = self.params.get(u"_cache_to_disc_", True)
         self.redirect_single_item = False
         self._manual_sort = list()
         self.content_type = _UNSET
         self.autosort = True
+        self._cache_file = None
+
+    @classmethod
+    def register(cls, callback=None, **kwargs):
+        """
+        Decorator used to register callback functions.
+
+        Can be used with or without arguments.
+
+        :param callback: The callback function to register.
+        :param int cache_ttl: [opt] Keyword only argument. Cache the finalized listing for the given time in
+                              seconds. Cached listings are replayed without calling the callback, so any delayed
+                              callbacks registered by the callback will not run when the listing is cached.
+        :returns: The original callback function.
+
+        :example:
+            >>> @Route.register(cache_ttl=3600)
+            >>> def videos(_, url):
+            >>>     ...
+        """
+        return super(Route, cls).register(callback, **kwargs)
+
+    @staticmethod
+    def invalidate_cache(callback=None, **params):
+        """
+        Remove cached listings.
+
+        :param callback: [opt] Only remove the listings of this callback. Defaults to all callbacks.
+        :param params: [opt] Only remove the listing of the callback that was called with these parameters.
+        """
+        directory = cache_dir()
+        if callback is None:
+            filenames = os.listdir(directory)
+        elif params:
+            filenames = [cache_key(callback.route.path, params)]
+        else:
+            prefix = cache_key(callback.route.path, None).rsplit(u"-", 1)[0]
+            filenames = [name for name in os.listdir(directory) if name.startswith(prefix)]
+
+        for filename in filenames:
+            filepath = os.path.join(directory, filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+                logger.debug("Removed cached listing: %s", filename)
+
+    def _load_cache(self, route, params):
+        """Return the cached listing of the route if it has not expired, else None."""
+        self._cache_file = filepath = os.path.join(cache_dir(), cache_key(route.path, params))
+        try:
+            if time.time() - os.stat(filepath).st_mtime < route.cache_ttl:
+                with open(filepath, "rb") as stream:
+                    snapshot = pickle.load(stream)
+                logger.debug("Route cache hit: %s", route.path)
+                return snapshot
+        except (IOError, OSError):
+            pass
+        except Exception as e:
+            logger.debug("Unable to load cached listing: %s", e)
+
+        # The listing will be cached again, so this is when the expired listings are cleaned up
+        logger.debug("Route cache miss: %s", route.path)
+        prune_cache(route)
+        return None
+
+    def _save_cache(self, snapshot):
+        """Save the finalized listing to the cache."""
+        try:
+            with open(self._cache_file, "wb") as stream:
+                pickle.dump(snapshot, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug("Unable to cache listing: %s", e)
 
     def _process_results(self, raw_listitems):
         """Handle the processing of the listitems."""
+        if isinstance(raw_listitems, ListingSnapshot):
+            return self._replay(raw_listitems)
+
         raw_listitems = validate_listitems(raw_listitems)
         if raw_listitems is False:
             xbmcplugin.endOfDirectory(self.handle, False)
@@ -99,12 +261,16 @@ class Route(Script):
 
         # Create a new list containing tuples, consisting of path, listitem, isfolder.
         listitems = []
+        snapshots = [] if self._cache_file else None
         folder_counter = 0.0
+        close_time = 0.0
         mediatypes = defaultdict(int)
         for listitem in raw_listitems:
             if listitem:  # pragma: no branch
+                close_start = timer()
                 # noinspection PyProtectedMember
                 listitem_tuple = listitem._close()
+                close_time += timer() - close_start
                 listitems.append(listitem_tuple)
                 if listitem_tuple[2]:  # pragma: no branch
                     folder_counter += 1
@@ -112,11 +278,54 @@ class Route(Script):
                 if "mediatype" in listitem.info:
                     mediatypes[listitem.info["mediatype"]] += 1
 
+                if snapshots is not None:
+                    # noinspection PyProtectedMember
+                    snapshots.append(listitem._snapshot(listitem_tuple[0], listitem_tuple[2]))
+
+        if tracing.tracer is not None:
+            tracing.tracer.add("listitem_close", close_time, count=len(listitems))
+
+        if snapshots is not None:
+            self._save_cache(ListingSnapshot(snapshots, self))
+
         # If redirect_single_item is set to True then redirect view to the first
         # listitem if it's the only listitem and that listitem is a folder
         if self.redirect_single_item and len(listitems) == 1 and listitems[0][2] is True:
             return listitems[0][0]  # return the listitem path
 
+        self.__add_items(listitems, folder_counter, mediatypes)
+
+    def _replay(self, snapshot):  # type: (ListingSnapshot) -> str
+        """Pass a cached listing to kodi."""
+        self._manual_sort = list(snapshot.manual_sort)
+        auto_sort.update(snapshot.auto_sort)
+        self.autosort = snapshot.autosort
+        self.content_type = _UNSET if snapshot.content_type is None else snapshot.content_type[0]
+        if snapshot.category is not None:
+            self.category = snapshot.category
+        self.redirect_single_item = snapshot.redirect_single_item
+        # Only the non default values can come from the request, these take priority over the cached values
+        self.update_listing = self.update_listing or snapshot.update_listing
+        self.cache_to_disc = self.cache_to_disc and snapshot.cache_to_disc
+
+        listitems = []
+        folder_counter = 0.0
+        mediatypes = defaultdict(int)
+        for item in snapshot.items:
+            # noinspection PyProtectedMember
+            listitems.append(Listitem._restore(item))
+            if item[1]:
+                folder_counter += 1
+            if "mediatype" in item[5]:
+                mediatypes[item[5]["mediatype"]] += 1
+
+        if self.redirect_single_item and len(listitems) == 1 and listitems[0][2] is True:
+            return listitems[0][0]
+
+        self.__add_items(listitems, folder_counter, mediatypes)
+
+    def __add_items(self, listitems, folder_counter, mediatypes):  # type: (list, float, defaultdict) -> None
+        """Pass the listitems to kodi, along with the category, content type and sort methods."""
         # Guess if this directory listing is primarily a folder or video listing.
         # Listings will be considered to be a folder if more that half the listitems are folder items.
         isfolder = folder_counter > (len(listitems) / 2)
@@ -132,8 +341,10 @@ class Route(Script):
             self.__add_sort_methods(self._manual_sort)
 
         # Pass the listitems and relevant data to kodi
-        success = xbmcplugin.addDirectoryItems(self.handle, listitems, len(listitems))
-        xbmcplugin.endOfDirectory(self.handle, success, self.update_listing, self.cache_to_disc)
+        with span("addDirectoryItems", count=len(listitems)):
+            success = xbmcplugin.addDirectoryItems(self.handle, listitems, len(listitems))
+        with span("endOfDirectory"):
+            xbmcplugin.endOfDirectory(self.handle, success, self.update_listing, self.cache_to_disc)
 
     def __content_type(self, default_type, mediatypes):  # type: (str, defaultdict) -> None
         """Configure plugin properties, content, category and sort methods."""
@@ -160,14 +160,19 @@ class Script(object):
         self.handle = dispatcher.handle
 
     @classmethod
-    def register(cls, callback):
+    def register(cls, callback=None, **kwargs):
         """
         Decorator used to register callback functions.
 
+        Can be used with or without arguments. See :meth:`Route.register<codequick.route.Route.register>`
+        for the arguments that are supported by "Route" callbacks.
+
         :param callback: The callback function to register.
         :returns: The original callback function.
         """
-        return dispatcher.register_callback(callback, parent=cls)
+        if callback is None:
+            return lambda func: dispatcher.register_callback(func, parent=cls, **kwargs)
+        return dispatcher.register_callback(callback, parent=cls, **kwargs)
 
     @staticmethod
     def register_delayed(func, *args, **kwargs):
@@ -196,9 +201,18 @@ class Script(object):
             If there is an argument called exception in the delayed function callback and an error was raised,
             then that exception argument will be set to the raised exception object.
             Otherwise it will be set to None.
+
+        .. note::
+
+            There is one optional keyword only argument ``parallel``. If ``True``, the function is considered
+            independent of the other delayed functions and will be executed on a worker thread, alongside
+            the other delayed functions. Kodi will only wait a limited time for parallel functions to finish.
         """
         function_type = kwargs.get("function_type", 0)
-        dispatcher.register_delayed(func, args, kwargs, function_type)
+        if kwargs.pop("parallel", False):
+            dispatcher.register_parallel(func, args, kwargs, function_type)
+        else:
+            dispatcher.register_delayed(func, args, kwargs, function_type)
 
     @staticmethod
     def log(msg, args=None, lvl=10):
@@ -2,14 +2,21 @@
 from __future__ import absolute_import
 
 # Standard Library Imports
+from collections import OrderedDict, deque
 import importlib
+import threading
 import binascii
 import inspect
 import logging
+import base64
 import pickle
+import json
+import zlib
+import weakref
 import time
 import sys
 import re
+import os
 
 # Kodi imports
 import xbmcaddon
@@ -18,12 +25,21 @@ import xbmc
 
 # Package imports
 from codequick.utils import parse_qs, ensure_native_str, urlparse, PY3, unicode_type
+from codequick.profiler import start_import_profiler, stop_import_profiler, start_route_profiler, stop_route_profiler
+from codequick.tracing import span, timer, start_tracer, stop_tracer
+from codequick import tracing
 
 if PY3:
     from inspect import getfullargspec
+    from urllib.parse import quote_plus
+    long_type = int
 else:
     # noinspection PyDeprecation
     from inspect import getargspec as getfullargspec
+    # noinspection PyUnresolvedReferences
+    from urllib import quote_plus
+    # noinspection PyUnresolvedReferences
+    long_type = long
 
 script_data = xbmcaddon.Addon("script.module.codequick")
 addon_data = xbmcaddon.Addon()
@@ -31,12 +47,49 @@ addon_data = xbmcaddon.Addon()
 plugin_id = addon_data.getAddonInfo("id")
 logger_id = re.sub("[ .]", "-", addon_data.getAddonInfo("name"))
 
+# The import profiler can also be enabled using the add-on setting, now that the add-on data is loaded
+start_import_profiler(addon_data)
+
 # Logger specific to this module
 logger = logging.getLogger("%s.support" % logger_id)
 
 # Listitem auto sort methods
 auto_sort = set()
 
+# Max number of debug records to keep, for logging when a critical error occurs
+DEBUG_HISTORY = 500
+
+# Max number of threads used to execute parallel delayed callbacks
+PARALLEL_WORKERS = 4
+
+# Kodi's advanced settings, where debug logging can be enabled using the loglevel setting
+ADVANCED_SETTINGS = "special://userdata/advancedsettings.xml"
+
+# Total time in seconds to wait for parallel delayed callbacks to finish
+PARALLEL_BUDGET = 30.0
+
+# Cache of delayed callbacks and whether they accept the "exception" argument
+accepts_exception = weakref.WeakKeyDictionary()
+
+# Types that survive a round trip through json unchanged
+json_types = frozenset((type(None), bool, int, long_type, float, unicode_type))
+
+# Encoded params smaller than this, in bytes, are not worth compressing
+compress_threshold = 128
+
+# Cache of encoded query parameters, listitems of a listing often have values in common.
+# Each parameter is encoded on its own, so the url of a listitem never depends on the other listitems.
+encoded_params = {}
+
+# Max number of encoded query parameters to cache
+ENCODED_PARAMS_CACHE = 2000
+
+# Least recently used cache of encoded "_params_" values, keyed by the json text of the params
+encoded_blocks = OrderedDict()
+
+# Max number of encoded "_params_" values to cache
+ENCODED_BLOCKS_CACHE = 16
+
 
 class RouteMissing(KeyError):
     """
@@ -45,6 +98,59 @@ class RouteMissing(KeyError):
     """
 
 
+class RouteManifest(dict):
+    """
+    Persistent mapping of route paths to the module, callback name and parent type that owns the route.
+
+    This allows the dispatcher to import only the module that owns the requested route. Routes are added
+    to the manifest as they are registered and the manifest is discarded when the add-on version changes.
+
+    :param str filepath: Path to the manifest file.
+    :param str version: The version of the add-on.
+    """
+    def __init__(self, filepath, version):
+        super(RouteManifest, self).__init__()
+        self.filepath = filepath
+        self.version = version
+        self.changed = False
+        self.load()
+
+    def load(self):
+        """Load the manifest from disk, if it matches the current add-on version."""
+        try:
+            with open(self.filepath, "r") as stream:
+                data = json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if data.get("version") == self.version:
+            self.update(data["routes"])
+        else:
+            logger.debug("Add-on version changed, discarding route manifest")
+
+    def save(self):
+        """Save the manifest to disk, if any route was changed."""
+        if self.changed:
+            data = {"version": self.version, "routes": self}
+            try:
+                data_dir = os.path.dirname(self.filepath)
+                if not os.path.exists(data_dir):
+                    os.makedirs(data_dir)
+                with open(self.filepath, "w") as stream:
+                    json.dump(data, stream, separators=(",", ":"))
+            except (IOError, OSError) as e:
+                logger.debug("Unable to save route manifest: %s", e)
+            else:
+                self.changed = False
+
+    def add(self, route):  # type: (Route) -> None
+        """Add the route to the manifest."""
+        entry = [route.callback.__module__, route.callback.__name__, route.parent.__name__]
+        if self.get(route.path) != entry:
+            self[route.path] = entry
+            self.changed = True
+
+
 class LoggingMap(dict):
     def __init__(self):
         super(LoggingMap, self).__init__()
@@ -59,39 +165,79 @@ class LoggingMap(dict):
         return xbmc.LOGNOTICE
 
 
+def loglevel():  # type: () -> int
+    """Return the loglevel that is set in kodi's advancedsettings.xml, 0 if not set."""
+    filepath = xbmc.translatePath(ADVANCED_SETTINGS)
+    if not os.path.exists(filepath):
+        return 0
+
+    # Only imported when needed, as most users don't have an advancedsettings.xml file
+    from xml.etree import ElementTree
+    try:
+        return int(ElementTree.parse(filepath).getroot().findtext("loglevel", "0"))
+    except (IOError, OSError, ValueError, ElementTree.ParseError) as e:
+        logger.debug("Unable to read loglevel from advancedsettings.xml: %s", e)
+        return 0
+
+
 class KodiLogHandler(logging.Handler):
     """
     Custom Logger Handler to forward logs to Kodi.
 
     Log records will automatically be converted from unicode to utf8 encoded strings.
-    All debug messages will be stored locally and outputed as warning messages if a critical error occurred.
+    The most recent debug records will be stored locally and outputed as warning messages if a critical error occurred.
     This is done so that debug messages will appear on the normal kodi log file without having to enable debug logging.
 
-    :ivar debug_msgs: Local store of degub messages.
+    Debug records are only formatted and forwarded to kodi when kodi debug logging is enabled,
+    using the debug setting or the loglevel of advancedsettings.xml. Otherwise they are stored as is
+    and only formatted if a critical error occurred.
+
+    :ivar debug_records: Local store of the most recent debug records.
+    :ivar bool debug_enabled: True if kodi debug logging is enabled.
     """
     def __init__(self):
         super(KodiLogHandler, self).__init__()
         self.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
         self.log_level_map = LoggingMap()
-        self.debug_msgs = []
+        self.debug_records = deque(maxlen=DEBUG_HISTORY)
+        self.debug_enabled = True
+        self.refresh()
+
+    @property
+    def debug_msgs(self):  # type: () -> list
+        """List of the formatted debug messages."""
+        return [ensure_native_str(self.format(record)) for record in self.debug_records]
+
+    def refresh(self):
+        """Check whether kodi debug logging is enabled."""
+        self.debug_enabled = bool(xbmc.getCondVisibility("System.GetBool(debug.showloginfo)")) or loglevel() > 0
+
+    def clear(self):
+        """Clear the stored debug records."""
+        self.debug_records.clear()
 
     def emit(self, record):  # type: (logging.LogRecord) -> None
         """Forward the log record to kodi, lets kodi handle the logging."""
-        formatted_msg = ensure_native_str(self.format(record))
         log_level = record.levelno
 
-        # Forward the log record to kodi with translated log level
-        xbmc.log(formatted_msg, self.log_level_map[log_level])
-
-        # Keep a history of all debug records so they can be logged later if a critical error occurred
+        # Keep a history of the debug records so they can be logged later if a critical error occurred
         # Kodi by default, won't show debug messages unless debug logging is enabled
         if log_level == 10:
-            self.debug_msgs.append(formatted_msg)
+            self.debug_records.append(record)
+            if not self.debug_enabled:
+                return
+
+        # Forward the log record to kodi with translated log level
+        xbmc.log(ensure_native_str(self.format(record)), self.log_level_map[log_level])
 
         # If a critical error occurred, log all debug messages as warnings
-        elif log_level == 50 and self.debug_msgs:
+        if log_level == 50 and self.debug_records:
             xbmc.log("###### debug ######", xbmc.LOGWARNING)
-            for msg in self.debug_msgs:
+            for record in self.debug_records:
+                try:
+                    msg = ensure_native_str(self.format(record))
+                except Exception as e:
+                    msg = "Unable to format debug record: {}".format(e)
                 xbmc.log(msg, xbmc.LOGWARNING)
             xbmc.log("###### debug ######", xbmc.LOGWARNING)
 
@@ -103,6 +249,7 @@ class Route(object):
     :param callback: The callable callback function.
     :param parent: The parent class that will handle the response from callback.
     :param str path: The route path to func/class.
+    :param int cache_ttl: [opt] Time in seconds that the results of the callback can be cached for.
 
     :ivar bool is_playable: True if callback is playable, else False.
     :ivar bool is_folder: True if callback is a folder, else False.
@@ -110,13 +257,14 @@ class Route(object):
     :ivar callback: The callable callback function.
     :ivar parent: The parent class that will handle the response from callback.
     :ivar str path: The route path to func/class.
+    :ivar int cache_ttl: Time in seconds that the results of the callback can be cached for, None if disabled.
     """
-    __slots__ = ("parent", "function", "callback", "path", "is_playable", "is_folder")
+    __slots__ = ("parent", "function", "callback", "path", "is_playable", "is_folder", "cache_ttl", "_arg_names")
 
     def __eq__(self, other):
         return self.path == other.path
 
-    def __init__(self, callback, parent, path):
+    def __init__(self, callback, parent, path, cache_ttl=None):
         # Register a class callback
         if inspect.isclass(callback):
             if hasattr(callback, "run"):
@@ -135,6 +283,10 @@ class Route(object):
         self.is_folder = parent.is_folder
         self.callback = callback
         self.path = path
+        self.cache_ttl = cache_ttl
+
+        # Inspecting the callback is slow, so only do it once
+        self._arg_names = getfullargspec(self.function).args
 
     def args_to_kwargs(self, args, kwargs):  # type: (tuple, dict) -> None
         """Convert positional arguments to keyword arguments and merge into callback parameters."""
@@ -144,7 +296,7 @@ class Route(object):
 
     def arg_names(self):  # type: () -> list
         """Return a list of argument names, positional and keyword arguments."""
-        return getfullargspec(self.function).args
+        return self._arg_names
 
     def unittest_caller(self, *args, **kwargs):
         """
@@ -199,21 +351,55 @@ class Route(object):
 
 
 class Dispatcher(object):
-    """Class to handle registering and dispatching of callback functions."""
+    """
+    Class to handle registering and dispatching of callback functions.
+
+    Kodi can keep the python interpreter alive between invocations of the add-on, when
+    "reuselanguageinvoker" is enabled in the addon.xml. All per-invocation state is reset before dispatching,
+    and the add-on data is refreshed when the interpreter is reused, so changed settings are picked up.
+
+    :ivar int invocations: Number of times the add-on was invoked by kodi, within this interpreter.
+    """
 
     def __init__(self):
+        self.invocations = 0
         self.registered_delayed = []
+        self.registered_parallel = []
         self.registered_routes = {}
         self.callback_params = {}
         self.selector = "root"
         self.params = {}
         self.handle = -1
+        self._manifest = None
+
+    @property
+    def manifest(self):  # type: () -> RouteManifest
+        """The route manifest, loaded on first use."""
+        if self._manifest is None:
+            profile = xbmc.translatePath(addon_data.getAddonInfo("profile"))
+            profile = profile.decode("utf8") if isinstance(profile, bytes) else profile
+            filepath = os.path.join(profile, u"_routes.json")
+            self._manifest = RouteManifest(filepath, addon_data.getAddonInfo("version"))
+        return self._manifest
+
+    def refresh(self):
+        """Refresh the add-on data, as kodi is reusing the python interpreter."""
+        global addon_data
+        logger.debug("Reusing python interpreter, invocation: %d", self.invocations)
+        addon_data = xbmcaddon.Addon()
+        kodi_logger.refresh()
+
+        # The script module keeps its own reference to the add-on data
+        script_module = sys.modules.get("codequick.script")
+        if script_module is not None:
+            script_module.addon_data = addon_data
 
     def reset(self):
         """Reset session parameters."""
         self.registered_delayed[:] = []
+        self.registered_parallel[:] = []
         self.callback_params.clear()
-        kodi_logger.debug_msgs = []
+        kodi_logger.clear()
         self.selector = "root"
         self.params.clear()
         auto_sort.clear()
@@ -228,7 +414,11 @@ class Dispatcher(object):
             params = parse_qs(raw_params)
             self.params.update(params)
 
-            # Unpickle pickled data
+            # Decode encoded params
+            if "_params_" in params:
+                self.params.update(decode_params(self.params.pop("_params_")))
+
+            # Unpickle pickled data, from urls created by older versions
             if "_pickle_" in params:
                 unpickled = pickle.loads(binascii.unhexlify(self.params.pop("_pickle_")))
                 self.params.update(unpickled)
@@ -241,6 +431,15 @@ class Dispatcher(object):
         """Return the given route object."""
         path = path if path else self.selector
 
+        # Attempt to import the module that owns the route, as listed in the route manifest
+        if path not in self.registered_routes and path in self.manifest:
+            module_path = self.manifest[path][0]
+            logger.debug("Attempting to import route from manifest: %s", module_path)
+            try:
+                importlib.import_module(module_path)
+            except ImportError:
+                logger.debug("Route manifest is out of date")
+
         # Attempt to import the module where the route
         # is located if it's not already registered
         if path not in self.registered_routes:
@@ -251,16 +450,21 @@ class Dispatcher(object):
             except ModuleNotFoundError:
                 raise RouteMissing("unable to import route module")
         try:
-            return self.registered_routes[path]
+            route = self.registered_routes[path]
         except KeyError:
             raise RouteMissing(path)
+        else:
+            # All routes known at this point have been registered, so save any new routes
+            self.manifest.save()
+            return route
 
-    def register_callback(self, callback, parent):
+    def register_callback(self, callback, parent, cache_ttl=None):
         """
         Register route callback function
 
         :param callback: The callback function.
         :param parent: Parent class that will handle the callback, used when callback is a function.
+        :param int cache_ttl: [opt] Time in seconds that the results of the callback can be cached for.
         :returns: The callback function with extra attributes added, 'route', 'testcall'.
         """
         # Construct route path
@@ -272,13 +476,20 @@ class Dispatcher(object):
         if path in self.registered_routes:
             logger.debug("encountered duplicate route: '%s'", path)
 
-        self.registered_routes[path] = route = Route(callback, parent, path)
+        self.registered_routes[path] = route = Route(callback, parent, path, cache_ttl)
+        self.manifest.add(route)
         callback.route = route
         return callback
 
     def register_delayed(self, *callback):
         """Register a function that will be called later, after content has been listed."""
         self.registered_delayed.append(callback)
+        wants_exception(callback[0])
+
+    def register_parallel(self, *callback):
+        """Register a function that will be called later, on a worker thread, after content has been listed."""
+        self.registered_parallel.append(callback)
+        wants_exception(callback[0])
 
     # noinspection PyIncorrectDocstring
     def run_callback(self, process_errors=True, redirect=None):
@@ -298,26 +509,55 @@ class Dispatcher(object):
         returns the error Exception if an error ocurred.
         :rtype: Exception or None
         """
+        # Redirects are part of the same invocation
+        new_invocation = redirect is None
+        if new_invocation:
+            self.invocations += 1
+            if self.invocations > 1:
+                self.refresh()
+            start_tracer(addon_data)
+
         self.reset()
-        self.parse_args(redirect)
+        with span("parse_args"):
+            self.parse_args(redirect)
+        if new_invocation and tracing.tracer is not None:
+            tracing.tracer.route = self.selector
+
         logger.debug("Dispatching to route: '%s'", self.selector)
         logger.debug("Callback parameters: '%s'", self.callback_params)
 
         try:
             # Fetch the controling class and callback function/method
-            route = self.get_route()
+            with span("import"):
+                route = self.get_route()
+
+            # All imports are done at this point
+            stop_import_profiler()
+            start_route_profiler(addon_data)
             execute_time = time.time()
             redirect = None
 
-            # Initialize controller and execute callback
-            parent_ins = route.parent()
-            results = route.function(parent_ins, **self.callback_params)
-            if hasattr(parent_ins, "_process_results"):
+            # Initialize controller and execute callback, unless the parent has cached results
+            with span("parent"):
+                parent_ins = route.parent()
+            results = None
+            if route.cache_ttl and hasattr(parent_ins, "_load_cache"):
                 # noinspection PyProtectedMember
-                redirect = parent_ins._process_results(results)
+                results = parent_ins._load_cache(route, self.callback_params)
+            if results is None:
+                with span("callback"):
+                    results = route.function(parent_ins, **self.callback_params)
+            if hasattr(parent_ins, "_process_results"):
+                # Generator callbacks are executed while the results are processed
+                with span("process_results"):
+                    # noinspection PyProtectedMember
+                    redirect = parent_ins._process_results(results)
 
         except Exception as e:
             self.run_delayed(e)
+            stop_route_profiler(self.selector)
+            if new_invocation:
+                stop_tracer()
             # Don't do anything with the error
             # if process_errors is disabled
             if not process_errors:
@@ -340,31 +580,96 @@ class Dispatcher(object):
         else:
             logger.debug("Route Execution Time: %ims", (time.time() - execute_time) * 1000)
             self.run_delayed()
+            stop_route_profiler(self.selector)
             if redirect:
                 self.run_callback(process_errors, redirect)
+            if new_invocation:
+                stop_tracer()
 
     def run_delayed(self, exception=None):
         """Execute all delayed callbacks, if any."""
-        if self.registered_delayed:
+        if self.registered_delayed or self.registered_parallel:
             # Time before executing callbacks
             start_time = time.time()
 
+            # Parallel callbacks are started first, so they can run while the ordered callbacks are executed
+            workers = self.start_parallel(exception)
+
             # Execute in order of last in first out (LIFO).
             while self.registered_delayed:
                 func, args, kwargs, function_type = self.registered_delayed.pop()
                 if function_type == 2 or bool(exception) == function_type:
-                    # Add raised exception to callback if requested
-                    if "exception" in getfullargspec(func).args:
-                        kwargs["exception"] = exception
+                    call_delayed(func, args, kwargs, exception)
 
-                    try:
-                        func(*args, **kwargs)
-                    except Exception as e:
-                        logger.exception(str(e))
+            # Wait for the parallel callbacks to finish, within the time budget
+            for worker in workers:
+                worker.join(max(0.0, start_time + PARALLEL_BUDGET - time.time()))
+                if worker.is_alive():
+                    logger.warning("Parallel callbacks did not finish within %is", PARALLEL_BUDGET)
+                    break
 
             # Log execution time of callbacks
             logger.debug("Callbacks Execution Time: %ims", (time.time() - start_time) * 1000)
 
+    def start_parallel(self, exception=None):  # type: (Exception) -> list
+        """Start executing the parallel delayed callbacks on worker threads, returning the started threads."""
+        callbacks = [(func, args, kwargs) for func, args, kwargs, function_type in self.registered_parallel
+                     if function_type == 2 or bool(exception) == function_type]
+        self.registered_parallel[:] = []
+
+        def worker():
+            while True:
+                try:
+                    func, args, kwargs = callbacks.pop()
+                except IndexError:
+                    break
+                call_delayed(func, args, kwargs, exception, parallel=True)
+
+        workers = []
+        for _ in range(min(PARALLEL_WORKERS, len(callbacks))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+        return workers
+
+
+def call_delayed(func, args, kwargs, exception=None, parallel=False):
+    """Execute a delayed callback, logging any error that was raised and the execution time."""
+    # Add raised exception to callback if requested
+    if wants_exception(func):
+        kwargs["exception"] = exception
+
+    name = getattr(func, "__name__", repr(func))
+    start_time = timer()
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        logger.exception(str(e))
+    finally:
+        elapsed = timer() - start_time
+        logger.debug("Delayed callback '%s' execution time: %ims", name, elapsed * 1000)
+        # Workers that run past the budget can race with stop_tracer, so the tracer is only read once
+        tracer = tracing.tracer
+        if tracer is not None:
+            tracer.add("delayed", elapsed, start_time, callback=name, parallel=parallel)
+
+
+def wants_exception(func):
+    """Return True if the delayed callback accepts the "exception" argument, else False."""
+    # Bound methods are created on each attribute access, so the underlying function is used as the key
+    key = getattr(func, "__func__", func)
+    try:
+        return accepts_exception[key]
+    except KeyError:
+        pass
+    except TypeError:
+        # Callable can't be weak referenced, e.g. a builtin function
+        return "exception" in getfullargspec(func).args
+
+    accepts_exception[key] = result = "exception" in getfullargspec(func).args
+    return result
+
 
 def build_path(callback=None, args=None, query=None, **extra_query):
     """
@@ -392,15 +697,139 @@ def build_path(callback=None, args=None, query=None, **extra_query):
         query = dispatcher.params.copy()
         query.update(extra_query)
 
-    # Encode the query parameters using json
+    # Encode the query parameters
     if query:
-        pickled = binascii.hexlify(pickle.dumps(query, protocol=pickle.HIGHEST_PROTOCOL))
-        query = "_pickle_={}".format(pickled.decode("ascii") if PY3 else pickled)
+        query = encode_params(query)
 
     # Build kodi url with new path and query parameters
     return urlparse.urlunsplit(("plugin", plugin_id, route.path, query, ""))
 
 
+def is_json_safe(obj):
+    """Return True if the object will be the same after a round trip through json, else False."""
+    obj_type = type(obj)
+    if obj_type in json_types:
+        return True
+    elif obj_type is list:
+        return all(is_json_safe(item) for item in obj)
+    elif obj_type is dict:
+        return all(type(key) in (unicode_type, str) and is_json_safe(value) for key, value in obj.items())
+    elif obj_type is str and not PY3:
+        # Native python 2 strings are encoded by json as utf8
+        try:
+            obj.decode("utf8")
+        except UnicodeDecodeError:
+            return False
+        else:
+            return True
+    else:
+        return False
+
+
+def encode_pair(key, value):  # type: (str, str) -> tuple
+    """Return the sort key and the quoted "key=value" string of a plain query parameter, cached in encoded_params."""
+    try:
+        return encoded_params[(key, value)]
+    except KeyError:
+        pass
+
+    if len(encoded_params) >= ENCODED_PARAMS_CACHE:
+        encoded_params.clear()
+
+    native_key = ensure_native_str(key)
+    pair = (native_key, "{}={}".format(quote_plus(native_key), quote_plus(ensure_native_str(value))))
+    encoded_params[(key, value)] = pair
+    return pair
+
+
+def encode_params(query):  # type: (dict) -> str
+    """
+    Encode the query parameters into a query string.
+
+    Non empty string values are added as plain query parameters. All other values are encoded into
+    the "_params_" parameter. The first character of "_params_" is the format of the encoded data,
+    followed by the data as unpadded base64url.
+
+    * ``j``: json
+    * ``z``: zlib compressed json
+    * ``p``: pickle, for types that can't be stored as json
+    * ``x``: zlib compressed pickle
+
+    Keys are sorted, so the same params will always produce the same url.
+
+    :param dict query: The query parameters.
+    :returns: The encoded query string.
+    :rtype: str
+    """
+    plain = []
+    complex_params = {}
+    for key, value in query.items():
+        if isinstance(value, (unicode_type, str)) and value and isinstance(key, (unicode_type, str)):
+            plain.append(encode_pair(key, value))
+        else:
+            complex_params[key] = value
+
+    if complex_params:
+        if is_json_safe(complex_params):
+            data = json.dumps(complex_params, sort_keys=True, separators=(",", ":")).encode("utf8")
+            try:
+                # Listitems that share all of their complex params only need the json text to be compressed once
+                pair = encoded_blocks.pop(data)
+            except KeyError:
+                pair = encode_block(data, "jz")
+                if len(encoded_blocks) >= ENCODED_BLOCKS_CACHE:
+                    encoded_blocks.popitem(last=False)
+            encoded_blocks[data] = pair
+        else:
+            pair = encode_block(pickle.dumps(complex_params, protocol=2), "px")
+        plain.append(pair)
+
+    return "&".join(pair for _, pair in sorted(plain))
+
+
+def encode_block(data, formats):  # type: (bytes, str) -> tuple
+    """
+    Return the sort key and the "_params_=..." string for the serialized complex params.
+
+    :param bytes data: The serialized params.
+    :param str formats: The format characters of the data, uncompressed and compressed.
+    """
+    # Only compress when there is something to gain
+    data_format = formats[0]
+    if len(data) > compress_threshold:
+        compressed = zlib.compress(data, 9)
+        if len(compressed) < len(data):
+            data, data_format = compressed, formats[1]
+
+    # Base64url only contains characters that are safe in a query string
+    encoded = ensure_native_str(base64.urlsafe_b64encode(data).rstrip(b"="))
+    return "_params_", "_params_=" + data_format + encoded
+
+
+def decode_params(data):  # type: (str) -> dict
+    """
+    Decode the "_params_" query parameter, created by :func:`encode_params`.
+
+    :param str data: The encoded params.
+    :returns: The decoded params.
+    :rtype: dict
+    :raises ValueError: If the format of the params is unknown.
+    """
+    data_format, encoded = data[:1], data[1:]
+    if data_format not in ("j", "z", "p", "x"):
+        raise ValueError("unknown params format: '{}'".format(data_format))
+
+    encoded = encoded.encode("ascii")
+    raw = base64.urlsafe_b64decode(encoded + b"=" * (-len(encoded) % 4))
+    if data_format in ("z", "x"):
+        raw = zlib.decompress(raw)
+
+    if data_format in ("j", "z"):
+        return json.loads(raw.decode("utf8"))
+    else:
+        return pickle.loads(raw)
+
+
 # Setup kodi logging
 kodi_logger = KodiLogHandler()
 base_logger = logging.getLogger()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Structured timing spans for the dispatch pipeline.
+
+When enabled, every invocation of the add-on appends one JSON object per span to "_trace.jsonl"
+in the add-on profile directory. This module has no kodi dependencies at import time, so the
+trace file can be summarized outside of kodi by running this file directly::
+
+    python tracing.py _trace.jsonl
+"""
+from __future__ import absolute_import, print_function
+
+# Standard Library Imports
+from collections import defaultdict
+import logging
+import json
+import math
+import time
+import sys
+import os
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+__all__ = ["Tracer", "span", "tracer"]
+
+# Environment variable that will enable tracing if set to "1" or "true"
+ENV_TRACING = "CODEQUICK_TRACE"
+
+# Add-on setting that will enable tracing if set to "true"
+SETTING_TRACING = "codequick_trace"
+
+# Trace file is rotated when it grows bigger than this size in bytes
+MAX_TRACE_SIZE = 1024 * 1024 * 5
+
+# Highest resolution timer available
+timer = getattr(time, "perf_counter", time.time)
+
+
+class Span(object):
+    """
+    Context manager that records the time spent within the block.
+
+    If :mod:`tracemalloc` is tracing, the memory allocated within the block is also recorded.
+    """
+    __slots__ = ("tracer", "name", "attrs", "start", "memory")
+
+    def __init__(self, tracer_ins, name, attrs):
+        self.tracer = tracer_ins
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.memory = 0
+
+    def __enter__(self):
+        if self.tracer.memory:
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.tracer.stack.append(self.name)
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        elapsed = timer() - self.start
+        self.tracer.stack.pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        if self.tracer.memory:
+            self.attrs["alloc_kb"] = round((tracemalloc.get_traced_memory()[0] - self.memory) / 1024.0, 1)
+        self.tracer.add(self.name, elapsed, self.start, **self.attrs)
+
+
+class NullSpan(object):
+    """Span that does nothing, used when tracing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+null_span = NullSpan()
+
+
+class Tracer(object):
+    """
+    Collect the timing spans of one invocation.
+
+    Spans are nested, the parent of a span is the span that was active when the span started.
+    Records are kept in memory and written out in one go by :meth:`flush`.
+
+    :param str filepath: The file that the spans will be appended to.
+    :ivar str route: The route path of the invocation, added to every record.
+    :ivar bool memory: True if the memory allocated within each span is recorded, only when tracemalloc is tracing.
+    """
+
+    def __init__(self, filepath):
+        self.memory = tracemalloc is not None and tracemalloc.is_tracing()
+        self.filepath = filepath
+        self.invocation = "{:x}".format(int(time.time() * 1000000))
+        self.origin = timer()
+        self.route = None
+        self.records = []
+        self.stack = []
+
+    def span(self, name, **attrs):  # type: (str, ...) -> Span
+        """
+        Return a context manager that records the time spent within the block as a span.
+
+        :param str name: The name of the span.
+        :param attrs: Extra attributes to add to the span record.
+        """
+        return Span(self, name, attrs)
+
+    def add(self, name, elapsed, start=None, **attrs):
+        """
+        Add a span that was timed by the caller, e.g. the total time of many small operations.
+
+        :param str name: The name of the span.
+        :param float elapsed: Time in seconds.
+        :param float start: [opt] Timer value when the span started. Defaults to now minus elapsed.
+        :param attrs: Extra attributes to add to the span record.
+        """
+        start = timer() - elapsed if start is None else start
+        record = {"span": name, "parent": self.stack[-1] if self.stack else None,
+                  "start": round((start - self.origin) * 1000, 3), "ms": round(elapsed * 1000, 3)}
+        record.update(attrs)
+        self.records.append(record)
+
+    def flush(self):
+        """Write the collected spans to the trace file, the spans are discarded if the file can't be written."""
+        if not self.records:
+            return
+
+        try:
+            directory = os.path.dirname(self.filepath)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # Keep only one previous trace file
+            if os.path.exists(self.filepath) and os.path.getsize(self.filepath) > MAX_TRACE_SIZE:
+                if os.path.exists(self.filepath + ".1"):
+                    os.remove(self.filepath + ".1")
+                os.rename(self.filepath, self.filepath + ".1")
+
+            with open(self.filepath, "a") as stream:
+                for record in self.records:
+                    record["id"] = self.invocation
+                    record["route"] = self.route
+                    stream.write(json.dumps(record, sort_keys=True))
+                    stream.write("\n")
+        except (IOError, OSError) as e:
+            from codequick.support import logger_id
+            logging.getLogger("%s.tracing" % logger_id).debug("Unable to save trace: %s", e)
+        finally:
+            del self.records[:]
+
+
+#: The tracer of the current invocation, only set when tracing is enabled.
+tracer = None
+
+
+def span(name, **attrs):
+    """
+    Return a context manager that records the time spent within the block, if tracing is enabled.
+
+    :param str name: The name of the span.
+    :param attrs: Extra attributes to add to the span record.
+    """
+    # Read once, as stop_tracer can be called from another thread
+    tracer_ins = tracer
+    if tracer_ins is None:
+        return null_span
+    return tracer_ins.span(name, **attrs)
+
+
+def request_hook(req, resp, elapsed):
+    """Urlquick request hook that records every request as a span, nested under the active span."""
+    # Requests can be sent from hedged or parallel threads, that can race with stop_tracer
+    tracer_ins = tracer
+    if tracer_ins is not None:
+        from urlquick import CacheResponse
+        tracer_ins.add("request", elapsed, url=req.url, method=req.method, status=resp.status_code,
+                       cached=isinstance(resp.raw, CacheResponse))
+
+
+def start_tracer(addon):
+    """
+    Start tracing the invocation, if tracing is enabled.
+
+    :param addon: The addon object, used to check the add-on setting.
+    """
+    global tracer
+    from codequick.profiler import enabled, profile_dir
+    if enabled(ENV_TRACING, SETTING_TRACING, addon):
+        tracer = Tracer(os.path.join(profile_dir(), u"_trace.jsonl"))
+        import urlquick
+        if request_hook not in urlquick.request_hooks:
+            urlquick.request_hooks.append(request_hook)
+    else:
+        tracer = None
+
+
+def stop_tracer():
+    """Stop tracing, if running, and write the spans to the trace file."""
+    global tracer
+    if tracer is not None:
+        tracer_ins, tracer = tracer, None
+        tracer_ins.flush()
+
+
+def percentile(values, percent):  # type: (list, float) -> float
+    """Return the percentile of the sorted list of values, using the nearest rank method."""
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(len(values) - 1, index))]
+
+
+def summarize(lines):
+    """
+    Aggregate the span records of many invocations.
+
+    :param lines: Iterable of json lines, e.g. an open trace file.
+    :returns: Dictionary of (route, span) keys, with (count, p50, p95, max) tuple values. Times are in ms.
+    """
+    timings = defaultdict(list)
+    for line in lines:
+        line = line.strip()
+        if line:
+            record = json.loads(line)
+            timings[(record["route"], record["span"])].append(record["ms"])
+
+    summary = {}
+    for key, values in timings.items():
+        values.sort()
+        summary[key] = (len(values), percentile(values, 50), percentile(values, 95), values[-1])
+    return summary
+
+
+def report(summary):  # type: (dict) -> list
+    """Return the summary as a list of report lines, grouped by route."""
+    lines = ["{:<30} {:<20} {:>6} {:>10} {:>10} {:>10}".format("route", "span", "count", "p50 (ms)", "p95 (ms)",
+                                                               "max (ms)")]
+    for (route, name), (count, p50, p95, slowest) in sorted(summary.items(), key=lambda item: str(item[0])):
+        lines.append("{:<30} {:<20} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            str(route), name, count, p50, p95, slowest))
+    return lines
+
+
+def main(args=None):
+    """Print a p50/p95 report of the given trace files."""
+    args = sys.argv[1:] if args is None else args
+    if not args:
+        print("usage: tracing.py <trace file> [<trace file>...]")
+        return 1
+
+    lines = []
+    for filepath in args:
+        with open(filepath) as stream:
+            lines.extend(stream)
+    print("\n".join(report(summarize(lines))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -46,17 +46,23 @@ Code Coverage: https://coveralls.io/github/willforde/urlquick?branch=master
 Code Quality: https://app.codacy.com/app/willforde/urlquick/dashboard
 """
 
-__all__ = ["request", "get", "head", "post", "put", "patch", "delete", "cache_cleanup", "Session"]
+__all__ = ["request", "get", "head", "post", "put", "patch", "delete", "cache_cleanup", "Session", "Scheduler",
+           "CookieJar"]
 __version__ = "0.9.4"
 
 # Standard library imports
-from codecs import open as _open, getencoder
+from codecs import open as _open, getencoder, lookup as _lookup_codec
 from base64 import b64encode, b64decode
 from collections import defaultdict
 from datetime import datetime
+from email.utils import parsedate_tz, mktime_tz
 import json as _json
 import logging
 import hashlib
+import marshal
+import threading
+import weakref
+import pickle
 import socket
 import time
 import zlib
@@ -76,6 +82,8 @@ if py3:
     from http.cookies import SimpleCookie
     # noinspection PyUnresolvedReferences, PyCompatibility
     from collections.abc import MutableMapping
+    # noinspection PyUnresolvedReferences, PyCompatibility
+    from queue import Queue, Empty
 
     # Under kodi this constant is set to the addon data directory
     # code for whitch is at the bottom of this file
@@ -94,6 +102,8 @@ else:
     from Cookie import SimpleCookie
     # noinspection PyUnresolvedReferences, PyCompatibility
     from collections import MutableMapping
+    # noinspection PyUnresolvedReferences, PyCompatibility
+    from Queue import Queue, Empty
 
     # Under kodi this constant is set to the addon data directory
     # code for whitch is at the bottom of this file
@@ -141,9 +151,47 @@ REDIRECT_CODES = (301, 302, 303, 307, 308)
 #: The default max age of the cache in seconds is used when no max age is given in request.
 MAX_AGE = 14400  # 4 Hours
 
+#: Response bodies smaller than this, in bytes, are stored in the cache as is.
+CACHE_COMPRESS_THRESHOLD = 1024
+
+#: The zlib compression level used for bodies stored in the cache, from 1 (fastest) to 9. 0 disables compression.
+CACHE_COMPRESS_LEVEL = 6
+
+# Size of the chunks that a response body is read in, when reading against a deadline
+CHUNK_SIZE = 65536
+
+# Status codes that indicate that the server wants us to slow down
+THROTTLE_CODES = (429, 503)
+
+# Min time in seconds between writes of the rate limit state, the state is always written when the session closes
+RATE_LIMIT_SAVE_INTERVAL = 1.0
+
+#: Time in seconds to wait before sending a hedged request, when the latency of a mirror is still unknown.
+HEDGE_DELAY = 1.0
+
+# Latency in seconds that is recorded for a mirror when a request to it fails
+MIRROR_FAIL_LATENCY = 10.0
+
+# Min time in seconds between writes of the mirror stats, the stats are always written when the session closes
+MIRROR_STATS_SAVE_INTERVAL = 1.0
+
+#: Scheduler priority for requests that are needed right now, e.g. the visible listing.
+PRIORITY_HIGH = 0
+#: Scheduler priority for normal requests.
+PRIORITY_NORMAL = 10
+#: Scheduler priority for requests that can wait, e.g. prefetching.
+PRIORITY_LOW = 20
+
+#: List of callables that are called after each response with the arguments (request, response, elapsed seconds).
+#: Used for tracing/metrics, a hook must not raise any exceptions.
+request_hooks = []
+
 # Unique logger for this module
 logger = logging.getLogger("urlquick")
 
+# Matches a query string that is already fully urlencoded and ascii compatible
+_safe_query = re.compile(r"^(?:[A-Za-z0-9\-._~!$&'()*+,=:@/?]|%[0-9A-Fa-f]{2})*$").match
+
 
 class UrlError(IOError):
     """Base exception. All exceptions and errors will subclass from this."""
@@ -194,11 +242,15 @@ class CaseInsensitiveDict(MutableMapping):
     Credit goes to requests for this code
     http://docs.python-requests.org/en/master/
     """
+    __slots__ = ("_store",)
 
     def __init__(self, *args):
         self._store = {}
         for _dict in args:
-            if _dict:
+            if isinstance(_dict, CaseInsensitiveDict):
+                # Values are already validated, so the store can be copied directly
+                self._store.update(_dict._store)
+            elif _dict:
                 self.update(_dict)
 
     def __repr__(self):
@@ -206,8 +258,10 @@ class CaseInsensitiveDict(MutableMapping):
 
     def __setitem__(self, key, value):
         if value is not None:
-            key = make_unicode(key, "ascii")
-            value = make_unicode(value, "iso-8859-1")
+            if not isinstance(key, unicode):
+                key = make_unicode(key, "ascii")
+            if not isinstance(value, unicode):
+                value = make_unicode(value, "iso-8859-1")
             self._store[key.lower()] = (key, value)
 
     def __getitem__(self, key):
@@ -222,9 +276,15 @@ class CaseInsensitiveDict(MutableMapping):
     def __len__(self):
         return len(self._store)
 
+    def items(self):
+        """Return a list of (key, value) pairs, keeping the original case of the keys."""
+        return list(self._store.values())
+
     def copy(self):
         """Return a shallow copy of the case-insensitive dictionary."""
-        return CaseInsensitiveDict(self._store.values())
+        new = CaseInsensitiveDict()
+        new._store = self._store.copy()
+        return new
 
 
 class CachedProperty(object):
@@ -323,7 +383,7 @@ class CacheHandler(object):
             logger.debug("Found conditional header: Last-Modified = %s", cached_headers[u"Last-modified"])
             headers[u"If-modified-since"] = cached_headers[u"Last-Modified"]
 
-    def update(self, headers, body, status, reason, version=11, strict=True):
+    def update(self, headers, body, status, reason, version=11, strict=True, partial=False):
         # Convert headers into a Case Insensitive Dict
         headers = CaseInsensitiveDict(headers)
 
@@ -336,10 +396,27 @@ class CacheHandler(object):
         reason = unicode(reason)
 
         # Create response data structure
-        self.response = CacheResponse(headers, body, status, reason, version, strict)
+        self.response = CacheResponse(headers, body, status, reason, version, strict, partial)
 
         # Save response to disk
-        self._save(headers=dict(headers), body=body, status=status, reason=reason, version=version, strict=strict)
+        stored_body, compressed = self.compress(body, headers)
+        self._save(headers=dict(headers), body=stored_body, status=status, reason=reason,
+                   version=version, strict=strict, partial=partial, compressed=compressed)
+
+    @staticmethod
+    def compress(body, headers):
+        """
+        Compress the body using zlib, if the body is not already compressed.
+
+        :returns: Tuple of (body, compressed), where compressed is True if the body was compressed.
+        """
+        if (CACHE_COMPRESS_LEVEL and len(body) >= CACHE_COMPRESS_THRESHOLD
+                and headers.get(u"Content-Encoding", u"identity").lower() == u"identity"):
+            compressed_body = zlib.compress(body, CACHE_COMPRESS_LEVEL)
+            # Bodies like images are already compressed, so don't bother when there is little to gain
+            if len(compressed_body) < len(body) * 0.9:
+                return compressed_body, True
+        return body, False
 
     def _load(self):
         """Load the cache response that is stored on disk."""
@@ -358,6 +435,8 @@ class CacheHandler(object):
 
         # Decode body content using base64
         json_data[u"body"] = b64decode(json_data[u"body"].encode("ascii"))
+        if json_data.pop(u"compressed", False):
+            json_data[u"body"] = zlib.decompress(json_data[u"body"])
         json_data[u"headers"] = CaseInsensitiveDict(json_data[u"headers"])
         return CacheResponse(**json_data)
 
@@ -378,6 +457,45 @@ class CacheHandler(object):
             logger.exception("Cache Error: Failed to serialize response.")
             self.delete(self.cache_file)
 
+    @classmethod
+    def load_parsed(cls, body_hash, kind):
+        """
+        Load a parsed object, that was created from a response body with the given hash.
+
+        :param str body_hash: The sha1 hash of the response body.
+        :param str kind: The kind of parsed object e.g. "json".
+        :return: The parsed object or None if there is no usable parsed object.
+        """
+        parsed_file = os.path.join(cls.cache_dir(), cls.safe_path(u"cache-{}.{}".format(body_hash, kind)))
+        if os.path.exists(parsed_file):
+            try:
+                with open(parsed_file, "rb") as stream:
+                    data = stream.read()
+                return marshal.loads(data) if kind == u"json" else pickle.loads(data)
+            except Exception as e:
+                # Marshal data is not compatible between python versions, so just parse again
+                logger.debug("Cache Error: Failed to load parsed object: %s", e)
+                cls.delete(parsed_file)
+
+    @classmethod
+    def save_parsed(cls, body_hash, kind, obj):
+        """
+        Save a parsed object, so that the response body does not need to be parsed again.
+
+        :param str body_hash: The sha1 hash of the response body.
+        :param str kind: The kind of parsed object e.g. "json".
+        :param obj: The parsed object.
+        """
+        parsed_file = os.path.join(cls.cache_dir(), cls.safe_path(u"cache-{}.{}".format(body_hash, kind)))
+        try:
+            data = marshal.dumps(obj) if kind == u"json" else pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(parsed_file, "wb") as stream:
+                stream.write(data)
+        except Exception as e:
+            # Not all element trees can be pickled, e.g. cElementTree on python 2
+            logger.debug("Cache Error: Failed to save parsed object: %s", e)
+            cls.delete(parsed_file)
+
     @staticmethod
     def safe_path(path):
         """
@@ -416,8 +534,11 @@ class CacheHandler(object):
         return cls.safe_path(u"cache-{}".format(urlhash))
 
     @classmethod
-    def from_url(cls, url, data=None, max_age=MAX_AGE):
+    def from_url(cls, url, data=None, max_age=MAX_AGE, max_bytes=None):
         """Initialize CacheHandler with url instead of uid."""
+        if max_bytes:
+            # Partial responses are cached separately from the full response
+            url = u"{}#max_bytes={}".format(url, max_bytes)
         uid = cls.hash_url(url, data)
         return cls(uid, max_age)
 
@@ -432,18 +553,21 @@ class CacheAdapter(object):
     def __init__(self):
         self.__cache = None
 
-    def cache_check(self, method, url, data, headers, max_age=None):
+    def cache_check(self, method, url, data, headers, max_age=None, max_bytes=None):
         # Fetch max age from request header
         max_age = max_age if max_age is not None else int(headers.pop(u"x-max-age", MAX_AGE))
+        # Forget the cache of the previous request, so it can't be mistaken for the cache of this request
+        self.__cache = None
         if method == u"OPTIONS":
             return None
 
         # Check if cache exists first
-        self.__cache = cache = CacheHandler.from_url(url, data, max_age)
+        self.__cache = cache = CacheHandler.from_url(url, data, max_age, max_bytes)
         if cache:
             if method in ("PUT", "DELETE"):
                 logger.debug("Cache purged, %s request invalidates cache", method)
                 cache.delete(cache.cache_file)
+                self.__cache = None
 
             elif cache.isfresh():
                 logger.debug("Cache is fresh, returning cached response")
@@ -453,15 +577,20 @@ class CacheAdapter(object):
                 logger.debug("Cache is stale, checking for conditional headers")
                 cache.add_conditional_headers(headers)
 
-    def handle_response(self, method, status, callback):
-        if status == 304:
+    def stale_response(self):
+        """Return the stale cached response of the last cache check, if any."""
+        if self.__cache:
+            return self.__cache.response
+
+    def handle_response(self, method, status, callback, partial=False):
+        if status == 304 and self.__cache:
             logger.debug("Server return 304 Not Modified response, using cached response")
             callback()
             self.__cache.reset_timestamp()
             return self.__cache.response
 
-        # Cache any cachable response
-        elif status in CACHEABLE_CODES and method.upper() in CACHEABLE_METHODS:
+        # Cache any cachable response, partial content is only cachable when requested using max_bytes
+        elif (status in CACHEABLE_CODES or (partial and status == 206)) and method.upper() in CACHEABLE_METHODS:
             response = callback()
             logger.debug("Caching %s %s response", status, response[3])
 
@@ -473,14 +602,23 @@ class CacheAdapter(object):
 class CacheResponse(object):
     """A mock HTTPResponse class"""
 
-    def __init__(self, headers, body, status, reason, version=11, strict=True):
+    def __init__(self, headers, body, status, reason, version=11, strict=True, partial=False, body_hash=None):
         self.headers = headers
         self.status = status
         self.reason = reason
         self.version = version
         self.strict = strict
+        self.partial = partial
+        self._body_hash = body_hash
         self.body = body
 
+    @property
+    def body_hash(self):
+        """Sha1 hash of the body, used as the key for any parsed objects of this response. Computed on first use."""
+        if self._body_hash is None and self.body is not None:
+            self._body_hash = unicode(hashlib.sha1(self.body).hexdigest())
+        return self._body_hash
+
     def getheaders(self):
         """Return the response headers"""
         return self.headers
@@ -493,39 +631,672 @@ class CacheResponse(object):
         pass
 
 
+class _Buckets(object):
+    """The token bucket states of all hosts, shared by every rate limiter of the process."""
+
+    def __init__(self):
+        self.state = {}
+        self.path = None
+        self.mtime = None
+        self.dirty = False
+        self.saved = 0.0
+        # Reentrant, as the state is saved while the lock is held by acquire and penalize
+        self.lock = threading.RLock()
+
+
+_buckets = _Buckets()
+
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter, with limits set per host.
+
+    The state of each bucket is saved to disk, so that limits are honored across separate
+    plugin invocations. Each bucket refills at a rate of "rate" tokens per second,
+    up to a max of "burst" tokens. Every request to a limited host consumes one token.
+    Hosts that asked us to slow down are delayed, even if they have no configured limit.
+
+    The bucket states are shared by all limiters of the process, so the state file is only read once.
+    It's read again when it was changed by another process. The limiter can be shared between threads.
+
+    :param dict limits: [opt] Dictionary of host: rate or host: (rate, burst) pairs.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = {}
+        self._checked = False
+        self._lock = _buckets.lock
+        if limits:
+            for host, limit in limits.items():
+                if isinstance(limit, (tuple, list)):
+                    self.set_limit(host, *limit)
+                else:
+                    self.set_limit(host, limit)
+
+    def set_limit(self, host, rate, burst=None):
+        """
+        Set the rate limit for a host.
+
+        :param str host: The host to limit, e.g. "www.example.com".
+        :param float rate: Max number of requests per second. ``None`` or ``0`` will remove the limit.
+        :param int burst: [opt] Max number of requests that can be sent in a burst. Defaults to ``rate`` or ``1``.
+        """
+        host = make_unicode(host).lower()
+        if rate:
+            self.limits[host] = (float(rate), float(burst if burst else max(rate, 1)))
+        else:
+            self.limits.pop(host, None)
+
+    @staticmethod
+    def state_file():
+        """Returns the path to the file where the bucket states are stored."""
+        return CacheHandler.safe_path(os.path.join(CACHE_LOCATION, u"rate_limits.json"))
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _load(self):
+        """Load the bucket states from disk, unless they are already loaded and the file is unchanged."""
+        with self._lock:
+            path = self.state_file()
+            mtime = self._mtime(path)
+            # Unsaved changes are newer than the state file
+            if path == _buckets.path and (mtime == _buckets.mtime or _buckets.dirty):
+                return None
+
+            state = {}
+            if mtime is not None:
+                try:
+                    with _open(path, "rb", encoding="utf8") as stream:
+                        state = _json.load(stream)
+                except (IOError, OSError, ValueError):
+                    pass
+
+            if path != _buckets.path:
+                _buckets.saved = 0.0
+            _buckets.state = state
+            _buckets.path = path
+            _buckets.mtime = mtime
+            _buckets.dirty = False
+        self._checked = True
+
+    def save(self, force=True):
+        """
+        Save the bucket states to disk, if they changed since the last save.
+
+        :param bool force: [opt] Save even if the last save was less than
+                           :data:`RATE_LIMIT_SAVE_INTERVAL <urlquick.RATE_LIMIT_SAVE_INTERVAL>` seconds ago.
+        """
+        with self._lock:
+            if not _buckets.dirty or not (force or time.time() - _buckets.saved >= RATE_LIMIT_SAVE_INTERVAL):
+                return None
+
+            # Other threads can change the state while it's being written
+            state = dict(_buckets.state)
+            path = _buckets.path
+            _buckets.dirty = False
+            _buckets.saved = time.time()
+
+        try:
+            write_json(path, state)
+        except (IOError, OSError):
+            logger.exception("Rate Limit Error: Failed to save rate limit state.")
+        else:
+            # Our own writes don't need to be read back
+            with self._lock:
+                if _buckets.path == path:
+                    _buckets.mtime = self._mtime(path)
+
+    def acquire(self, host):
+        """
+        Consume a token for the given host, waiting for the bucket to refill if needed.
+
+        :param str host: The host that will be requested.
+        :returns: The time in seconds that was spent waiting.
+        :rtype: float
+        """
+        if not self._checked:
+            self._load()
+
+        # Hosts without a limit are only in the state when they asked us to slow down
+        limit = self.limits.get(host)
+        if limit is None and host not in _buckets.state:
+            return 0.0
+
+        with self._lock:
+            now = time.time()
+            if limit is None:
+                wait = self._penalty(host, now)
+            else:
+                rate, burst = limit
+                tokens, stamp = _buckets.state.get(host, (burst, now))
+
+                # Refill the bucket based on the time that has passed since the last request
+                tokens = min(burst, tokens + (now - stamp) * rate)
+                wait = (1 - tokens) / rate if tokens < 1 else 0.0
+
+                # The token is reserved before waiting, so other threads queue up behind this request
+                _buckets.state[host] = (tokens - 1, now)
+                _buckets.dirty = True
+            self.save(force=False)
+
+        if wait > 0:
+            logger.debug("Rate limit reached for '%s', waiting %.2f seconds", host, wait)
+            time.sleep(wait)
+        return wait
+
+    @staticmethod
+    def _penalty(host, now):
+        """Return the time left before a host without a limit can be requested again."""
+        state = _buckets.state.get(host)
+        if state is None:
+            return 0.0
+
+        wait = state[1] - now
+        if wait <= 0:
+            del _buckets.state[host]
+            _buckets.dirty = True
+            return 0.0
+        return wait
+
+    def penalize(self, host, delay):
+        """
+        Empty the bucket of the given host, so the next request will be delayed by the given number of seconds.
+
+        :param str host: The host that asked us to slow down.
+        :param float delay: Time in seconds to wait before the next request.
+        """
+        logger.debug("Server asked to slow down, delaying next request to '%s' by %.2f seconds", host, delay)
+        with self._lock:
+            if not self._checked:
+                self._load()
+
+            # One token becomes available once the delay has passed
+            _buckets.state[host] = (1.0, time.time() + delay)
+            _buckets.dirty = True
+            self.save()
+
+
+class MirrorStats(object):
+    """
+    Keeps track of the latency of mirrors, using a exponentially weighted moving average.
+
+    The average and mean deviation of the latency is calculated the same way as tcp calculates the round trip time.
+    The stats are saved to disk, so that the fastest mirror is known across separate plugin invocations.
+    """
+    alpha = 0.125
+    beta = 0.25
+
+    def __init__(self):
+        self._state = None
+        self._dirty = False
+        self._saved = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def state_file():
+        """Returns the path to the file where the mirror stats are stored."""
+        return CacheHandler.safe_path(os.path.join(CACHE_LOCATION, u"mirrors.json"))
+
+    def _load(self):
+        """Load the mirror stats from disk."""
+        try:
+            with _open(self.state_file(), "rb", encoding="utf8") as stream:
+                self._state = _json.load(stream)
+        except (IOError, OSError, ValueError):
+            self._state = {}
+
+    def save(self, force=True):
+        """
+        Save the mirror stats to disk, if they changed since the last save.
+
+        :param bool force: [opt] Save even if the last save was less than
+                           :data:`MIRROR_STATS_SAVE_INTERVAL <urlquick.MIRROR_STATS_SAVE_INTERVAL>` seconds ago.
+        """
+        with self._lock:
+            if not self._dirty or not (force or time.time() - self._saved >= MIRROR_STATS_SAVE_INTERVAL):
+                return None
+
+            state = dict(self._state)
+            self._dirty = False
+            self._saved = time.time()
+
+        try:
+            write_json(self.state_file(), state)
+        except (IOError, OSError):
+            logger.exception("Mirror Error: Failed to save mirror stats.")
+
+    def get(self, mirror):
+        """
+        Return the (average, deviation) latency of a mirror.
+
+        :param str mirror: The base url of the mirror.
+        :returns: Tuple of (average, deviation) in seconds, or None if the mirror has not been used yet.
+        """
+        with self._lock:
+            if self._state is None:
+                self._load()
+            return self._state.get(mirror)
+
+    def record(self, mirror, latency):
+        """
+        Add the latency of a request to the average of the mirror.
+
+        :param str mirror: The base url of the mirror.
+        :param float latency: Time in seconds it took for the mirror to respond.
+        """
+        with self._lock:
+            if self._state is None:
+                self._load()
+            stats = self._state.get(mirror)
+            if stats is None:
+                average, deviation = latency, latency / 2
+            else:
+                average, deviation = stats
+                deviation = (1 - self.beta) * deviation + self.beta * abs(average - latency)
+                average = (1 - self.alpha) * average + self.alpha * latency
+
+            self._state[mirror] = (average, deviation)
+            self._dirty = True
+        self.save(force=False)
+
+    def failed(self, mirror):
+        """Record a failed request to the mirror, pushing it down the ranking."""
+        self.record(mirror, MIRROR_FAIL_LATENCY)
+
+    def ranked(self, mirrors):
+        """
+        Return the mirrors sorted from fastest to slowest.
+        Mirrors that have not been used yet are tried first, so that there latency gets known.
+
+        :param list mirrors: List of mirror base urls.
+        :rtype: list
+        """
+        return sorted(mirrors, key=lambda mirror: (self.get(mirror) or (0.0, 0.0))[0])
+
+    def hedge_delay(self, mirror):
+        """
+        Return the time to wait for the mirror before sending a hedged request to the next mirror.
+        This is the latency that the mirror will rarely exceed, i.e. the average plus four times the deviation.
+
+        :param str mirror: The base url of the mirror.
+        :rtype: float
+        """
+        stats = self.get(mirror)
+        if stats is None:
+            return HEDGE_DELAY
+        return stats[0] + 4 * stats[1]
+
+
+class CookieJar(dict):
+    """
+    Store of the cookies sent back by servers, that is persisted to disk under a given name.
+
+    Cookies are stored along with there domain, path and secure flag, and are only sent with requests
+    to matching urls. Cookies with an expiry time, like a login session, will survive between plugin invocations,
+    while session cookies are only kept in memory. Expired cookies are discarded when the jar is loaded.
+
+    The jar maps (domain, path, name) keys to (value, expires, secure, host_only) tuples.
+
+    :param str name: Name of the jar, used to create the filename.
+    """
+
+    def __init__(self, name):
+        super(CookieJar, self).__init__()
+        self.name = make_unicode(name)
+        self._lock = threading.Lock()
+        self.load()
+
+    def path(self):
+        """Returns the path to the file where the cookies are stored."""
+        filename = u"cookies-{}.json".format(re.sub(r"[^\w.-]", u"_", self.name))
+        return CacheHandler.safe_path(os.path.join(CACHE_LOCATION, filename))
+
+    def load(self):
+        """Load the cookies from disk, discarding expired cookies."""
+        try:
+            with _open(self.path(), "rb", encoding="utf8") as stream:
+                data = _json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+
+        now = time.time()
+        for cookie in data:
+            try:
+                domain, path, name, value, expires, secure, host_only = cookie
+            except (TypeError, ValueError):
+                # Not a cookie that was saved by this version of the jar
+                continue
+            if expires is not None and expires > now:
+                self[(domain, path, name)] = (value, expires, secure, host_only)
+
+    def save(self):
+        """Save the cookies that have an expiry time to disk, the file is replaced in one step."""
+        with self._lock:
+            data = [list(key) + list(cookie) for key, cookie in self.items() if cookie[1] is not None]
+        try:
+            write_json(self.path(), data)
+        except (IOError, OSError):
+            logger.exception("Cookie Error: Failed to save cookies to disk.")
+
+    def extract(self, req, headers):
+        """
+        Update the jar with the cookies from the "Set-Cookie" response headers.
+
+        :param Request req: The request that the response belongs to.
+        :param headers: List of (key, value) header pairs.
+        :returns: True if any cookie was changed, else False.
+        :rtype: bool
+        """
+        changed = persist = False
+        now = time.time()
+        # noinspection PyProtectedMember
+        urlparts = req._urlparts
+        host = urlparts.hostname.lower()
+        for key, value in headers:
+            if key.lower() != "set-cookie":
+                continue
+
+            if not py3 and isinstance(value, unicode):
+                value = value.encode("iso-8859-1")
+
+            cookiejar = SimpleCookie(value)
+            for cookie in cookiejar.values():
+                domain = make_unicode(cookie["domain"]).lower().lstrip(u".")
+                if not domain:
+                    domain, host_only = host, True
+                elif self.domain_match(host, domain, False):
+                    host_only = False
+                else:
+                    # Servers can only set cookies for there own domain
+                    continue
+
+                path = make_unicode(cookie["path"])
+                if not path.startswith(u"/"):
+                    path = self.default_path(urlparts.path)
+
+                key = (domain, path, make_unicode(cookie.key))
+                expires = self._expiry(cookie, now)
+                with self._lock:
+                    old = self.get(key)
+                    if expires is not None and expires <= now:
+                        # The server is asking us to delete the cookie
+                        if old is not None:
+                            del self[key]
+                            changed = True
+                            persist |= old[1] is not None
+                    else:
+                        entry = (make_unicode(cookie.value), expires, bool(cookie["secure"]), host_only)
+                        if old != entry:
+                            self[key] = entry
+                            changed = True
+                            persist |= expires is not None or (old is not None and old[1] is not None)
+
+        # Session cookies are not saved, so there is no need to write to disk when only they change
+        if persist:
+            self.save()
+        return changed
+
+    def matching(self, req):
+        """
+        Returns the name and value of the cookies that should be sent with the request.
+
+        :param Request req: The request to match the cookies against.
+        :rtype: dict
+        """
+        # noinspection PyProtectedMember
+        urlparts = req._urlparts
+        host = urlparts.hostname.lower()
+        path = urlparts.path or u"/"
+        secure = urlparts.scheme == u"https"
+        now = time.time()
+        with self._lock:
+            items = list(self.items())
+
+        # Cookies with a more specific path take precedence over cookies with the same name
+        items.sort(key=lambda item: len(item[0][1]))
+        cookies = {}
+        for (domain, cookie_path, name), (value, expires, secure_only, host_only) in items:
+            if ((expires is None or expires > now) and (secure or not secure_only) and
+                    self.domain_match(host, domain, host_only) and self.path_match(path, cookie_path)):
+                cookies[name] = value
+        return cookies
+
+    @staticmethod
+    def domain_match(host, domain, host_only):
+        """Returns True if cookies of the domain should be sent to the host."""
+        return host == domain or (not host_only and host.endswith(u"." + domain))
+
+    @staticmethod
+    def path_match(path, cookie_path):
+        """Returns True if cookies of the cookie path should be sent with requests for the path."""
+        return path == cookie_path or (path.startswith(cookie_path) and (
+            cookie_path.endswith(u"/") or path[len(cookie_path)] == u"/"))
+
+    @staticmethod
+    def default_path(path):
+        """Returns the path of the cookie if the server did not set one, i.e. the directory of the request path."""
+        if not path.startswith(u"/") or path.count(u"/") == 1:
+            return u"/"
+        return path[:path.rindex(u"/")]
+
+    @staticmethod
+    def _expiry(cookie, now):
+        """Returns the time the cookie expires, or None if it's a session cookie."""
+        if cookie["max-age"]:
+            try:
+                return now + int(cookie["max-age"])
+            except ValueError:
+                pass
+        if cookie["expires"]:
+            date = parsedate_tz(cookie["expires"])
+            if date:
+                return mktime_tz(date)
+        return None
+
+
+class TLSConnection(HTTPSConnection):
+    """
+    HTTPS connection that shares a ssl context between connections and resumes previous tls sessions.
+
+    Reconnecting to a host that we already have a tls session for, skips the full handshake.
+    Only http/1.1 is advertised during alpn negotiation as that is the only protocol we speak.
+    """
+    _contexts = {}
+
+    def __init__(self, host, timeout, verify=True, tls_session=None):
+        super(TLSConnection, self).__init__(host, timeout=timeout, context=self.get_context(verify))
+        self.tls_session = tls_session
+
+    @classmethod
+    def get_context(cls, verify=True):
+        """Return the shared ssl context for given verify mode, creating it on first use."""
+        verify = verify is not False
+        try:
+            return cls._contexts[verify]
+        except KeyError:
+            # noinspection PyProtectedMember
+            context = ssl.create_default_context() if verify else ssl._create_unverified_context()
+            if getattr(ssl, "HAS_ALPN", False):
+                context.set_alpn_protocols(["http/1.1"])
+            cls._contexts[verify] = context
+            return context
+
+    def connect(self):
+        if self.tls_session is None or not hasattr(ssl.SSLSocket, "session"):
+            return super(TLSConnection, self).connect()
+
+        HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host if self._tunnel_host else self.host
+        try:
+            self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname,
+                                                  session=self.tls_session)
+        except ssl.SSLError:
+            # Server refused to resume the session, fallback to a full handshake
+            self.tls_session = None
+            self.sock.close()
+            return self.connect()
+
+    def close(self):
+        # Hold on to the tls session, as the socket is closed as soon as a 'Connection: close' response is received
+        self.tls_session = self.session
+        super(TLSConnection, self).close()
+
+    @property
+    def session(self):
+        """The tls session of the active or last connection, if any."""
+        return getattr(self.sock, "session", None) or self.tls_session
+
+
 class ConnectionManager(CacheAdapter):
     def __init__(self):
         self.request_handler = {"http": {}, "https": {}}
+        self.tls_sessions = {}
+        self.rate_limiter = RateLimiter()
+        self.cookie_jar = None
+        self.network_time = 0.0
+        self.aborted = False
+        # Every connection that was opened, including connections that are not pooled, so they can be aborted
+        self._connections = weakref.WeakSet()
         super(ConnectionManager, self).__init__()
 
-    def make_request(self, req, timeout, verify, max_age):
+    def throttle(self, req, resp):
+        """Delay further requests to the host if the response indicates that we are sending to many requests."""
+        if resp.status in THROTTLE_CODES:
+            retry_after = resp.getheader("Retry-After") if hasattr(resp, "getheader") else None
+            try:
+                delay = float(retry_after) if retry_after else 1.0
+            except ValueError:
+                # Retry-After can also be a http date, which we don't support
+                delay = 1.0
+            self.rate_limiter.penalize(req.host, delay)
+
+    def make_request(self, req, timeout, verify, max_age, max_bytes=None, deadline=None):
         # Only check cache if max_age set to a valid value
         if max_age >= 0:
-            cached_resp = self.cache_check(req.method, req.url, req.data, req.headers, max_age=max_age)
+            cached_resp = self.cache_check(req.method, req.url, req.data, req.headers, max_age, max_bytes)
             if cached_resp:
                 return cached_resp
 
             def callback():
-                return resp.getheaders(), resp.read(), resp.status, resp.reason
+                return resp.getheaders(), resp.read(), resp.status, resp.reason, 11, True, partial
 
             # Request resource and cache it if possible
-            resp = self.connect(req, timeout, verify)
-            cached_resp = self.handle_response(req.method, resp.status, callback)
+            try:
+                resp = self.fetch(req, timeout, verify, max_bytes, deadline)
+            except Timeout:
+                # A stale response is better than no response at all
+                resp = self.stale_response()
+                if resp is None:
+                    raise
+                logger.debug("Request timed out, returning stale cached response")
+                return resp
+
+            partial = getattr(resp, "partial", False)
+            cached_resp = self.handle_response(req.method, resp.status, callback, bool(max_bytes))
             if cached_resp:
                 return cached_resp
             else:
                 return resp
 
         # Default to un-cached response
-        return self.connect(req, timeout, verify)
+        return self.fetch(req, timeout, verify, max_bytes, deadline)
+
+    def fetch(self, req, timeout, verify, max_bytes=None, deadline=None):
+        """
+        Request the remote resource, reading no more than max_bytes of the body if given.
+        The body is read before returning when a deadline is given, so that the deadline covers the body read.
+        """
+        self.rate_limiter.acquire(req.host)
+        timeout = self.timeouts(timeout, deadline)
+        start = time.time()
+        resp = self.connect(req, timeout, verify)
+        self.network_time += time.time() - start
+        self.throttle(req, resp)
+        if self.cookie_jar is not None:
+            self.cookie_jar.extract(req, resp.getheaders())
+        if max_bytes or deadline:
+            return self.read_partial(req, resp, max_bytes, deadline)
+        else:
+            return resp
+
+    @staticmethod
+    def timeouts(timeout, deadline=None):
+        """
+        Return the (connect, read) timeouts, capped to the time that is left before the deadline.
+
+        :raises Timeout: If the deadline has already passed.
+        """
+        connect, read = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise Timeout("Request deadline exceeded")
+            connect = remaining if connect is None else min(connect, remaining)
+            read = remaining if read is None else min(read, remaining)
+        return connect, read
+
+    def read_partial(self, req, resp, max_bytes=None, deadline=None):
+        """
+        Read the response body in chunks and return it as a cached response,
+        stopping after max_bytes have been read or when the deadline has passed.
+        """
+        # Read one extra byte so we can tell if the body was truncated
+        limit = max_bytes + 1 if max_bytes else None
+        # read1 returns as soon as any data is available, so a slow server can't hold up the deadline check
+        read = getattr(resp, "read1", resp.read)
+        chunks = []
+        size = 0
+        try:
+            while limit is None or size < limit:
+                if deadline is not None and time.time() >= deadline:
+                    self.drop(req, resp)
+                    raise Timeout("Request deadline exceeded while reading response body")
+
+                chunk = read(CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit - size))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+
+        except socket.timeout as e:
+            self.drop(req, resp)
+            raise Timeout(e)
+
+        body = b"".join(chunks)
+        truncated = max_bytes is not None and size > max_bytes
+        partial = resp.status == 206 or truncated
+
+        if truncated:
+            # The remainder of the body is unwanted, so the connection can't be reused
+            self.drop(req, resp)
+        else:
+            # The whole body was read, so the connection can be reused
+            resp.close()
+
+        return CacheResponse(resp.getheaders(), body[:max_bytes], resp.status, resp.reason, partial=partial)
+
+    def drop(self, req, resp):
+        """Close the response and remove its connection from the pool, as it can't be reused."""
+        resp.close()
+        pool = self.request_handler[req.type]
+        if req.host in pool:
+            pool.pop(req.host).close()
 
     def connect(self, req, timeout, verify):
+        if self.aborted:
+            raise ConnError("Request aborted")
+
         # Fetch connection from pool and attempt to reuse if available
         pool = self.request_handler[req.type]
         if req.host in pool:
             try:
                 # noinspection PyTypeChecker
-                return self.send_request(pool[req.host], req)
+                return self.send_request(pool[req.host], req, timeout)
             except Exception as e:
                 # Remove the connection from the pool as it's unusable
                 pool[req.host].close()
@@ -537,14 +1308,17 @@ class ConnectionManager(CacheAdapter):
 
         # Create a new connection
         if req.type == "https":
-            # noinspection PyProtectedMember
-            context = ssl._create_unverified_context() if verify is False else None
-            conn = HTTPSConnection(req.host, timeout=timeout, context=context)
+            conn = TLSConnection(req.host, timeout[0], verify, self.tls_sessions.get((req.host, verify is not False)))
         else:
-            conn = HTTPConnection(req.host, timeout=timeout)
+            conn = HTTPConnection(req.host, timeout=timeout[0])
 
         # Make first connection to server
-        response = self.send_request(conn, req)
+        self._connections.add(conn)
+        response = self.send_request(conn, req, timeout)
+
+        # Keep the tls session so later connections to the same host can resume it
+        if req.type == "https" and conn.session is not None:
+            self.tls_sessions[(req.host, verify is not False)] = conn.session
 
         # Add connection to the pool if the response is not set to close
         if not response.will_close:
@@ -552,8 +1326,15 @@ class ConnectionManager(CacheAdapter):
         return response
 
     @staticmethod
-    def send_request(conn, req):
+    def send_request(conn, req, timeout=None):
         try:
+            # Connect using the connect timeout, then switch to the read timeout
+            if timeout is not None:
+                if conn.sock is None:
+                    conn.timeout = timeout[0]
+                    conn.connect()
+                conn.sock.settimeout(timeout[1])
+
             # Setup request
             conn.putrequest(str(req.method), str(req.selector), skip_host=1, skip_accept_encoding=1)
 
@@ -576,11 +1357,29 @@ class ConnectionManager(CacheAdapter):
 
     def close(self):
         """Close all persistent connections and remove."""
+        self.rate_limiter.save()
         for pool in self.request_handler.values():
             for key in list(pool.keys()):
                 conn = pool.pop(key)
                 conn.close()
 
+    def abort(self):
+        """
+        Abort the requests that are in progress from another thread.
+
+        The sockets are shutdown, so a blocking read returns straight away, any further request will raise
+        ConnError. The connections are not closed, that is left to the thread that is using them.
+        """
+        self.aborted = True
+        for conn in list(self._connections):
+            sock = conn.sock
+            if sock is not None:
+                try:
+                    # The ssl wrapper is bypassed, so the tls state of the reading thread is left alone
+                    socket.socket.shutdown(sock, socket.SHUT_RDWR)
+                except (socket.error, OSError):
+                    pass
+
 
 class Request(object):
     """A Request Object"""
@@ -682,22 +1481,29 @@ class Request(object):
             else:
                 auth = (auth, u"")
 
-        return auth, netloc.encode("idna").decode("ascii")
+        try:
+            # The idna codec is slow, so skip it when the host is already ascii
+            netloc.encode("ascii")
+        except UnicodeEncodeError:
+            netloc = netloc.encode("idna").decode("ascii")
+        return auth, netloc
 
     @staticmethod
     def _ascii_path(path):
         """Make sure that path is url encoded and ascii compatible."""
         try:
             # If this statement passes then path must contain only ascii characters
-            return path.encode("ascii").decode("ascii")
+            path.encode("ascii")
         except UnicodeEncodeError:
             # Path must contain non ascii characters
             return quote(path)
+        else:
+            return path
 
     @staticmethod
     def _ascii_query(query, params):
         """Make sure that query is urlencoded and ascii compatible."""
-        if query:
+        if query and not _safe_query(query):
             # Ensure that query contains only valid characters
             qsl = parse_qsl(query, keep_blank_values=True)
             query = urlencode(qsl)
@@ -729,8 +1535,7 @@ class Request(object):
 
     def _py2_header_items(self):
         """Return request headers with no unicode value to be compatible with python2"""
-        # noinspection PyCompatibility
-        for key, value in self.headers.iteritems():
+        for key, value in self.headers.items():
             key = key.encode("ascii")
             value = value.encode("iso-8859-1")
             yield key, value
@@ -749,6 +1554,26 @@ class UnicodeDict(dict):
                         self[key] = value
 
 
+def write_json(path, data):
+    """
+    Write data to path as json. The file is replaced in one step so it's never left half written.
+
+    :raises IOError: If the file could not be written.
+    """
+    suffix = u".{}.tmp".format(os.getpid())
+    tmp_path = path + suffix if isinstance(path, unicode) else path + suffix.encode("ascii")
+    with _open(tmp_path, "wb", encoding="utf8") as stream:
+        _json.dump(data, stream, separators=(",", ":"))
+
+    if hasattr(os, "replace"):
+        os.replace(tmp_path, path)
+    else:
+        # Windows under python2 is not able to rename over a existing file
+        if os.path.exists(path) and sys.platform.startswith("win"):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+
 def make_unicode(data, encoding="utf8", errors=""):
     """Ensure that data is a unicode string"""
     if isinstance(data, bytes):
@@ -773,6 +1598,18 @@ class Session(ConnectionManager):
     :ivar bool raise_for_status: Raise HTTPError if status code is > 400. Defaults to ``False``
     :ivar int max_age: Max age the cache can be, before it’s considered stale. -1 will disable caching.
                        Defaults to :data:`MAX_AGE <urlquick.MAX_AGE>`
+    :ivar dict rate_limits: Dictionary of host: rate or host: (rate, burst) pairs, where rate is the max number
+                            of requests per second. Limits are honored across separate plugin invocations.
+    :ivar bool parse_cache: Store the objects returned by json(), xml() and parse() alongside the cache,
+                            so cached responses don't need to be decoded and parsed again. Defaults to ``False``
+    :ivar bool memory_lean: Keep only one copy of the response body in memory, e.g. the compressed body is
+                            released once inflated. See :class:`Response <urlquick.Response>`. Defaults to ``False``
+    :ivar str name: Name of a persistent cookie jar. When given, cookies sent back by the server are stored in
+                    the jar and sent with requests to matching urls. Cookies with an expiry time are saved to disk,
+                    so that they survive between plugin invocations.
+                    See :class:`CookieJar <urlquick.CookieJar>`. Defaults to ``None``
+    :ivar float deadline: Max time in seconds a request can take in total, including redirects and reading
+                          the response body. Defaults to ``None``
     """
     # This is here so the kodi related code can change
     # this value to True for a better kodi expereance.
@@ -790,7 +1627,10 @@ class Session(ConnectionManager):
 
         # Session Controls
         self._cm = ConnectionManager()
+        self.name = kwargs.get("name")
         self._cookies = dict()
+        if self.name:
+            self.cookie_jar = CookieJar(self.name)
         self._params = dict()
         self._auth = None
 
@@ -800,6 +1640,21 @@ class Session(ConnectionManager):
         self.max_redirects = kwargs.get("max_redirects", 10)
         self.allow_redirects = kwargs.get("allow_redirects", True)
         self.raise_for_status = kwargs.get("raise_for_status", self.default_raise_for_status)
+        self.rate_limiter = RateLimiter(kwargs.get("rate_limits"))
+        self.parse_cache = kwargs.get("parse_cache", False)
+        self.memory_lean = kwargs.get("memory_lean", False)
+        self.deadline = kwargs.get("deadline")
+        self.mirror_stats = MirrorStats()
+
+    def rate_limit(self, host, rate, burst=None):
+        """
+        Limit the number of requests per second that can be sent to a host.
+
+        :param str host: The host to limit, e.g. "www.example.com".
+        :param float rate: Max number of requests per second. ``None`` or ``0`` will remove the limit.
+        :param int burst: [opt] Max number of requests that can be sent in a burst. Defaults to ``rate``.
+        """
+        self.rate_limiter.set_limit(host, rate, burst)
 
     @property
     def auth(self):
@@ -952,8 +1807,9 @@ class Session(ConnectionManager):
         """
         return self.request(u"DELETE", url, **kwargs)
 
-    def request(self, method, url, params=None, data=None, headers=None, cookies=None, auth=None,
-                timeout=10, allow_redirects=None, verify=True, json=None, raise_for_status=None, max_age=None):
+    def request(self, method, url, params=None, data=None, headers=None, cookies=None, auth=None, timeout=10,
+                allow_redirects=None, verify=True, json=None, raise_for_status=None, max_age=None, max_bytes=None,
+                deadline=None, mirrors=None, hedge=False):
         """
         Make request for remote resource.
 
@@ -964,13 +1820,22 @@ class Session(ConnectionManager):
         :param dict headers: [opt] HTTP request headers.
         :param dict cookies: [opt] Dictionary of cookies to send with the request.
         :param tuple auth: [opt] (username, password) for basic authentication.
-        :param int timeout: [opt] Connection timeout in seconds.
+        :param timeout: [opt] Timeout in seconds, or a (connect, read) tuple of timeouts.
         :param bool allow_redirects: [opt] Enable/disable redirection. Defaults to ``True``.
         :param bool verify: [opt] Controls whether to verify the server's TLS certificate. Defaults to ``True``
         :param json: [opt] Json data sent in the body of the Request.
         :param bool raise_for_status: [opt] Raise's HTTPError if status code is > 400. Defaults to ``False``.
         :param int max_age: [opt] Age the 'cache' can be, before it’s considered stale. -1 will disable caching.
                             Defaults to :data:`MAX_AGE <urlquick.MAX_AGE>`
+        :param int max_bytes: [opt] Only fetch the first max_bytes of the response body. A "Range" header is used
+                              when possible, else the connection is closed once max_bytes have been read.
+        :param float deadline: [opt] Max time in seconds the request can take in total, including redirects
+                               and reading the response body. A stale cached response is returned, if available,
+                               when the request times out.
+        :param list mirrors: [opt] List of base urls that serve the same resources. The url is joined with
+                             the fastest mirror, falling back to the next mirror if the request fails.
+        :param bool hedge: [opt] Send a duplicate request to the next mirror when the fastest mirror takes longer
+                           than usual to respond. The first response wins. Defaults to ``False``.
 
         :return: A requests like Response object.
         :rtype: urlquick.Response
@@ -979,27 +1844,41 @@ class Session(ConnectionManager):
         :raises ConnError: If connection to server failed.
         :raises HTTPError: If response status is greater or equal to 400 and raise_for_status is ``True``.
         :raises SSLError: If an SSL error occurs while sending the request.
-        :raises Timeout: If the connection to server timed out.
+        :raises Timeout: If the connection to server timed out or the deadline has passed.
         """
+        if mirrors:
+            args = (params, data, headers, cookies, auth, timeout, allow_redirects, verify, json,
+                    raise_for_status, max_age, max_bytes, deadline)
+            if hedge and len(mirrors) > 1:
+                return self._hedged_request(method, url, mirrors, args)
+            else:
+                return self._mirror_request(method, url, mirrors, args)
+
         # Fetch settings from local or session
         allow_redirects = self.allow_redirects if allow_redirects is None else allow_redirects
         raise_for_status = self.raise_for_status if raise_for_status is None else raise_for_status
 
         # Ensure that all mappings of unicode data
         req_headers = CaseInsensitiveDict(self._headers, headers)
-        req_cookies = UnicodeDict(self._cookies, cookies)
-        req_params = UnicodeDict(self._params, params)
+        req_cookies = UnicodeDict(self._cookies, cookies) if self._cookies or cookies else None
+        req_params = UnicodeDict(self._params, params) if self._params or params else None
 
-        # Add cookies to headers
-        if req_cookies and u"Cookie" not in req_headers:
-            header = u"; ".join([u"{}={}".format(key, value) for key, value in req_cookies.items()])
-            req_headers[u"Cookie"] = header
+        add_cookies = u"Cookie" not in req_headers
+        # Ask the server for only the first part of the resource
+        if max_bytes and method.upper() == u"GET" and u"Range" not in req_headers:
+            req_headers[u"Range"] = u"bytes=0-{}".format(max_bytes - 1)
 
         # Fetch max age of cache
         max_age = (-1 if self.max_age is None else self.max_age) if max_age is None else max_age
 
+        # The deadline covers the whole request, including redirects
+        deadline = self.deadline if deadline is None else deadline
+        deadline = time.time() + deadline if deadline else None
+
         # Parse url into it's individual components including params if given
         req = Request(method, url, req_headers, data, json, req_params)
+        if add_cookies:
+            self._add_cookies(req, req_cookies)
         logger.debug("Requesting resource: %s", req.url)
         logger.debug("Request headers: %s", req.headers)
         if data:
@@ -1018,8 +1897,11 @@ class Session(ConnectionManager):
 
         while True:
             # Send a request for resource
-            raw_resp = self.make_request(req, timeout, verify, max_age)
-            resp = Response(raw_resp, req, start_time, history[:])
+            request_time = time.time()
+            raw_resp = self.make_request(req, timeout, verify, max_age, max_bytes, deadline)
+            resp = Response(raw_resp, req, start_time, history[:], self.parse_cache, self.memory_lean)
+            for hook in request_hooks:
+                hook(req, resp, time.time() - request_time)
 
             visited[req.url] += 1
             # Process the response
@@ -1036,6 +1918,11 @@ class Session(ConnectionManager):
                     req = Request(req.method, location, req_headers, req.data, referer=req.url)
                 else:
                     req = Request(u"GET", location, req_headers, referer=req.url)
+
+                # The redirect can be to another host, and cookies set during a redirect, e.g. a login,
+                # are needed by the next request
+                if add_cookies:
+                    self._add_cookies(req, req_cookies)
                 logger.debug("Redirecting to = %s", unquote(req.url))
 
             # And Authorization Credentials if needed
@@ -1057,6 +1944,141 @@ class Session(ConnectionManager):
     def __exit__(self, *args):
         self.close()
 
+    def close(self):
+        """Close all persistent connections and save the rate limit state and mirror stats."""
+        self.mirror_stats.save()
+        super(Session, self).close()
+
+    def _mirror_request(self, method, url, mirrors, args):
+        """Send the request to the fastest mirror, trying the next mirror if the request fails."""
+        error = resp = None
+        for mirror in self.mirror_stats.ranked(mirrors):
+            self.network_time = 0.0
+            try:
+                resp = self.request(method, urljoin(mirror, url), *args)
+            except (ConnError, Timeout, HTTPError) as e:
+                # Client errors will be the same on every mirror
+                if isinstance(e, HTTPError) and e.code < 500:
+                    raise
+                logger.debug("Mirror '%s' failed: %s", mirror, e)
+                self.mirror_stats.failed(mirror)
+                error = e
+                continue
+
+            if resp.status_code >= 500:
+                logger.debug("Mirror '%s' failed with status: %s", mirror, resp.status_code)
+                self.mirror_stats.failed(mirror)
+            else:
+                # Cached responses tell us nothing about the latency of the mirror
+                if self.network_time:
+                    self.mirror_stats.record(mirror, self.network_time)
+                return resp
+
+        # All mirrors failed
+        if resp is not None:
+            return resp
+        raise error
+
+    def _hedged_request(self, method, url, mirrors, args):
+        """
+        Send the request to the fastest mirror, and a duplicate request to the next mirror if the first mirror
+        is slower than usual. Each request is sent from a separate thread using its own session.
+        The request that loses the race is aborted, by shutting down the connection of its session.
+        """
+        results = Queue()
+        started = {}
+        sessions = {}
+        ranked = self.mirror_stats.ranked(mirrors)
+        delay = self.mirror_stats.hedge_delay(ranked[0])
+
+        def worker(mirror, session):
+            resp = error = None
+            latency = 0.0
+            try:
+                with session:
+                    resp = session.request(method, urljoin(mirror, url), *args)
+                    latency = session.network_time
+            except Exception as e:
+                error = e
+            finally:
+                # Always report back, else the main thread would wait on the queue forever
+                results.put((mirror, resp, error, latency))
+
+        def send_next():
+            mirror = ranked.pop(0)
+            started[mirror] = time.time()
+            sessions[mirror] = session = self._fork()
+            thread = threading.Thread(target=worker, args=(mirror, session))
+            thread.daemon = True
+            thread.start()
+
+        send_next()
+        pending = 1
+        error = resp = None
+        try:
+            while pending:
+                try:
+                    # Only hedge once, and only if there is a mirror left to hedge with
+                    mirror, resp, error, latency = results.get(timeout=delay if ranked else None)
+                except Empty:
+                    logger.debug("Mirror is slower than %.2f seconds, sending hedged request", delay)
+                    delay = None
+                    send_next()
+                    pending += 1
+                    continue
+
+                pending -= 1
+                del started[mirror]
+                if isinstance(error, HTTPError) and error.code < 500:
+                    raise error
+                elif resp is not None and resp.status_code < 500:
+                    if latency:
+                        self.mirror_stats.record(mirror, latency)
+
+                    # The mirrors that lost the race took at least this long
+                    for slow_mirror, start in started.items():
+                        self.mirror_stats.record(slow_mirror, time.time() - start)
+                    return resp
+
+                logger.debug("Mirror '%s' failed: %s", mirror, error if resp is None else resp.status_code)
+                self.mirror_stats.failed(mirror)
+                if ranked:
+                    send_next()
+                    pending += 1
+        finally:
+            # The requests that are still running lost the race, they must not outlive this request
+            for mirror in started:
+                sessions[mirror].abort()
+
+        # All mirrors failed
+        if resp is not None:
+            return resp
+        raise error
+
+    def _fork(self):
+        """Return a new session with the same configuration, so requests can be sent from another thread."""
+        session = Session(max_age=self.max_age, max_repeats=self.max_repeats, max_redirects=self.max_redirects,
+                          allow_redirects=self.allow_redirects, raise_for_status=self.raise_for_status,
+                          parse_cache=self.parse_cache, memory_lean=self.memory_lean, deadline=self.deadline)
+        session._headers = self._headers.copy()
+        session._cookies = dict(self._cookies)
+        session._params = dict(self._params)
+        session._auth = self._auth
+        session.rate_limiter = self.rate_limiter
+        session.cookie_jar = self.cookie_jar
+        return session
+
+    def _add_cookies(self, req, cookies):
+        """Set the cookie header of the request, using the matching cookies from the jar and the given cookies."""
+        if self.cookie_jar is not None:
+            cookies = UnicodeDict(self.cookie_jar.matching(req), cookies)
+        if cookies:
+            req.headers[u"Cookie"] = self._cookie_header(cookies)
+
+    @staticmethod
+    def _cookie_header(cookies):
+        return u"; ".join([u"{}={}".format(key, value) for key, value in cookies.items()])
+
     @staticmethod
     def _auth_header(username, password):
         # Ensure that username & password is of type bytes
@@ -1072,13 +2094,27 @@ class Session(ConnectionManager):
 
 
 class Response(object):
-    """A Response object containing all data returned from the server."""
+    """
+    A Response object containing all data returned from the server.
+
+    When memory_lean is enabled, only one copy of the body is kept at any time.
+    The compressed body is released once inflated, the bytes are released once decoded into text,
+    the body of the :attr:`raw <urlquick.Response.raw>` response is released and
+    :meth:`iter_content <urlquick.Response.iter_content>` will return memoryview objects instead of bytes.
+    """
 
     # noinspection PyArgumentList
-    def __init__(self, response, org_request, start_time, history):
+    def __init__(self, response, org_request, start_time, history, parse_cache=False, memory_lean=False):
         #: The default encoding, used when no encoding is given.
         self.apparent_encoding = "utf8"
 
+        # Only keep one copy of the body in memory if True
+        self._lean = memory_lean
+        self._text_encoding = None
+
+        # Hash of the body when the response is cached, only set if parsed objects are to be cached
+        self._body_hash = getattr(response, "body_hash", None) if parse_cache else None
+
         #: File-like object representation of response (for advanced usage).
         self.raw = response
 
@@ -1102,9 +2138,14 @@ class Response(object):
         #: Textual reason of response HTTP Status e.g. “Not Found” or “OK”.
         self.reason = unicode(response.reason)
 
+        #: ``True`` if only part of the content body was returned, e.g. when using max_bytes.
+        self.partial = getattr(response, "partial", False) or response.status == 206
+
         # Fetch content body
         self._body = response.read()
         response.close()
+        if memory_lean and isinstance(response, CacheResponse):
+            response.body = None
 
         # Fetch response headers and convert to CaseInsensitiveDict if needed
         headers = response.getheaders()
@@ -1134,6 +2175,10 @@ class Response(object):
 
         :raises ContentError: If content failes to decompress.
         """
+        # Body is released after decoding when in memory lean mode
+        if self._body is None:
+            return self.text.encode(self._text_encoding)
+
         # Check if Response need to be decoded, else return raw response
         content_encoding = self._headers.get(u"content-encoding", u"").lower()
         if u"gzip" in content_encoding:
@@ -1146,10 +2191,14 @@ class Response(object):
             return self._body
 
         try:
-            return decoder.decompress(self._body)
+            content = decoder.decompress(self._body)
         except (IOError, zlib.error) as e:
             raise ContentError("Failed to decompress content body: {}".format(e))
 
+        if self._lean:
+            self._body = None
+        return content
+
     @CachedProperty
     def text(self):
         """
@@ -1159,9 +2208,18 @@ class Response(object):
         Will fallback to :data:`apparent_encoding <urlquick.Response.apparent_encoding>`
         if no encoding was given within headers.
         """
+        text, self._text_encoding = self._decode(self.content)
+        if self._lean:
+            # Only the text is kept, content can be recreated from the text if ever needed again
+            del self.content
+            self._body = None
+        return text
+
+    def _decode(self, content):
+        """Decode content using the best available encoding, returns a tuple of (text, encoding)."""
         if self.encoding:
             try:
-                return self.content.decode(self.encoding)
+                return content.decode(self.encoding), self.encoding
             except UnicodeDecodeError:
                 logger.debug("Failed to decode content with given encoding: '%s'", self.encoding)
 
@@ -1169,14 +2227,14 @@ class Response(object):
         if apparent_encoding and not (self.encoding and getencoder(self.encoding) == getencoder(apparent_encoding)):
             logger.debug("Attempting to decode with default encoding: '%s'", self.apparent_encoding)
             try:
-                return self.content.decode(apparent_encoding)
+                return content.decode(apparent_encoding), apparent_encoding
             except UnicodeDecodeError:
                 logger.debug("Failed to decode content with default encoding: %s, "
                              "switching to fallback encoding: 'iso-8859-1'", apparent_encoding)
         else:
             logger.debug("Attempting to decode with fallback encoding: 'iso-8859-1'")
 
-        return self.content.decode("iso-8859-1")
+        return content.decode("iso-8859-1"), "iso-8859-1"
 
     @CachedProperty
     def cookies(self):
@@ -1250,6 +2308,19 @@ class Response(object):
         """
         return self.status_code < 400
 
+    def _parsed(self, kind, parser):
+        """Return the parsed object from the parse cache if available, else parse the body and cache the result."""
+        if self._body_hash is None:
+            return parser()
+
+        obj = CacheHandler.load_parsed(self._body_hash, kind)
+        if obj is None:
+            obj = parser()
+            CacheHandler.save_parsed(self._body_hash, kind, obj)
+        else:
+            logger.debug("Using cached parsed object: %s", kind)
+        return obj
+
     def json(self, **kwargs):
         """
         Returns the json-encoded content of a response.
@@ -1257,6 +2328,26 @@ class Response(object):
         :param kwargs: [opt] Arguments that :func:`json.loads` takes.
         :raises ValueError: If the response body does not contain valid json.
         """
+        if kwargs:
+            # Custom decoding options can't be keyed, so skip the parse cache
+            return self._json_loads(**kwargs)
+        else:
+            return self._parsed(u"json", self._json_loads)
+
+    def _json_loads(self, **kwargs):
+        """Decode json, directly from bytes when possible, to avoid creating a decoded copy of the content."""
+        if u"text" not in self.__dict__:
+            try:
+                utf8 = self.encoding is None or _lookup_codec(self.encoding).name == "utf-8"
+            except LookupError:
+                utf8 = False
+
+            if utf8:
+                try:
+                    return _json.loads(self.content, **kwargs)
+                except UnicodeDecodeError:
+                    logger.debug("Failed to decode json directly from bytes, falling back to text")
+
         return _json.loads(self.text, **kwargs)
 
     def xml(self):
@@ -1267,7 +2358,7 @@ class Response(object):
         :rtype: xml.etree.ElementTree.Element
         """
         from xml.etree import ElementTree
-        return ElementTree.fromstring(self.content)
+        return self._parsed(u"xml", lambda: ElementTree.fromstring(self.content))
 
     def parse(self, tag=u"", attrs=None):
         """
@@ -1293,9 +2384,18 @@ class Response(object):
         except ImportError:
             raise MissingDependency("Missing optional dependency named 'HTMLement'")
         else:
-            parser = HTMLement(unicode(tag), attrs)
-            parser.feed(self.text)
-            return parser.close()
+            def parse():
+                parser = HTMLement(unicode(tag), attrs)
+                parser.feed(self.text)
+                return parser.close()
+
+            if tag or attrs:
+                # The filter is part of the key, as it changes the resulting tree
+                key = _json.dumps([tag, attrs], sort_keys=True).encode("utf8")
+                kind = u"html-{}".format(hashlib.sha1(key).hexdigest()[:10])
+            else:
+                kind = u"html"
+            return self._parsed(kind, parse)
 
     def iter_content(self, chunk_size=512, decode_unicode=False):
         """
@@ -1307,7 +2407,14 @@ class Response(object):
         :param bool decode_unicode: [opt] ``True`` to return unicode, else ``False`` to return bytes.
                                     (default=``False``)
         """
-        content = self.text if decode_unicode else self.content
+        if decode_unicode:
+            content = self.text
+        elif self._lean:
+            # Slices of a memoryview share the memory of the content, so no copies are made
+            content = memoryview(self.content)
+        else:
+            content = self.content
+
         prevnl = 0
         while True:
             chucknl = prevnl + chunk_size
@@ -1376,8 +2483,63 @@ class Response(object):
         return "<Response [{}]>".format(self.status_code)
 
 
-def request(method, url, params=None, data=None, headers=None, cookies=None, auth=None,
-            timeout=10, allow_redirects=None, verify=True, json=None, raise_for_status=None, max_age=None):
+class Scheduler(object):
+    """
+    Queue of requests that will be sent in order of priority.
+
+    Requests with the lowest priority value are sent first, requests with the same
+    priority are sent in the order they were added. This allows requests that are needed
+    for the visible listing to be sent before any prefetch requests, while any rate limits
+    that are set on the session are still honored.
+
+    :param session: [opt] The :class:`Session <urlquick.Session>` used to send the requests.
+
+    :example:
+        >>> scheduler = Scheduler(session)
+        >>> scheduler.add(u"GET", "https://www.example.com/prefetch", priority=PRIORITY_LOW)
+        >>> scheduler.add(u"GET", "https://www.example.com/videos", priority=PRIORITY_HIGH)
+        >>> prefetch, videos = scheduler.run()
+    """
+
+    def __init__(self, session=None):
+        self.session = session if session is not None else Session()
+        self._queue = []
+
+    def add(self, method, url, priority=PRIORITY_NORMAL, callback=None, **kwargs):
+        """
+        Add a request to the queue.
+
+        :param str method: HTTP request method, GET, HEAD, POST.
+        :param str url: Url of the remote resource.
+        :param int priority: [opt] Priority of the request, lower values are sent first.
+                             Defaults to :data:`PRIORITY_NORMAL <urlquick.PRIORITY_NORMAL>`
+        :param callback: [opt] Function that will be called with the response, as soon as it's available.
+        :param kwargs: Optional arguments that :func:`request <urlquick.request>` takes.
+        """
+        self._queue.append((priority, len(self._queue), method, url, callback, kwargs))
+
+    def run(self):
+        """
+        Send all queued requests in order of priority.
+
+        :return: List of Response objects, in the same order as the requests were added.
+        :rtype: list
+        """
+        queue, self._queue = self._queue, []
+        results = [None] * len(queue)
+        for _, index, method, url, callback, kwargs in sorted(queue, key=lambda item: item[:2]):
+            resp = results[index] = self.session.request(method, url, **kwargs)
+            if callback is not None:
+                callback(resp)
+        return results
+
+    def __len__(self):
+        return len(self._queue)
+
+
+def request(method, url, params=None, data=None, headers=None, cookies=None, auth=None, timeout=10,
+            allow_redirects=None, verify=True, json=None, raise_for_status=None, max_age=None, max_bytes=None,
+            deadline=None, mirrors=None, hedge=False):
     """
     Make request for remote resource.
 
@@ -1388,13 +2550,22 @@ def request(method, url, params=None, data=None, headers=None, cookies=None, aut
     :param dict headers: [opt] HTTP request headers.
     :param dict cookies: [opt] Dictionary of cookies to send with the request.
     :param tuple auth: [opt] (username, password) for basic authentication.
-    :param int timeout: [opt] Connection timeout in seconds.
+    :param timeout: [opt] Timeout in seconds, or a (connect, read) tuple of timeouts.
     :param bool allow_redirects: [opt] Enable/disable redirection. Defaults to ``True``.
     :param bool verify: [opt] Controls whether to verify the server's TLS certificate. Defaults to ``True``
     :param json: [opt] Json data sent in the body of the Request.
     :param bool raise_for_status: [opt] Raise's HTTPError if status code is > 400. Defaults to ``False``.
     :param int max_age: [opt] Age the 'cache' can be, before it’s considered stale. -1 will disable caching.
                         Defaults to :data:`MAX_AGE <urlquick.MAX_AGE>`
+    :param int max_bytes: [opt] Only fetch the first max_bytes of the response body. A "Range" header is used
+                          when possible, else the connection is closed once max_bytes have been read.
+    :param float deadline: [opt] Max time in seconds the request can take in total, including redirects
+                           and reading the response body. A stale cached response is returned, if available,
+                           when the request times out.
+    :param list mirrors: [opt] List of base urls that serve the same resources. The url is joined with
+                         the fastest mirror, falling back to the next mirror if the request fails.
+    :param bool hedge: [opt] Send a duplicate request to the next mirror when the fastest mirror takes longer
+                       than usual to respond. The first response wins. Defaults to ``False``.
 
     :return: A requests like Response object.
     :rtype: urlquick.Response
@@ -1403,11 +2574,11 @@ def request(method, url, params=None, data=None, headers=None, cookies=None, aut
     :raises ConnError: If connection to server failed.
     :raises HTTPError: If response status is greater or equal to 400 and raise_for_status is ``True``.
     :raises SSLError: If an SSL error occurs while sending the request.
-    :raises Timeout: If the connection to server timed out.
+    :raises Timeout: If the connection to server timed out or the deadline has passed.
     """
     with Session() as session:
-        return session.request(method, url, params, data, headers, cookies, auth, timeout,
-                               allow_redirects, verify, json, raise_for_status, max_age)
+        return session.request(method, url, params, data, headers, cookies, auth, timeout, allow_redirects, verify,
+                               json, raise_for_status, max_age, max_bytes, deadline, mirrors, hedge)
 
 
 def get(url, params=None, **kwargs):
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of full plugin invocations, driven through ``support.run`` like kodi would.
+
+Run from the repository root, using the same kodi mock environment as the unit tests::
+
+    python -m tests.benchmark                 # run all benchmarks and compare against the baseline
+    python -m tests.benchmark listing_1000    # only run the given benchmarks
+    python -m tests.benchmark --save          # store the results as the new baseline
+    python -m tests.benchmark --record        # record the youtube fixtures, requires network access
+
+The urlquick benchmarks send their requests to a local http server, that runs within the benchmark process.
+The youtube benchmarks replay the api responses stored in ``tests/fixtures/youtube.json``.
+
+Each benchmark is timed over a number of runs, the fastest run is reported as it is the least affected
+by noise. Time spent in each phase of the dispatch pipeline is taken from the trace spans. Memory is
+measured in a separate run with tracemalloc enabled, as tracemalloc slows down execution. The reported
+allocations are the net memory allocated within each phase and the peak memory of the whole invocation.
+
+The exit status is 1 if a benchmark is slower, or uses more memory, than the baseline allows.
+Timings are machine dependent, so the baseline should be saved on the machine that checks it.
+"""
+from __future__ import print_function, division
+
+# Standard Library Imports
+from collections import defaultdict
+import argparse
+import copy
+import gc
+import json
+import threading
+import zlib
+import sys
+import os
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+try:
+    from urllib.parse import urlencode
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # pragma: no cover
+    # noinspection PyUnresolvedReferences
+    from urllib import urlencode
+    # noinspection PyUnresolvedReferences
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+# Package imports
+from codequick import Route, Resolver, Listitem, youtube, tracing
+from codequick.profiler import profile_dir
+from codequick.search import SavedSearches
+from codequick.support import dispatcher, build_path
+import urlquick
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "youtube.json")
+
+# Allowed slowdown, or increase in peak memory, compared to the baseline
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+
+# Slowdowns smaller than this, in milliseconds, are considered to be noise
+TIME_MIN_DELTA = 2.0
+
+# Id of the youtube channel that is used for the youtube benchmarks
+YOUTUBE_CHANNEL = "UCaWd5_7JhbQBe4dknZhsHJg"
+
+GENRES = ["Comedy", "Drama", "Documentary", "News", "Sport"]
+
+# Base url of the local http server used by the urlquick benchmarks, set by start_server
+SERVER_URL = None
+
+
+def synthetic_item(index):
+    """Create a listitem with varied info, art, context and params."""
+    item = Listitem()
+    item.label = u"Episode {} - The Title of the Episode".format(index)
+    item.info["plot"] = u"Plot of episode {}. ".format(index) * 5
+    item.info["duration"] = u"{}:{:02d}".format(20 + index % 40, index % 60)
+    item.info["genre"] = GENRES[index % len(GENRES)]
+    item.info["episode"] = index
+    item.info.date(u"2018-{:02d}-{:02d}".format(index % 12 + 1, index % 28 + 1), "%Y-%m-%d")
+    item.art["thumb"] = u"https://example.com/images/{}/thumb.jpg".format(index)
+    item.art["fanart"] = u"https://example.com/images/fanart.jpg"
+    if index % 3 == 0:
+        item.art.local_thumb("videos.png")
+    if index % 2 == 0:
+        item.context.related(listing, page=index)
+    item.context.container(listing, u"More like this", count=10, page=index)
+    if index % 5 == 0:
+        item.set_callback(listing, count=10, page=index, show=u"benchmark")
+    else:
+        item.set_callback(play_video, url=u"https://example.com/videos/{}.mp4".format(index))
+    return item
+
+
+@Route.register
+def listing(_, count, page=1, show=None):
+    for index in range(count):
+        yield synthetic_item(index)
+    yield Listitem.next_page(count=count, page=page + 1)
+
+
+def scraped_rows(count):
+    """Rows of data like a scraper would produce, for comparing from_dict with bulk."""
+    return [{"title": u"Episode {}".format(index),
+             "url": u"https://example.com/videos/{}.mp4".format(index),
+             "thumb": u"https://example.com/images/{}/thumb.jpg".format(index),
+             "plot": u"Plot of episode {}. ".format(index) * 5,
+             "duration": u"{}:{:02d}".format(20 + index % 40, index % 60),
+             "genre": GENRES[index % len(GENRES)],
+             "episode": str(index),
+             "rating": u"{:.1f}".format(index % 10)} for index in range(count)]
+
+
+@Route.register
+def from_dict_listing(_, count):
+    for row in scraped_rows(count):
+        yield Listitem.from_dict(play_video, row["title"], params={"url": row["url"]}, art={"thumb": row["thumb"]},
+                                 info={"plot": row["plot"], "duration": row["duration"], "genre": row["genre"],
+                                       "episode": row["episode"], "rating": row["rating"]})
+
+
+@Route.register
+def bulk_listing(_, count):
+    mapping = {"label": "title", "params.url": "url", "art.thumb": "thumb", "info.plot": "plot",
+               "info.duration": "duration", "info.genre": "genre", "info.episode": "episode", "info.rating": "rating"}
+    return Listitem.bulk(play_video, scraped_rows(count), mapping)
+
+
+@Route.register
+def shared_params_listing(_, count):
+    """Episodes of one show, that all link to a resolver with the same show details."""
+    show = {"show_id": 1234, "channel": 7, "season": 2, "cast": [u"Actor {}".format(index) for index in range(8)],
+            "studio": u"Benchmark Studios", "genres": GENRES}
+    for index in range(count):
+        item = Listitem()
+        item.label = u"Episode {}".format(index)
+        item.set_callback(play_episode, url=u"https://example.com/videos/{}.mp4".format(index), show=show)
+        yield item
+
+
+@Resolver.register
+def play_episode(_, url, show):
+    return url
+
+
+@Route.register
+def search_results(_, search_query):
+    for index in range(50):
+        item = synthetic_item(index)
+        item.label = u"{} {}".format(search_query, item.label)
+        yield item
+
+
+@Route.register
+def delayed_callbacks(plugin, count):
+    def callback(index, exception=None):
+        return index
+
+    for index in range(count):
+        plugin.register_delayed(callback, index, function_type=2)
+    return [synthetic_item(index) for index in range(10)]
+
+
+@Resolver.register
+def play_video(_, url):
+    return url
+
+
+@Resolver.register
+def playlist(_, count):
+    return [u"https://example.com/videos/{}.mp4".format(index) for index in range(count)]
+
+
+@Route.register
+def urlquick_build(_, count):
+    """Construct requests without sending them, like the session does before every request."""
+    session_headers = urlquick.CaseInsensitiveDict({u"Accept": u"*/*", u"Accept-Encoding": u"gzip, deflate",
+                                                    u"Connection": u"keep-alive"})
+    for index in range(count):
+        headers = urlquick.CaseInsensitiveDict(session_headers, {u"Referer": u"https://www.example.com/"})
+        urlquick.Request(u"GET", u"https://www.example.com/videos/{}?sort=date&page=1".format(index), headers,
+                         params={u"show": u"benchmark", u"index": index})
+    return [synthetic_item(index) for index in range(10)]
+
+
+@Route.register
+def urlquick_requests(_, count, cached=False):
+    """Fetch a json page for every listitem from the local server, over one keep-alive connection."""
+    with urlquick.Session(max_age=urlquick.MAX_AGE if cached else -1) as session:
+        for index in range(count):
+            data = session.get(u"{}/page/{}".format(SERVER_URL, index), params={u"show": u"benchmark"}).json()
+            item = synthetic_item(index)
+            item.label = data["title"]
+            yield item
+
+
+@Route.register
+def urlquick_json(_, count, lean=False):
+    """Scrape a large gzipped json document, to compare the peak memory of memory_lean mode."""
+    with urlquick.Session(max_age=-1, memory_lean=lean) as session:
+        resp = session.get(u"{}/json/{}".format(SERVER_URL, count))
+        # Scrapers often search the text before parsing it, while the response is still referenced
+        data = json.loads(resp.text) if u"Episode" in resp.text else []
+    for entry in data[:100]:
+        item = synthetic_item(entry["id"])
+        item.label = entry["title"]
+        yield item
+
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+    """Serve the json pages of the urlquick benchmarks."""
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this every response waits on a delayed ack
+    disable_nagle_algorithm = True
+    bodies = {}
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        try:
+            body = self.bodies[path]
+        except KeyError:
+            kind, index = path.strip("/").split("/")
+            if kind == "json":
+                data = [{"id": i, "title": u"Episode {}".format(i), "plot": u"Plot of episode {}. ".format(i) * 5}
+                        for i in range(int(index))]
+            else:
+                data = {"id": int(index), "title": u"Episode {}".format(index)}
+            body = json.dumps(data).encode("utf8")
+            if kind == "json":
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                body = compressor.compress(body) + compressor.flush()
+            self.bodies[path] = body
+
+        self.send_response(200)
+        if path.startswith("/json/"):
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    """Start the local http server in a background thread."""
+    global SERVER_URL
+    server = HTTPServer(("127.0.0.1", 0), BenchmarkHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    SERVER_URL = "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def fixture_key(url, query):
+    """
+    Return the key of the youtube fixture for the given request, without the api key.
+
+    The youtube module requests video ids in set order, which changes between runs, so the ids are sorted.
+    """
+    query = [(key, ",".join(sorted(value.split(","))) if key == "id" else value)
+             for key, value in query.items() if key != "key"]
+    return u"{}?{}".format(url, urlencode(sorted(query)))
+
+
+def load_fixtures():  # type: () -> dict
+    """Load the recorded youtube fixtures and patch the youtube API to use them, returns None if not recorded."""
+    if not os.path.exists(FIXTURES):
+        return None
+
+    with open(FIXTURES) as stream:
+        fixtures = json.load(stream)
+
+    # The youtube module modifies the responses, so a copy is returned every time
+    def replay(_, url, query):
+        return copy.deepcopy(fixtures[fixture_key(url, query)])
+
+    youtube.API._request = replay
+    return fixtures
+
+
+def record_fixtures():
+    """Record the youtube api responses that are needed by the youtube benchmarks."""
+    fixtures = {}
+    org_request = youtube.API._request
+
+    def record(self, url, query):
+        response = org_request(self, url, query)
+        fixtures[fixture_key(url, query)] = copy.deepcopy(response)
+        return response
+
+    youtube.API._request = record
+    try:
+        for name, url in benchmark_urls().items():
+            if name.startswith("youtube"):
+                clean_youtube()
+                invoke(url)
+    finally:
+        youtube.API._request = org_request
+
+    if not os.path.exists(os.path.dirname(FIXTURES)):
+        os.makedirs(os.path.dirname(FIXTURES))
+    with open(FIXTURES, "w") as stream:
+        json.dump(fixtures, stream, indent=1, sort_keys=True)
+    print("Recorded {} responses to {}".format(len(fixtures), FIXTURES))
+
+
+def clean_youtube():
+    """Remove the youtube cache, so every run fetches the same data."""
+    if os.path.exists(youtube.CACHEFILE):
+        os.remove(youtube.CACHEFILE)
+
+
+BENCHMARKS = {
+    "listing_10": lambda: build_path(listing, count=10),
+    "listing_100": lambda: build_path(listing, count=100),
+    "listing_1000": lambda: build_path(listing, count=1000),
+    "listing_5000": lambda: build_path(listing, count=5000),
+    "from_dict_1000": lambda: build_path(from_dict_listing, count=1000),
+    "bulk_1000": lambda: build_path(bulk_listing, count=1000),
+    "shared_params_1000": lambda: build_path(shared_params_listing, count=1000),
+    "delayed_100": lambda: build_path(delayed_callbacks, count=100),
+    "resolver_playlist": lambda: build_path(playlist, count=100),
+    "urlquick_build_1000": lambda: build_path(urlquick_build, count=1000),
+    "urlquick_requests_100": lambda: build_path(urlquick_requests, count=100),
+    "urlquick_cached_100": lambda: build_path(urlquick_requests, count=100, cached=True),
+    "urlquick_json": lambda: build_path(urlquick_json, count=20000),
+    "urlquick_json_lean": lambda: build_path(urlquick_json, count=20000, lean=True),
+    "search": lambda: build_path(SavedSearches, _route=search_results.route.path, search=True),
+    "youtube_playlist": lambda: build_path(youtube.Playlist, contentid=YOUTUBE_CHANNEL),
+    "youtube_playlists": lambda: build_path(youtube.Playlists, channel_id=YOUTUBE_CHANNEL),
+}
+
+
+def benchmark_urls():  # type: () -> dict
+    """
+    Return the plugin url of every benchmark.
+
+    The urls are built before any invocation, as build_path includes the params of the current invocation.
+    """
+    return {name: make_url() for name, make_url in BENCHMARKS.items()}
+
+
+def invoke(url):  # type: (str) -> None
+    """Invoke the add-on with the given plugin url, like kodi would."""
+    base, _, query = url.partition("?")
+    org_argv = sys.argv
+    sys.argv = [base, "1", "?" + query if query else ""]
+    try:
+        dispatcher.run_callback(process_errors=False)
+    finally:
+        sys.argv = org_argv
+
+
+def read_spans(filepath):  # type: (str) -> dict
+    """Return the total time, and allocations, of each span in the trace file. Removing the trace file."""
+    phases = defaultdict(lambda: {"ms": 0.0})
+    with open(filepath) as stream:
+        for line in stream:
+            record = json.loads(line)
+            phase = phases[record["span"]]
+            phase["ms"] += record["ms"]
+            if "alloc_kb" in record:
+                phase["alloc_kb"] = phase.get("alloc_kb", 0.0) + record["alloc_kb"]
+    os.remove(filepath)
+    return phases
+
+
+def run_benchmark(url, runs):  # type: (str, int) -> dict
+    """Run the benchmark and return the results."""
+    trace_file = os.path.join(profile_dir(), u"_trace.jsonl")
+    if os.path.exists(trace_file):
+        os.remove(trace_file)
+
+    # Warm up, so imports and route registration are not included
+    clean_youtube()
+    invoke(url)
+    os.remove(trace_file)
+
+    wall_times = []
+    phase_times = defaultdict(list)
+    for _ in range(runs):
+        clean_youtube()
+        # Garbage collection is disabled while timing, like timeit does, so collections don't add noise
+        gc.collect()
+        gc.disable()
+        try:
+            start = tracing.timer()
+            invoke(url)
+            wall_times.append((tracing.timer() - start) * 1000)
+        finally:
+            gc.enable()
+        for phase, data in read_spans(trace_file).items():
+            phase_times[phase].append(data["ms"])
+
+    result = {"wall_ms": round(min(wall_times), 2),
+              "phases": {phase: {"ms": round(min(times), 2)} for phase, times in phase_times.items()}}
+
+    if tracemalloc is not None:
+        clean_youtube()
+        tracemalloc.start()
+        try:
+            invoke(url)
+            result["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024.0, 1)
+        finally:
+            tracemalloc.stop()
+        for phase, data in read_spans(trace_file).items():
+            if "alloc_kb" in data:
+                result["phases"].setdefault(phase, {})["alloc_kb"] = round(data["alloc_kb"], 1)
+    return result
+
+
+def compare(name, result, baseline):  # type: (str, dict, dict) -> list
+    """Return a list of regressions of the result compared to the baseline."""
+    regressions = []
+    if name not in baseline:
+        return regressions
+
+    base = baseline[name]
+    if result["wall_ms"] > max(base["wall_ms"] * (1 + TIME_TOLERANCE), base["wall_ms"] + TIME_MIN_DELTA):
+        regressions.append("{}: wall time {:.2f}ms, baseline {:.2f}ms".format(
+            name, result["wall_ms"], base["wall_ms"]))
+    if "peak_kb" in result and "peak_kb" in base and result["peak_kb"] > base["peak_kb"] * (1 + MEMORY_TOLERANCE):
+        regressions.append("{}: peak memory {:.1f}KiB, baseline {:.1f}KiB".format(
+            name, result["peak_kb"], base["peak_kb"]))
+    return regressions
+
+
+def report(name, result, baseline):  # type: (str, dict, dict) -> None
+    """Print the results of the benchmark."""
+    base = baseline.get(name, {})
+    change = ""
+    if "wall_ms" in base:
+        change = " ({:+.1f}%)".format((result["wall_ms"] / base["wall_ms"] - 1) * 100)
+    print("{}: {:.2f}ms{}, peak {}KiB".format(name, result["wall_ms"], change, result.get("peak_kb", "n/a")))
+    for phase, data in sorted(result["phases"].items()):
+        alloc = "{:>10.1f}KiB".format(data["alloc_kb"]) if "alloc_kb" in data else ""
+        print("    {:<20} {:>10.2f}ms {}".format(phase, data.get("ms", 0.0), alloc))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark full plugin invocations.")
+    parser.add_argument("benchmarks", nargs="*", help="Names of the benchmarks to run, defaults to all.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of timed runs per benchmark.")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline.")
+    parser.add_argument("--record", action="store_true", help="Record the youtube fixtures.")
+    args = parser.parse_args(args)
+
+    os.environ[tracing.ENV_TRACING] = "true"
+    if args.record:
+        return record_fixtures()
+
+    urls = benchmark_urls()
+    names = args.benchmarks or sorted(urls)
+    if any(name.startswith("urlquick") for name in names):
+        start_server()
+    if load_fixtures() is None:
+        skipped = [name for name in names if name.startswith("youtube")]
+        if skipped:
+            print("Skipping {}, no youtube fixtures recorded".format(", ".join(skipped)))
+        names = [name for name in names if name not in skipped]
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as stream:
+            baseline = json.load(stream)
+
+    results = {}
+    regressions = []
+    for name in names:
+        results[name] = result = run_benchmark(urls[name], args.runs)
+        report(name, result, baseline)
+        regressions.extend(compare(name, result, baseline))
+
+    if args.save:
+        baseline.update(results)
+        with open(BASELINE, "w") as stream:
+            json.dump(baseline, stream, indent=2, sort_keys=True)
+        print("Baseline saved to {}".format(BASELINE))
+    elif regressions:
+        print("\nRegressions:")
+        print("\n".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
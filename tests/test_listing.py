@@ -1,8 +1,9 @@
 import unittest
 
 from codequick import listing, route, resolver
-from codequick.support import dispatcher
+from codequick.support import dispatcher, auto_sort
 from codequick.utils import unicode_type
+import xbmcplugin
 import xbmcgui
 import xbmc
 import sys
@@ -164,6 +165,26 @@ class Info(Params):
         self.assertEqual(self.base["aired"], "2017-06-27")
         self.assertEqual(self.base["year"], "2017")
 
+    def test_date_iso(self):
+        self.base.date("2017-06-27", "%Y-%m-%d")
+        self.assertEqual(self.base["date"], "27.06.2017")
+        self.assertEqual(self.base["aired"], "2017-06-27")
+        self.assertEqual(self.base["year"], "2017")
+
+    def test_parse_date(self):
+        self.assertEqual(listing.parse_date("Jun 27, 17", "%b %d, %y"), ("27.06.2017", "2017-06-27", "2017"))
+        self.assertEqual(listing.parse_date("27/06/70", "%d/%m/%y"), ("27.06.1970", "1970-06-27", "1970"))
+        self.assertEqual(listing.parse_date("2017-06-27T18:30:00", "%Y-%m-%dT%H:%M:%S"),
+                         ("27.06.2017", "2017-06-27", "2017"))
+        # Fallback to strptime
+        self.assertEqual(listing.parse_date("178 2017", "%j %Y"), ("27.06.2017", "2017-06-27", "2017"))
+
+    def test_parse_date_invalid(self):
+        for date, date_format in (("2017-02-30", "%Y-%m-%d"), ("2017-06-27T18:30", "%Y-%m-%d"),
+                                  ("27 juin 2017", "%d %B %Y"), ("31/02/17", "%d/%m/%y")):
+            with self.assertRaises(ValueError):
+                listing.parse_date(date, date_format)
+
     def test_close(self):
         self.base["plot"] = "plot"
         self.base._close("video")
@@ -302,7 +323,7 @@ class Context(unittest.TestCase):
 
         self.assertEqual(label, "test label")
         self.assertTrue(command.startswith("XBMC.Container.Update(plugin://script.module.codequick/"
-                                           "tests/test_listing/test_callback/?_pickle_="))
+                                           "tests/test_listing/test_callback/?_params_="))
 
     def test_script(self):
         self.base.script(self.test_callback, "test label")
@@ -318,27 +339,15 @@ class Context(unittest.TestCase):
 
         self.assertEqual(label, "test label")
         self.assertTrue(command.startswith("XBMC.RunPlugin(plugin://script.module.codequick/"
-                                           "tests/test_listing/test_callback/?_pickle_="))
+                                           "tests/test_listing/test_callback/?_params_="))
 
-    @unittest.skipIf(PY3, "only work under python 2")
-    def test_related_py2(self):
+    def test_related(self):
         self.base.related(self.test_callback)
         label, command = self.base[0]
 
         self.assertEqual(label, "Related Videos")
         self.assertEqual(command, "XBMC.Container.Update(plugin://script.module.codequick/tests/test_listing/"
-                                  "test_callback/?_pickle_=80027d710055075f7469746c655f7101580e00000052656c61"
-                                  "74656420566964656f737102732e)")
-
-    @unittest.skipUnless(PY3, "only work under python 3")
-    def test_related_py3(self):
-        self.base.related(self.test_callback)
-        label, command = self.base[0]
-
-        self.assertEqual(label, "Related Videos")
-        self.assertEqual(command, "XBMC.Container.Update(plugin://script.module.codequick/tests/test_listing/"
-                                  "test_callback/?_pickle_=8004951f000000000000007d948c075f7469746c655f948c0e"
-                                  "52656c6174656420566964656f7394732e)")
+                                  "test_callback/?_title_=Related+Videos)")
 
     def test_related_with_params(self):
         self.base.related(self.test_callback, test=True)
@@ -346,7 +355,7 @@ class Context(unittest.TestCase):
 
         self.assertEqual(label, "Related Videos")
         self.assertTrue(command.startswith("XBMC.Container.Update(plugin://script.module.codequick/"
-                                           "tests/test_listing/test_callback/?_pickle_="))
+                                           "tests/test_listing/test_callback/?_params_="))
 
     def test_close(self):
         self.base.related(self.test_callback)
@@ -416,9 +425,28 @@ class TestListitem(unittest.TestCase):
     def test_close_route_params(self):
         self.listitem.set_callback(self.route_callback, "yes", full=True)
         path, raw_listitem, isfolder = self.listitem._close()
-        self.assertTrue(path.startswith("plugin://script.module.codequick/tests/test_listing/route_callback/?_pickle_="))
+        base_url = "plugin://script.module.codequick/tests/test_listing/route_callback/"
+        self.assertTrue(path.startswith(base_url + "?_params_="))
         self.assertTrue(isfolder)
 
+    def test_close_route_args(self):
+        self.listitem.set_callback(self.route_callback_args, "yes")
+        path, raw_listitem, isfolder = self.listitem._close()
+        self.assertEqual(path, "plugin://script.module.codequick/tests/test_listing/route_callback_args/?test=yes")
+
+    def test_close_independent_path(self):
+        def close(index):
+            item = listing.Listitem()
+            item.label = "item"
+            item.set_callback(self.route_callback_args, "yes", page=index, data={"show": 1})
+            return item._close()[0]
+
+        # The path of a listitem must not depend on the other listitems of the listing
+        alone = close(1)
+        self.assertListEqual([close(index) for index in range(3)][1:2], [alone])
+        self.assertEqual(alone, "plugin://script.module.codequick/tests/test_listing/route_callback_args/"
+                                "?_params_=jeyJkYXRhIjp7InNob3ciOjF9LCJwYWdlIjoxfQ&_title_=item&test=yes")
+
     def test_close_resolver(self):
         self.listitem.set_callback(self.resolver_callback)
         path, raw_listitem, isfolder = self.listitem._close()
@@ -438,6 +466,98 @@ class TestListitem(unittest.TestCase):
         self.assertEqual(path, "http://example.com/video.mkv")
         self.assertFalse(isfolder)
 
+    def test_lazy_attributes(self):
+        self.listitem.label = "test label"
+        self.listitem.set_callback("http://example.com/video.mkv")
+        self.assertIsNone(self.listitem._stream)
+        self.assertIsNone(self.listitem._property)
+        self.assertIsNone(self.listitem._listitem)
+
+        path, raw_listitem, isfolder = self.listitem._close()
+        self.assertIs(raw_listitem, self.listitem.listitem)
+        self.assertEqual(raw_listitem.getLabel(), "test label")
+        self.assertIsNone(self.listitem._stream)
+
+    def test_lazy_attribute_set(self):
+        info = listing.Info()
+        self.listitem.info = info
+        self.assertIs(self.listitem.info, info)
+        self.assertIsInstance(listing.Listitem.info, listing.LazyAttribute)
+
+    def test_slots(self):
+        for params in (self.listitem.info, self.listitem.art, self.listitem.stream, self.listitem.property):
+            self.assertFalse(hasattr(params, "__dict__"))
+            self.assertIsInstance(params, listing.MutableMapping)
+        with self.assertRaises(AttributeError):
+            self.listitem.info.unknown = True
+
+    def test_custom_attribute(self):
+        self.listitem.custom = True
+        self.assertTrue(self.listitem.custom)
+
+    def test_label_kodi_listitem(self):
+        self.listitem.listitem.setLabel("test label")
+        self.assertEqual(self.listitem.label, u"test label")
+
+    def test_label_kodi_listitem_override(self):
+        self.listitem.label = "first label"
+        self.listitem.listitem.setLabel("direct label")
+        self.assertEqual(self.listitem.label, u"direct label")
+        self.listitem.label = "last label"
+        self.assertEqual(self.listitem.listitem.getLabel(), u"last label")
+
+    def test_close_kodi_label(self):
+        self.listitem.listitem.setLabel("direct label")
+        self.listitem.set_callback("http://example.com/video.mkv")
+        path, raw_listitem, isfolder = self.listitem._close()
+        self.assertEqual(raw_listitem.getLabel(), u"direct label")
+        self.assertEqual(self.listitem.info.raw_dict["title"], u"direct label")
+
+    def test_bulk(self):
+        auto_sort.clear()
+        rows = [{"title": "[B]one[/B]", "url": "http://example.com/one", "thumb": "one.jpg", "duration": "1:30",
+                 "size": "1024", "date": "2017-06-27", "codec": "h264"},
+                {"title": "two", "url": "http://example.com/two", "duration": "", "date": "2017-06-27"}]
+        mapping = {"label": "title", "params.url": "url", "art.thumb": "thumb", "info.duration": "duration",
+                   "info.size": "size", "date": ("date", "%Y-%m-%d"), "stream.video_codec": "codec"}
+        items = list(listing.Listitem.bulk(self.route_callback, rows, mapping))
+
+        self.assertEqual(len(items), 2)
+        one, two = items
+        self.assertEqual(one.label, u"[B]one[/B]")
+        self.assertEqual(one.info["title"], u"one")
+        self.assertEqual(one.params["url"], u"http://example.com/one")
+        self.assertEqual(one.art["thumb"], "one.jpg")
+        self.assertEqual(one.info["duration"], 90)
+        self.assertEqual(one.info["size"], 1024)
+        self.assertEqual(one.info["aired"], "2017-06-27")
+        self.assertEqual(one.stream["video_codec"], "h264")
+        self.assertNotIn("duration", two.info)
+        self.assertNotIn("thumb", two.art)
+        self.assertEqual(two.info["year"], "2017")
+        self.assertIn(xbmcplugin.SORT_METHOD_VIDEO_RUNTIME, auto_sort)
+        self.assertIn(xbmcplugin.SORT_METHOD_DATE, auto_sort)
+
+        path, raw_listitem, isfolder = one._close()
+        self.assertTrue(isfolder)
+
+    def test_bulk_columns(self):
+        columns = {"label": ["one", "two", "three"], "callback": ["http://example.com/one", None, None],
+                   "info.episode": [1, 2]}
+        items = list(listing.Listitem.bulk("http://example.com/video", columns))
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].path, "http://example.com/one")
+        self.assertEqual(items[1].path, "http://example.com/video")
+        self.assertEqual(items[1].info["episode"], 2)
+        self.assertNotIn("episode", items[2].info)
+
+    def test_bulk_invalid(self):
+        # Invalid rows and mappings are reported when called, not when the listitems are iterated over
+        with self.assertRaises(TypeError):
+            listing.Listitem.bulk(self.route_callback, [{"year": "unknown"}], {"info.year": "year"})
+        with self.assertRaises(ValueError):
+            listing.Listitem.bulk(self.route_callback, [{"year": "2017"}], {"year": "year"})
+
     def test_from_dict(self):
         listitem = listing.Listitem.from_dict(self.route_callback, "test label",
                                               params={"test": True},
@@ -0,0 +1,131 @@
+import importlib
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+try:
+    import builtins
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import __builtin__ as builtins
+
+from codequick import profiler
+
+
+class Addon(object):
+    def __init__(self, **settings):
+        self.settings = settings
+
+    def getSetting(self, key):
+        return self.settings.get(key, "")
+
+
+class TestImportProfiler(unittest.TestCase):
+    def setUp(self):
+        # Create a package with a module that imports another module
+        self.directory = tempfile.mkdtemp()
+        package = os.path.join(self.directory, "profiled")
+        os.mkdir(package)
+        with open(os.path.join(package, "__init__.py"), "w") as stream:
+            stream.write("")
+        with open(os.path.join(package, "parent.py"), "w") as stream:
+            stream.write("import time\ntime.sleep(0.02)\nimport profiled.child\n")
+        with open(os.path.join(package, "child.py"), "w") as stream:
+            stream.write("import time\ntime.sleep(0.05)\n")
+        with open(os.path.join(package, "implicit.py"), "w") as stream:
+            stream.write("import child\n")
+
+        sys.path.insert(0, self.directory)
+        self.profiler = profiler.ImportProfiler()
+
+    def tearDown(self):
+        self.profiler.stop()
+        sys.path.remove(self.directory)
+        for name in ("profiled", "profiled.parent", "profiled.child", "profiled.implicit"):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.directory)
+
+    def records(self):
+        return {name: (elapsed, self_time) for name, elapsed, self_time in self.profiler.records}
+
+    def test_start_stop(self):
+        org_import, org_import_module = builtins.__import__, importlib.import_module
+        self.profiler.start()
+        self.assertTrue(self.profiler.running)
+        self.assertIsNot(builtins.__import__, org_import)
+        # On python 2 import_module goes through __import__, so it's not patched
+        self.assertEqual(importlib.import_module is not org_import_module, profiler.PY3)
+
+        self.profiler.stop()
+        self.assertFalse(self.profiler.running)
+        self.assertIs(builtins.__import__, org_import)
+        self.assertIs(importlib.import_module, org_import_module)
+
+    def test_import(self):
+        self.profiler.start()
+        # noinspection PyUnresolvedReferences
+        import profiled.parent
+        self.profiler.stop()
+
+        records = self.records()
+        parent_time, parent_self = records["profiled.parent"]
+        child_time, child_self = records["profiled.child"]
+        self.assertGreaterEqual(child_self, 0.05)
+        self.assertGreaterEqual(parent_time, child_time + 0.02)
+        self.assertLess(parent_self, child_time)
+
+    @unittest.skipIf(profiler.PY3, "implicit relative imports only exist in python 2")
+    def test_implicit_relative_import(self):
+        self.profiler.start()
+        # noinspection PyUnresolvedReferences
+        import profiled.implicit
+        self.profiler.stop()
+
+        self.assertIs(sys.modules["profiled.implicit"].child, sys.modules["profiled.child"])
+        self.assertIn("profiled.implicit", self.records())
+
+    def test_import_module(self):
+        self.profiler.start()
+        importlib.import_module("profiled.parent")
+        self.profiler.stop()
+        self.assertIn("profiled.parent", self.records())
+        self.assertIn("profiled.child", self.records())
+
+    def test_imported_modules_ignored(self):
+        self.profiler.start()
+        importlib.import_module("os")
+        self.profiler.stop()
+        self.assertListEqual(self.profiler.records, [])
+
+    def test_report(self):
+        self.profiler.start()
+        importlib.import_module("profiled.parent")
+        self.profiler.stop()
+
+        lines = self.profiler.report(limit=1)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Import profile: 2 modules imported in"))
+        self.assertTrue(lines[2].endswith("profiled.child"))
+
+
+class TestEnabled(unittest.TestCase):
+    def setUp(self):
+        self.org_env = os.environ.pop(profiler.ENV_IMPORT_PROFILER, None)
+
+    def tearDown(self):
+        os.environ.pop(profiler.ENV_IMPORT_PROFILER, None)
+        if self.org_env is not None:
+            os.environ[profiler.ENV_IMPORT_PROFILER] = self.org_env
+
+    def test_env(self):
+        os.environ[profiler.ENV_IMPORT_PROFILER] = "1"
+        self.assertTrue(profiler.enabled())
+
+    def test_setting(self):
+        self.assertTrue(profiler.enabled(addon=Addon(codequick_profile_imports="true")))
+        self.assertFalse(profiler.enabled(addon=Addon()))
+
+    def test_no_addon(self):
+        self.assertFalse(profiler.enabled())
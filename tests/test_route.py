@@ -1,4 +1,6 @@
 import unittest
+import time
+import os
 from addondev.testing import plugin_data, reset_plugin_data
 import xbmc
 
@@ -209,3 +211,152 @@ class TestRoute(unittest.TestCase):
         self.route._process_results(route_list())
         self.assertTrue(plugin_data["succeeded"])
         self.assertIsNone(plugin_data["contenttype"])
+
+
+@route.Route.register(cache_ttl=60)
+def callback_cached(_, url=None):
+    yield Listitem.from_dict(callback_test, "cached item", info={"mediatype": "video"})
+    yield Listitem.from_dict("http://example.com/video.mkv", "cached video", info={"plot": url})
+
+
+@route.Route.register(cache_ttl=60)
+def callback_cached_options(plugin, redirect=False):
+    plugin.category = "Custom category"
+    plugin.update_listing = True
+    plugin.cache_to_disc = False
+    plugin.redirect_single_item = redirect
+    yield Listitem.from_dict(callback_test, "cached folder")
+
+
+class TestRouteCache(unittest.TestCase):
+    def setUp(self):
+        reset_plugin_data()
+        route.Route.invalidate_cache()
+        self.route_ins = callback_cached.route
+
+    def tearDown(self):
+        route.Route.invalidate_cache()
+
+    def run_cached(self, **params):
+        reset_plugin_data()
+        plugin = route.Route()
+        results = plugin._load_cache(self.route_ins, params)
+        if results is None:
+            results = callback_cached(plugin, **params)
+        plugin._process_results(results)
+        return results
+
+    def test_cache_ttl(self):
+        self.assertEqual(self.route_ins.cache_ttl, 60)
+        self.assertIsNone(callback_test.route.cache_ttl)
+
+    def test_cache_miss(self):
+        results = self.run_cached(url="test")
+        self.assertNotIsInstance(results, route.ListingSnapshot)
+        self.assertTrue(plugin_data["succeeded"])
+
+    def test_cache_hit(self):
+        self.run_cached(url="test")
+        org_listitems = [(path, item.getLabel(), isfolder) for path, item, isfolder in plugin_data["listitems"]]
+
+        results = self.run_cached(url="test")
+        self.assertIsInstance(results, route.ListingSnapshot)
+        self.assertTrue(plugin_data["succeeded"])
+        self.assertEqual(plugin_data["contenttype"], "videos")
+        listitems = [(path, item.getLabel(), isfolder) for path, item, isfolder in plugin_data["listitems"]]
+        self.assertListEqual(listitems, org_listitems)
+
+    def test_cache_params(self):
+        self.run_cached(url="one")
+        results = self.run_cached(url="two")
+        self.assertNotIsInstance(results, route.ListingSnapshot)
+
+    def test_cache_expired(self):
+        self.run_cached(url="test")
+        self.route_ins.cache_ttl = 0
+        try:
+            results = self.run_cached(url="test")
+        finally:
+            self.route_ins.cache_ttl = 60
+        self.assertNotIsInstance(results, route.ListingSnapshot)
+
+    def test_invalidate_params(self):
+        self.run_cached(url="one")
+        self.run_cached(url="two")
+        route.Route.invalidate_cache(callback_cached, url="one")
+        self.assertNotIsInstance(self.run_cached(url="one"), route.ListingSnapshot)
+        self.assertIsInstance(self.run_cached(url="two"), route.ListingSnapshot)
+
+    def test_invalidate_callback(self):
+        self.run_cached(url="one")
+        self.run_cached(url="two")
+        route.Route.invalidate_cache(callback_cached)
+        self.assertNotIsInstance(self.run_cached(url="one"), route.ListingSnapshot)
+        self.assertNotIsInstance(self.run_cached(url="two"), route.ListingSnapshot)
+
+    def test_cache_title_category(self):
+        # The default category follows the title of the parent listitem, not the visit that populated the cache
+        for title in ("First (5)", "Second (7)"):
+            reset_plugin_data()
+            plugin = route.Route()
+            plugin._title = title
+            plugin.category = route.title_category(title)
+            results = plugin._load_cache(self.route_ins, {"url": "test"})
+            if results is None:
+                results = callback_cached(plugin, url="test")
+            plugin._process_results(results)
+
+        self.assertIsInstance(results, route.ListingSnapshot)
+        self.assertEqual(plugin_data["category"], "Second")
+
+    def run_options(self, **params):
+        reset_plugin_data()
+        plugin = route.Route()
+        results = plugin._load_cache(callback_cached_options.route, params)
+        if results is None:
+            results = callback_cached_options(plugin, **params)
+        return plugin, results, plugin._process_results(results)
+
+    def test_cache_options(self):
+        self.run_options()
+        plugin, results, _ = self.run_options()
+        self.assertIsInstance(results, route.ListingSnapshot)
+        self.assertEqual(plugin.category, "Custom category")
+        self.assertTrue(plugin.update_listing)
+        self.assertFalse(plugin.cache_to_disc)
+        self.assertEqual(plugin_data["category"], "Custom category")
+
+    def test_cache_redirect(self):
+        _, _, org_redirect = self.run_options(redirect=True)
+        plugin, results, redirect = self.run_options(redirect=True)
+        self.assertIsInstance(results, route.ListingSnapshot)
+        self.assertTrue(redirect.startswith("plugin://"))
+        self.assertEqual(redirect, org_redirect)
+
+    def test_outdated_snapshot(self):
+        # Snapshots pickled by an older version have fewer fields, these are treated as a cache miss
+        snapshot = route.ListingSnapshot.__new__(route.ListingSnapshot)
+        with self.assertRaises(ValueError):
+            snapshot.__setstate__([[], [], [], True, None])
+
+    def test_prune_expired(self):
+        self.run_cached(url="one")
+        self.run_cached(url="two")
+        self.route_ins.cache_ttl = 0
+        try:
+            route.prune_cache(self.route_ins)
+        finally:
+            self.route_ins.cache_ttl = 60
+        self.assertListEqual(os.listdir(route.cache_dir()), [])
+
+    def test_prune_oldest(self):
+        self.run_cached(url="one")
+        self.run_options()
+        self.run_cached(url="two")
+        old_time = time.time() - 30
+        os.utime(os.path.join(route.cache_dir(), route.cache_key(self.route_ins.path, {"url": "one"})),
+                 (old_time, old_time))
+
+        route.prune_cache(callback_cached_options.route, keep=2)
+        self.assertNotIsInstance(self.run_cached(url="one"), route.ListingSnapshot)
+        self.assertIsInstance(self.run_cached(url="two"), route.ListingSnapshot)
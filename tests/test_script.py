@@ -128,6 +128,18 @@ class Script(unittest.TestCase):
         else:
             self.assertTrue(False)
 
+    def test_register_metacall_parallel(self):
+        def tester():
+            pass
+
+        self.script.register_delayed(tester, parallel=True)
+        for callback, _, kwargs, _ in script.dispatcher.registered_parallel:
+            if callback is tester:
+                self.assertNotIn("parallel", kwargs)
+                break
+        else:
+            self.assertTrue(False)
+
     def test_log_noarg(self):
         with MockLogger() as logger:
             self.script.log("test msg")
@@ -1,11 +1,15 @@
 from contextlib import contextmanager
 import unittest
+import tempfile
 import logging
 import inspect
+import shutil
+import time
 import sys
+import os
 
 # Testing specific imports
-from codequick import support, route, script
+from codequick import support, route, script, profiler
 import xbmc
 
 PY3 = sys.version_info >= (3, 0)
@@ -31,6 +35,65 @@ class TestLogging(unittest.TestCase):
         support.base_logger.debug("test debug")
         self.assertIn("[root] test debug", support.kodi_logger.debug_msgs)
 
+    def test_logger_history(self):
+        support.kodi_logger.clear()
+        for i in range(support.DEBUG_HISTORY + 10):
+            support.base_logger.debug("test debug %d", i)
+
+        msgs = support.kodi_logger.debug_msgs
+        self.assertEqual(len(msgs), support.DEBUG_HISTORY)
+        self.assertEqual(msgs[0], "[root] test debug 10")
+
+    def test_logger_debug_disabled(self):
+        logged = []
+        org_log = xbmc.log
+        org_enabled = support.kodi_logger.debug_enabled
+        support.kodi_logger.debug_enabled = False
+        xbmc.log = lambda msg, level=0: logged.append(msg)
+        try:
+            support.base_logger.debug("test debug")
+            support.base_logger.info("test info")
+        finally:
+            support.kodi_logger.debug_enabled = org_enabled
+            xbmc.log = org_log
+
+        self.assertNotIn("[root] test debug", logged)
+        self.assertIn("[root] test info", logged)
+        self.assertIn("[root] test debug", support.kodi_logger.debug_msgs)
+
+    def check_loglevel(self, content):
+        directory = tempfile.mkdtemp()
+        org_path = support.ADVANCED_SETTINGS
+        support.ADVANCED_SETTINGS = os.path.join(directory, "advancedsettings.xml")
+        try:
+            if content is not None:
+                with open(support.ADVANCED_SETTINGS, "w") as stream:
+                    stream.write(content)
+            return support.loglevel()
+        finally:
+            support.ADVANCED_SETTINGS = org_path
+            shutil.rmtree(directory)
+
+    def test_loglevel(self):
+        content = '<advancedsettings><loglevel hide="false">1</loglevel></advancedsettings>'
+        self.assertEqual(self.check_loglevel(content), 1)
+        self.assertEqual(self.check_loglevel("<advancedsettings><loglevel>-1</loglevel></advancedsettings>"), -1)
+
+    def test_loglevel_not_set(self):
+        self.assertEqual(self.check_loglevel(None), 0)
+        self.assertEqual(self.check_loglevel("<advancedsettings></advancedsettings>"), 0)
+        self.assertEqual(self.check_loglevel("<advancedsettings><loglevel>"), 0)
+
+    def test_refresh_loglevel(self):
+        org_loglevel = support.loglevel
+        support.loglevel = lambda: 1
+        try:
+            support.kodi_logger.refresh()
+            self.assertTrue(support.kodi_logger.debug_enabled)
+        finally:
+            support.loglevel = org_loglevel
+            support.kodi_logger.refresh()
+
     # noinspection PyMethodMayBeStatic
     def test_critical(self):
         logger = logging.getLogger()
@@ -158,6 +221,46 @@ class TestDispatcher(unittest.TestCase):
         self.dispatcher.run_delayed()
         self.assertTrue(Executed.yes)
 
+    def test_metacalls_parallel(self):
+        executed = []
+
+        def slow(name):
+            time.sleep(0.2)
+            executed.append(name)
+
+        def ordered(name):
+            executed.append(name)
+
+        def on_error():
+            executed.append("error")
+
+        self.dispatcher.register_parallel(slow, ["one"], {}, 0)
+        self.dispatcher.register_parallel(slow, ["two"], {}, 0)
+        self.dispatcher.register_parallel(on_error, [], {}, 1)
+        self.dispatcher.register_delayed(ordered, ["three"], {}, 0)
+        self.dispatcher.register_delayed(ordered, ["four"], {}, 0)
+
+        start = time.time()
+        self.dispatcher.run_delayed()
+        self.assertLess(time.time() - start, 0.4)
+        self.assertListEqual(executed[:2], ["four", "three"])
+        self.assertListEqual(sorted(executed[2:]), ["one", "two"])
+        self.assertListEqual(self.dispatcher.registered_parallel, [])
+
+    def test_metacalls_parallel_budget(self):
+        def slow():
+            time.sleep(0.3)
+
+        org_budget = support.PARALLEL_BUDGET
+        support.PARALLEL_BUDGET = 0.05
+        try:
+            self.dispatcher.register_parallel(slow, [], {}, 0)
+            start = time.time()
+            self.dispatcher.run_delayed()
+        finally:
+            support.PARALLEL_BUDGET = org_budget
+        self.assertLess(time.time() - start, 0.25)
+
     def test_register_root(self):
         def root():
             pass
@@ -215,6 +318,57 @@ class TestDispatcher(unittest.TestCase):
 
         self.assertTrue(Executed.yes)
 
+    def test_dispatch_reused_interpreter(self):
+        def root(_):
+            return False
+
+        self.dispatcher.register_callback(root, script.Script)
+        with mock_argv(["plugin://script.module.codequick", 96, ""]):
+            self.dispatcher.run_callback()
+            addon_data = support.addon_data
+            self.dispatcher.run_callback()
+
+        self.assertEqual(self.dispatcher.invocations, 2)
+        self.assertIsNot(support.addon_data, addon_data)
+        self.assertIs(script.addon_data, support.addon_data)
+
+    def test_dispatch_route_profiler(self):
+        def root(_):
+            return False
+
+        self.dispatcher.register_callback(root, script.Script)
+        directory = os.path.join(profiler.profile_dir(), u"_route_profiles")
+        os.environ[profiler.ENV_ROUTE_PROFILER] = "true"
+        try:
+            with mock_argv(["plugin://script.module.codequick", 96, ""]):
+                for _ in range(profiler.MAX_ROUTE_PROFILES + 2):
+                    self.dispatcher.run_callback()
+        finally:
+            del os.environ[profiler.ENV_ROUTE_PROFILER]
+
+        filenames = sorted(os.listdir(directory))
+        shutil.rmtree(directory)
+        self.assertEqual(len(filenames), profiler.MAX_ROUTE_PROFILES)
+        self.assertTrue(filenames[-1].endswith("-root.pstats"))
+        self.assertIsNone(profiler.route_profiler)
+
+    def test_dispatch_route_profiler_setting(self):
+        def root(_):
+            return False
+
+        self.dispatcher.register_callback(root, script.Script)
+        directory = os.path.join(profiler.profile_dir(), u"_route_profiles")
+        support.addon_data.setSetting(profiler.SETTING_ROUTE_PROFILER, "true")
+        try:
+            with mock_argv(["plugin://script.module.codequick", 96, ""]):
+                self.dispatcher.run_callback()
+        finally:
+            support.addon_data.setSetting(profiler.SETTING_ROUTE_PROFILER, "false")
+
+        filenames = os.listdir(directory)
+        shutil.rmtree(directory)
+        self.assertEqual(len(filenames), 1)
+
     def test_dispatch_script(self):
         class Executed(object):
             yes = False
@@ -259,6 +413,50 @@ class TestDispatcher(unittest.TestCase):
         self.assertTrue(Executed.yes)
 
 
+class TestRouteManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, "_routes.json")
+
+        def listing():
+            pass
+
+        self.route = support.Route(listing, route.Route, "/tests/test_support/listing/")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_add(self):
+        manifest = support.RouteManifest(self.filepath, "1.0.0")
+        manifest.add(self.route)
+        self.assertTrue(manifest.changed)
+        self.assertListEqual(manifest["/tests/test_support/listing/"], ["tests.test_support", "listing", "Route"])
+
+    def test_save_load(self):
+        manifest = support.RouteManifest(self.filepath, "1.0.0")
+        manifest.add(self.route)
+        manifest.save()
+        self.assertFalse(manifest.changed)
+
+        manifest = support.RouteManifest(self.filepath, "1.0.0")
+        self.assertIn("/tests/test_support/listing/", manifest)
+
+    def test_version_change(self):
+        manifest = support.RouteManifest(self.filepath, "1.0.0")
+        manifest.add(self.route)
+        manifest.save()
+
+        manifest = support.RouteManifest(self.filepath, "1.0.1")
+        self.assertNotIn("/tests/test_support/listing/", manifest)
+
+    def test_get_route_outdated(self):
+        dispatcher = support.Dispatcher()
+        dispatcher._manifest = support.RouteManifest(self.filepath, "1.0.0")
+        dispatcher.manifest["/tests/test_support/missing/"] = ["tests.missing_module", "missing", "Route"]
+        with self.assertRaises(support.RouteMissing):
+            dispatcher.get_route("/tests/test_support/missing/")
+
+
 class BuildPath(unittest.TestCase):
     def setUp(self):
         # noinspection PyUnusedLocal
@@ -280,36 +478,112 @@ class BuildPath(unittest.TestCase):
         ret = support.build_path(self.callback)
         self.assertEqual(ret, "plugin://script.module.codequick/root")
 
-    @unittest.skipIf(PY3, "The pickled string is specific to python 2")
-    def test_build_path_new_args_py2(self):
-        ret = support.build_path(self.callback, query={"testdata": "data"})
-        self.assertEqual("plugin://script.module.codequick/root?_pickle_="
-                         "80027d71005508746573746461746171015504646174617102732e", ret)
-
-    @unittest.skipUnless(PY3, "The pickled string is specific to python 2")
-    def test_build_path_new_args_py3(self):
+    def test_build_path_new_args(self):
         ret = support.build_path(self.callback, query={"testdata": "data"})
-        self.assertEqual("plugin://script.module.codequick/root?_pickle_="
-                         "80049516000000000000007d948c087465737464617461948c046461746194732e", ret)
+        self.assertEqual("plugin://script.module.codequick/root?testdata=data", ret)
 
-    @unittest.skipIf(PY3, "The pickled string is specific to python 2")
-    def test_build_path_extra_args_py2(self):
+    def test_build_path_extra_args(self):
         support.dispatcher.params["_title_"] = "video"
         try:
             ret = support.build_path(self.callback, testdata="data")
-            self.assertEqual("plugin://script.module.codequick/root?_pickle_="
-                             "80027d71002855075f7469746c655f71015505766964656f71"
-                             "025508746573746461746171035504646174617104752e", ret)
+            self.assertEqual("plugin://script.module.codequick/root?_title_=video&testdata=data", ret)
         finally:
             del support.dispatcher.params["_title_"]
 
-    @unittest.skipUnless(PY3, "The pickled string is specific to python 2")
-    def test_build_path_extra_args_py3(self):
-        support.dispatcher.params["_title_"] = "video"
+    def test_build_path_json_args(self):
+        ret = support.build_path(self.callback, query={"one": 1, "two": [2], "three": "3"})
+        self.assertEqual("plugin://script.module.codequick/root?_params_=jeyJvbmUiOjEsInR3byI6WzJdfQ&three=3", ret)
+
+    def test_build_path_deterministic(self):
+        query = {"one": 1, "two": 2, "three": {"four": 4, "five": 5}}
+        reverse = {"three": {"five": 5, "four": 4}, "two": 2, "one": 1}
+        self.assertEqual(support.build_path(self.callback, query=query),
+                         support.build_path(self.callback, query=reverse))
+
+
+class TestParams(unittest.TestCase):
+    def roundtrip(self, query):
+        dispatcher = support.Dispatcher()
+        with mock_argv(["plugin://script.module.codequick/test/tester", 96, "?" + support.encode_params(query)]):
+            dispatcher.parse_args()
+        return dispatcher.params
+
+    def test_plain(self):
+        encoded = support.encode_params({"url": "http://example.com/?q=1"})
+        self.assertEqual(encoded, "url=http%3A%2F%2Fexample.com%2F%3Fq%3D1")
+
+    def test_roundtrip_json(self):
+        query = {"testdata": True, "worker": False, "_title_": "test", "count": 5, "empty": ""}
+        self.assertDictEqual(self.roundtrip(query), query)
+
+    def test_roundtrip_compressed(self):
+        query = {"items": [{"id": i, "title": "title %d" % i} for i in range(20)]}
+        encoded = support.encode_params(query)
+        self.assertTrue(encoded.startswith("_params_=z"))
+        self.assertDictEqual(self.roundtrip(query), query)
+
+    @unittest.skipIf(PY3, "Native strings are only different from unicode on python 2")
+    def test_roundtrip_native_str(self):
+        query = {"items": ["title", u"t\xeftle", "t\xc3\xaftle"]}
+        encoded = support.encode_params(query)
+        self.assertTrue(encoded.startswith("_params_=j"))
+        self.assertDictEqual(self.roundtrip(query), {"items": [u"title", u"t\xeftle", u"t\xeftle"]})
+
+        # Strings that are not utf8 can only be pickled
+        self.assertTrue(support.encode_params({"items": ["t\xefle"]}).startswith("_params_=p"))
+
+    def test_roundtrip_pickle(self):
+        query = {"pair": (1, 2)}
+        encoded = support.encode_params(query)
+        self.assertTrue(encoded.startswith("_params_=p"))
+        self.assertDictEqual(self.roundtrip(query), query)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            support.decode_params("qabc")
+
+    def test_cached_pairs(self):
+        query = {"show": "tester", "url": "http://example.com/?q=1", "page": 2}
+        encoded = support.encode_params(query)
+        self.assertEqual(support.encoded_params[("show", "tester")], ("show", "show=tester"))
+
+        # Cached pairs give the same result as encoding from scratch
+        support.encoded_params.clear()
+        self.assertEqual(support.encode_params(query), encoded)
+
+    def test_cached_blocks(self):
+        support.encoded_params.clear()
+        support.encoded_blocks.clear()
+        info = {"season": 1, "cast": ["actor %d" % i for i in range(20)]}
+        first = support.encode_params({"url": "http://example.com/1", "info": info})
+        second = support.encode_params({"url": "http://example.com/2", "info": info})
+
+        # The complex params are encoded once, and never end up in the plain params cache
+        self.assertEqual(len(support.encoded_blocks), 1)
+        self.assertNotIn("_params_", [key for key, _ in support.encoded_params])
+        self.assertEqual(first.split("&")[0], second.split("&")[0])
+        self.assertTrue(first.startswith("_params_=z"))
+
+    def test_cached_blocks_lru(self):
+        org_limit = support.ENCODED_BLOCKS_CACHE
+        support.ENCODED_BLOCKS_CACHE = 2
         try:
-            ret = support.build_path(self.callback, testdata="data")
-            self.assertEqual("plugin://script.module.codequick/root?_pickle_="
-                             "80049529000000000000007d94288c075f7469746c655f948c"
-                             "05766964656f948c087465737464617461948c046461746194752e", ret)
+            support.encoded_blocks.clear()
+            support.encode_params({"page": 1})
+            support.encode_params({"page": 2})
+            support.encode_params({"page": 1})
+            support.encode_params({"page": 3})
+            self.assertListEqual(list(support.encoded_blocks), [b'{"page":1}', b'{"page":3}'])
         finally:
-            del support.dispatcher.params["_title_"]
+            support.ENCODED_BLOCKS_CACHE = org_limit
+
+    def test_cache_limit(self):
+        org_limit = support.ENCODED_PARAMS_CACHE
+        support.ENCODED_PARAMS_CACHE = 2
+        try:
+            support.encoded_params.clear()
+            support.encode_params({"one": "1", "two": "2"})
+            support.encode_params({"three": "3"})
+            self.assertListEqual(list(support.encoded_params), [("three", "3")])
+        finally:
+            support.ENCODED_PARAMS_CACHE = org_limit
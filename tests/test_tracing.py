@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+import unittest
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+from codequick import support, script, tracing
+
+
+@contextmanager
+def mock_argv(argv):
+    org_argv = sys.argv[:]
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        sys.argv = org_argv
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, "_trace.jsonl")
+        self.tracer = tracing.Tracer(self.filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.filepath) as stream:
+            return [json.loads(line) for line in stream]
+
+    def test_nested_spans(self):
+        with self.tracer.span("outer", page=1):
+            with self.tracer.span("inner"):
+                pass
+        self.tracer.route = "/test/"
+        self.tracer.flush()
+
+        inner, outer = self.read()
+        self.assertEqual(inner["span"], "inner")
+        self.assertEqual(inner["parent"], "outer")
+        self.assertIsNone(outer["parent"])
+        self.assertEqual(outer["page"], 1)
+        self.assertEqual(outer["route"], "/test/")
+        self.assertEqual(inner["id"], outer["id"])
+        self.assertGreaterEqual(outer["ms"], inner["ms"])
+
+    def test_span_error(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span("failing"):
+                raise ValueError
+        self.tracer.flush()
+        self.assertEqual(self.read()[0]["error"], "ValueError")
+
+    def test_flush_error(self):
+        # The trace directory can't be created, as a file with that name is in the way
+        open(os.path.join(self.directory, "blocked"), "w").close()
+        tracer = tracing.Tracer(os.path.join(self.directory, "blocked", "_trace.jsonl"))
+        tracer.add("callback", 0.5)
+        tracer.flush()
+        self.assertListEqual(tracer.records, [])
+
+    def test_add(self):
+        self.tracer.add("listitem_close", 0.5, count=10)
+        self.tracer.flush()
+        record = self.read()[0]
+        self.assertEqual(record["ms"], 500)
+        self.assertEqual(record["count"], 10)
+
+    def test_rotate(self):
+        org_size = tracing.MAX_TRACE_SIZE
+        tracing.MAX_TRACE_SIZE = 0
+        try:
+            for _ in range(3):
+                self.tracer.add("test", 0.1)
+                self.tracer.flush()
+        finally:
+            tracing.MAX_TRACE_SIZE = org_size
+
+        self.assertEqual(len(self.read()), 1)
+        self.assertTrue(os.path.exists(self.filepath + ".1"))
+
+    @unittest.skipIf(tracing.tracemalloc is None, "tracemalloc is not available")
+    def test_span_memory(self):
+        tracing.tracemalloc.start()
+        try:
+            tracer = tracing.Tracer(self.filepath)
+            with tracer.span("alloc"):
+                data = [0] * 100000
+        finally:
+            tracing.tracemalloc.stop()
+        tracer.flush()
+        self.assertGreater(self.read()[0]["alloc_kb"], 500)
+        self.assertEqual(len(data), 100000)
+
+    def test_null_span(self):
+        self.assertIsNone(tracing.tracer)
+        self.assertIs(tracing.span("test"), tracing.null_span)
+
+
+class TestSummary(unittest.TestCase):
+    def test_summarize(self):
+        lines = [json.dumps({"route": "/test/", "span": "callback", "ms": ms}) for ms in range(1, 101)]
+        lines.append(json.dumps({"route": "root", "span": "callback", "ms": 5}))
+        summary = tracing.summarize(lines)
+        self.assertEqual(summary[("/test/", "callback")], (100, 50, 95, 100))
+        self.assertEqual(summary[("root", "callback")], (1, 5, 5, 5))
+
+    def test_report(self):
+        lines = tracing.report({("root", "callback"): (1, 5.0, 5.0, 5.0)})
+        self.assertEqual(len(lines), 2)
+        self.assertIn("callback", lines[1])
+
+
+class TestDispatchTracing(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = support.Dispatcher()
+
+    def test_dispatch(self):
+        def root(_):
+            self.dispatcher.register_delayed(delayed, (), {}, 2)
+            return False
+
+        def delayed():
+            pass
+
+        self.dispatcher.register_callback(root, script.Script)
+        os.environ[tracing.ENV_TRACING] = "true"
+        try:
+            with mock_argv(["plugin://script.module.codequick", 96, ""]):
+                self.dispatcher.run_callback()
+        finally:
+            del os.environ[tracing.ENV_TRACING]
+
+        from codequick.profiler import profile_dir
+        filepath = os.path.join(profile_dir(), u"_trace.jsonl")
+        with open(filepath) as stream:
+            records = [json.loads(line) for line in stream]
+        os.remove(filepath)
+
+        spans = [record["span"] for record in records]
+        for name in ("parse_args", "import", "parent", "callback", "delayed"):
+            self.assertIn(name, spans)
+        self.assertTrue(all(record["route"] == "root" for record in records))
+        self.assertIsNone(tracing.tracer)
@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import socket
+import ssl
+import json
+import threading
+import time
+import zlib
+import os
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    # noinspection PyUnresolvedReferences
+    from SocketServer import ThreadingMixIn
+
+import urlquick
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Respond with the (status, headers, body) that is registered for the path on the server."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, dict((k.lower(), v) for k, v in self.headers.items())))
+        response = self.server.routes[self.path.split("?", 1)[0]]
+        if callable(response):
+            # Callables can write the response themselves, by returning None
+            response = response(self)
+            if response is None:
+                return
+
+        status, headers, body = response
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        if not any(key.lower() == "content-length" for key, _ in headers):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except socket.error:
+            # The client stopped reading, e.g. when using max_bytes
+            pass
+
+    do_POST = do_OPTIONS = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context=None):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        if context is not None:
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.scheme = "https" if context else "http"
+        self.routes = {}
+        self.requests = []
+
+    @property
+    def host(self):
+        return "127.0.0.1:{}".format(self.server_address[1])
+
+    @property
+    def url(self):
+        return "{}://{}".format(self.scheme, self.host)
+
+    def handle_error(self, request, client_address):
+        # Connections that are dropped by the client are expected, e.g. when using max_bytes
+        pass
+
+
+class UrlquickTestCase(unittest.TestCase):
+    """Base test case that stores all urlquick data in a temporary directory."""
+
+    def setUp(self):
+        self.org_location = urlquick.CACHE_LOCATION
+        self.directory = tempfile.mkdtemp()
+        urlquick.CACHE_LOCATION = self.directory
+
+    def tearDown(self):
+        urlquick.CACHE_LOCATION = self.org_location
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TestRateLimiter(UrlquickTestCase):
+    def read_state(self):
+        with open(urlquick.RateLimiter.state_file(), "rb") as stream:
+            return json.loads(stream.read().decode("utf8"))
+
+    def test_no_limit(self):
+        limiter = urlquick.RateLimiter()
+        self.assertEqual(limiter.acquire(u"www.example.com"), 0.0)
+        limiter.save()
+        self.assertFalse(os.path.exists(limiter.state_file()))
+
+    def test_burst(self):
+        limiter = urlquick.RateLimiter({u"www.example.com": (20, 2)})
+        self.assertEqual(limiter.acquire(u"www.example.com"), 0.0)
+        self.assertEqual(limiter.acquire(u"www.example.com"), 0.0)
+        self.assertAlmostEqual(limiter.acquire(u"www.example.com"), 0.05, delta=0.01)
+
+    def test_threads(self):
+        limiter = urlquick.RateLimiter({u"www.example.com": (50, 1)})
+        threads = [threading.Thread(target=limiter.acquire, args=(u"www.example.com",)) for _ in range(5)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Each thread reserves its own token, so the requests are spread out over time
+        self.assertGreaterEqual(time.time() - start, 0.075)
+
+    def test_penalize_without_limit(self):
+        limiter = urlquick.RateLimiter()
+        limiter.penalize(u"www.example.com", 0.05)
+        self.assertAlmostEqual(limiter.acquire(u"www.example.com"), 0.05, delta=0.01)
+        self.assertEqual(limiter.acquire(u"www.example.com"), 0.0)
+        self.assertEqual(limiter.acquire(u"www.example.org"), 0.0)
+
+    def test_penalize_persisted(self):
+        urlquick.RateLimiter().penalize(u"www.example.com", 30)
+        self.assertListEqual(os.listdir(self.directory), ["rate_limits.json"])
+
+        limiter = urlquick.RateLimiter()
+        waited = []
+        org_sleep = urlquick.time.sleep
+        urlquick.time.sleep = waited.append
+        try:
+            limiter.acquire(u"www.example.com")
+        finally:
+            urlquick.time.sleep = org_sleep
+        self.assertAlmostEqual(waited[0], 30, delta=1)
+
+    def test_loaded_once(self):
+        urlquick.RateLimiter().penalize(u"www.example.com", 30)
+        opened = []
+        org_open = urlquick._open
+        urlquick._open = lambda *args, **kwargs: (opened.append(args[0]), org_open(*args, **kwargs))[1]
+        try:
+            for _ in range(3):
+                self.assertGreater(urlquick.RateLimiter().acquire(u"www.example.org"), -1)
+        finally:
+            urlquick._open = org_open
+
+        # The state is shared by every limiter, so the unchanged state file is never read
+        self.assertListEqual(opened, [])
+
+    def test_reload_changed(self):
+        limiter = urlquick.RateLimiter()
+        self.assertEqual(limiter.acquire(u"www.example.com"), 0.0)
+
+        # Another process asked to slow down
+        with open(urlquick.RateLimiter.state_file(), "w") as stream:
+            json.dump({u"www.example.com": [1.0, time.time() + 30]}, stream)
+        mtime = time.time() + 10
+        os.utime(urlquick.RateLimiter.state_file(), (mtime, mtime))
+
+        waited = []
+        org_sleep = urlquick.time.sleep
+        urlquick.time.sleep = waited.append
+        try:
+            urlquick.RateLimiter().acquire(u"www.example.com")
+        finally:
+            urlquick.time.sleep = org_sleep
+        self.assertAlmostEqual(waited[0], 30, delta=1)
+
+    def test_save_interval(self):
+        limiter = urlquick.RateLimiter({u"www.example.com": (1, 5)})
+        limiter.acquire(u"www.example.com")
+        self.assertAlmostEqual(self.read_state()[u"www.example.com"][0], 4, delta=0.01)
+
+        # Writes are throttled, the latest state is saved when the session closes
+        limiter.acquire(u"www.example.com")
+        self.assertAlmostEqual(self.read_state()[u"www.example.com"][0], 4, delta=0.01)
+        limiter.save()
+        self.assertAlmostEqual(self.read_state()[u"www.example.com"][0], 3, delta=0.01)
+
+
+class ServerTestCase(UrlquickTestCase):
+    """Base test case with a local http server, routes are registered on self.server."""
+    context = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server(cls.context)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        super(ServerTestCase, self).setUp()
+        self.server.routes.clear()
+        del self.server.requests[:]
+        self.session = urlquick.Session(raise_for_status=False)
+
+    def tearDown(self):
+        self.session.close()
+        super(ServerTestCase, self).tearDown()
+
+    def url(self, path):
+        return self.server.url + path
+
+
+class TestCacheCompression(UrlquickTestCase):
+    body = b"<html>" + b"<li>Episode</li>" * 1000 + b"</html>"
+
+    def store(self, body, headers=()):
+        cache = urlquick.CacheHandler.from_url(u"http://www.example.com/", max_age=-1)
+        cache.update(list(headers), body, 200, u"OK")
+        with open(cache.cache_file, "rb") as stream:
+            return json.loads(stream.read().decode("utf8"))
+
+    def load(self):
+        return urlquick.CacheHandler.from_url(u"http://www.example.com/", max_age=-1).response
+
+    def test_compressed(self):
+        stored = self.store(self.body)
+        self.assertTrue(stored["compressed"])
+        self.assertLess(len(stored["body"]), len(self.body) / 10)
+        self.assertEqual(self.load().body, self.body)
+
+    def test_small_body(self):
+        self.assertFalse(self.store(b"<html></html>")["compressed"])
+        self.assertEqual(self.load().body, b"<html></html>")
+
+    def test_content_encoded(self):
+        body = zlib.compress(self.body)
+        self.assertFalse(self.store(body, [("Content-Encoding", "deflate")])["compressed"])
+        self.assertEqual(self.load().body, body)
+
+    def test_incompressible(self):
+        body = os.urandom(4096)
+        self.assertFalse(self.store(body)["compressed"])
+        self.assertEqual(self.load().body, body)
+
+    def test_disabled(self):
+        org_level = urlquick.CACHE_COMPRESS_LEVEL
+        urlquick.CACHE_COMPRESS_LEVEL = 0
+        try:
+            self.assertFalse(self.store(self.body)["compressed"])
+        finally:
+            urlquick.CACHE_COMPRESS_LEVEL = org_level
+        self.assertEqual(self.load().body, self.body)
+
+    def test_uncompressed_cache_file(self):
+        # Cache files from before compression was added have no compressed field
+        stored = self.store(b"<html></html>")
+        del stored["compressed"]
+        cache_file = urlquick.CacheHandler.from_url(u"http://www.example.com/").cache_file
+        with open(cache_file, "wb") as stream:
+            stream.write(json.dumps(stored).encode("utf8"))
+        self.assertEqual(self.load().body, b"<html></html>")
+
+
+class TestMaxBytes(ServerTestCase):
+    body = b"0123456789" * 10000
+
+    def test_range_ignored(self):
+        self.server.routes["/video"] = (200, [], self.body)
+        resp = self.session.get(self.url("/video"), max_bytes=1000, max_age=-1)
+        self.assertEqual(self.server.requests[0][2]["range"], "bytes=0-999")
+        self.assertEqual(resp.content, self.body[:1000])
+        self.assertTrue(resp.partial)
+
+        # The rest of the body was not read, so the connection can't be reused
+        self.assertDictEqual(self.session.request_handler["http"], {})
+
+    def test_range_supported(self):
+        self.server.routes["/video"] = (206, [("Content-Range", "bytes 0-999/100000")], self.body[:1000])
+        resp = self.session.get(self.url("/video"), max_bytes=1000, max_age=-1)
+        self.assertEqual(resp.content, self.body[:1000])
+        self.assertTrue(resp.partial)
+
+    def test_small_body(self):
+        self.server.routes["/small"] = (200, [], b"small")
+        resp = self.session.get(self.url("/small"), max_bytes=1000, max_age=-1)
+        self.assertEqual(resp.content, b"small")
+        self.assertFalse(resp.partial)
+
+    def test_cached_separately(self):
+        self.server.routes["/video"] = (200, [], self.body)
+        partial = self.session.get(self.url("/video"), max_bytes=1000)
+        full = self.session.get(self.url("/video"))
+        self.assertEqual(len(partial.content), 1000)
+        self.assertEqual(full.content, self.body)
+
+        # Both are now served from the cache
+        self.assertTrue(self.session.get(self.url("/video"), max_bytes=1000).partial)
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class TestDeadline(ServerTestCase):
+    def setUp(self):
+        super(TestDeadline, self).setUp()
+        self.server.routes["/small"] = (200, [], b"small")
+
+    def test_connection_reused(self):
+        self.assertEqual(self.session.get(self.url("/small"), max_age=-1, deadline=5).content, b"small")
+        conn = self.session.request_handler["http"][self.server.host]
+        self.assertEqual(self.session.get(self.url("/small"), max_age=-1, deadline=5).content, b"small")
+        self.assertIs(self.session.request_handler["http"][self.server.host], conn)
+
+    def test_max_bytes_not_exceeded(self):
+        self.session.get(self.url("/small"), max_age=-1, max_bytes=5)
+        self.assertEqual(len(self.session.request_handler["http"]), 1)
+
+    def test_body_deadline(self):
+        def slow_body(handler):
+            handler.send_response(200)
+            handler.send_header("Content-Length", "10")
+            handler.end_headers()
+            handler.wfile.write(b"slow")
+            handler.wfile.flush()
+            time.sleep(0.5)
+
+        self.server.routes["/slow"] = slow_body
+        with self.assertRaises(urlquick.Timeout):
+            self.session.get(self.url("/slow"), max_age=-1, deadline=0.2)
+        self.assertDictEqual(self.session.request_handler["http"], {})
+
+    def test_no_stale_response_for_options(self):
+        self.session.get(self.url("/small"))
+        self.server.routes["/slow"] = lambda handler: time.sleep(0.5) or (200, [], b"slow")
+        with self.assertRaises(urlquick.Timeout):
+            self.session.request(u"OPTIONS", self.url("/slow"), timeout=0.1)
+
+
+class TestParseCache(ServerTestCase):
+    def setUp(self):
+        super(TestParseCache, self).setUp()
+        self.server.routes["/data.json"] = (200, [("Content-Type", "application/json")], b'{"videos": [1, 2, 3]}')
+        self.server.routes["/data.xml"] = (200, [("Content-Type", "text/xml")], b"<videos><video id='1'/></videos>")
+
+    def parsed_files(self):
+        return sorted(name.rsplit(".", 1)[1] for name in os.listdir(os.path.join(self.directory, ".cache"))
+                      if name.count(".") == 1)
+
+    def test_save_and_load(self):
+        urlquick.CacheHandler.save_parsed(u"abc", u"json", {u"videos": [1, 2, 3]})
+        self.assertDictEqual(urlquick.CacheHandler.load_parsed(u"abc", u"json"), {u"videos": [1, 2, 3]})
+        self.assertIsNone(urlquick.CacheHandler.load_parsed(u"def", u"json"))
+
+    def test_load_corrupt(self):
+        urlquick.CacheHandler.save_parsed(u"abc", u"xml", [1])
+        parsed_file = os.path.join(urlquick.CacheHandler.cache_dir(), b"cache-abc.xml")
+        with open(parsed_file, "wb") as stream:
+            stream.write(b"corrupt")
+
+        self.assertIsNone(urlquick.CacheHandler.load_parsed(u"abc", u"xml"))
+        self.assertFalse(os.path.exists(parsed_file))
+
+    def test_parsed_objects_cached(self):
+        session = urlquick.Session(parse_cache=True)
+        self.assertDictEqual(session.get(self.url("/data.json")).json(), {u"videos": [1, 2, 3]})
+        self.assertEqual(session.get(self.url("/data.xml")).xml()[0].get("id"), "1")
+        self.assertListEqual(self.parsed_files(), ["json", "xml"])
+
+        # The cached response returns the stored parsed object
+        urlquick.CacheHandler.save_parsed(session.get(self.url("/data.json")).raw.body_hash, u"json", {u"from": 1})
+        self.assertDictEqual(session.get(self.url("/data.json")).json(), {u"from": 1})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_disabled(self):
+        resp = self.session.get(self.url("/data.json"))
+        self.assertDictEqual(resp.json(), {u"videos": [1, 2, 3]})
+        self.assertListEqual(self.parsed_files(), [])
+
+        # The body is only hashed when the parse cache is used
+        # noinspection PyProtectedMember
+        self.assertIsNone(resp.raw._body_hash)
+
+
+class TestMemoryLean(ServerTestCase):
+    body = u"".join(u"Épisode {}\n".format(i) for i in range(10000)).encode("utf8")
+
+    def setUp(self):
+        super(TestMemoryLean, self).setUp()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        headers = [("Content-Encoding", "gzip"), ("Content-Type", "text/plain; charset=utf-8")]
+        self.server.routes["/gzip"] = (200, headers, compressor.compress(self.body) + compressor.flush())
+
+    def test_compressed_body_released(self):
+        resp = urlquick.Session(memory_lean=True).get(self.url("/gzip"), max_age=-1)
+        self.assertEqual(resp.content, self.body)
+        # noinspection PyProtectedMember
+        self.assertIsNone(resp._body)
+
+    def test_content_released(self):
+        resp = urlquick.Session(memory_lean=True).get(self.url("/gzip"))
+        self.assertEqual(resp.text, self.body.decode("utf8"))
+        # noinspection PyProtectedMember
+        self.assertIsNone(resp._body)
+        self.assertIsNone(resp.raw.body)
+        self.assertNotIn("content", vars(resp))
+
+        # Content is recreated from the text when needed again
+        self.assertEqual(resp.content, self.body)
+
+    def test_body_kept(self):
+        resp = self.session.get(self.url("/gzip"), max_age=-1)
+        self.assertEqual(resp.text, self.body.decode("utf8"))
+        # noinspection PyProtectedMember
+        self.assertIsNotNone(resp._body)
+
+    def test_iter_content(self):
+        resp = urlquick.Session(memory_lean=True).get(self.url("/gzip"), max_age=-1)
+        chunks = list(resp.iter_content(1024))
+        self.assertTrue(all(isinstance(chunk, memoryview) for chunk in chunks))
+        self.assertEqual(b"".join(chunk.tobytes() for chunk in chunks), self.body)
+
+        chunks = list(self.session.get(self.url("/gzip")).iter_content(1024))
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertEqual(b"".join(chunks), self.body)
+
+
+class RefusingContext(object):
+    """Ssl context that fails the handshake of every connection that tries to resume a tls session."""
+
+    def __init__(self, context):
+        self.context = context
+        self.refused = 0
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def wrap_socket(self, sock, **kwargs):
+        if kwargs.get("session") is not None:
+            self.refused += 1
+            raise ssl.SSLError("session refused")
+        return self.context.wrap_socket(sock, **kwargs)
+
+
+@unittest.skipUnless(hasattr(ssl.SSLSocket, "session"), "tls session resumption is not supported")
+class TestTLSSessions(ServerTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        cls.context.load_cert_chain(os.path.join(FIXTURES, "localhost.pem"))
+        super(TestTLSSessions, cls).setUpClass()
+
+    def setUp(self):
+        super(TestTLSSessions, self).setUp()
+        # The server closes every connection, so each request needs a new handshake
+        self.server.routes["/"] = (200, [("Connection", "close")], b"secure")
+
+    def get(self):
+        return self.session.get(self.url("/"), max_age=-1, verify=False).content
+
+    def test_session_reused(self):
+        hits = self.context.session_stats()["hits"]
+        self.assertEqual(self.get(), b"secure")
+        self.assertEqual(self.context.session_stats()["hits"], hits)
+        self.assertEqual(len(self.session.tls_sessions), 1)
+
+        self.assertEqual(self.get(), b"secure")
+        self.assertEqual(self.get(), b"secure")
+        self.assertEqual(self.context.session_stats()["hits"], hits + 2)
+
+    def test_resume_refused(self):
+        self.assertEqual(self.get(), b"secure")
+        hits = self.context.session_stats()["hits"]
+
+        org_context = urlquick.TLSConnection.get_context(False)
+        # noinspection PyProtectedMember
+        refusing = urlquick.TLSConnection._contexts[False] = RefusingContext(org_context)
+        try:
+            # Falls back to a full handshake
+            self.assertEqual(self.get(), b"secure")
+        finally:
+            # noinspection PyProtectedMember
+            urlquick.TLSConnection._contexts[False] = org_context
+
+        self.assertEqual(refusing.refused, 1)
+        self.assertEqual(self.context.session_stats()["hits"], hits)
+        self.assertEqual(len(self.session.tls_sessions), 1)
+
+
+class TestCookieJar(UrlquickTestCase):
+    def setUp(self):
+        super(TestCookieJar, self).setUp()
+        self.jar = urlquick.CookieJar(u"test")
+
+    @staticmethod
+    def request(url):
+        return urlquick.Request(u"GET", url, urlquick.CaseInsensitiveDict())
+
+    def extract(self, url, *cookies):
+        return self.jar.extract(self.request(url), [("Set-Cookie", cookie) for cookie in cookies])
+
+    def matching(self, url):
+        return self.jar.matching(self.request(url))
+
+    def test_domain(self):
+        self.extract(u"http://www.example.com/", u"shared=1; Domain=.example.com", u"host=2")
+        self.assertDictEqual(self.matching(u"http://www.example.com/"), {u"shared": u"1", u"host": u"2"})
+        self.assertDictEqual(self.matching(u"http://video.example.com/"), {u"shared": u"1"})
+        self.assertDictEqual(self.matching(u"http://example.org/"), {})
+
+    def test_foreign_domain(self):
+        self.assertFalse(self.extract(u"http://www.example.org/", u"evil=1; Domain=example.com"))
+        self.assertDictEqual(self.matching(u"http://www.example.com/"), {})
+
+    def test_path(self):
+        self.extract(u"http://www.example.com/", u"api=1; Path=/api")
+        self.extract(u"http://www.example.com/dir/page", u"dir=2")
+        self.assertDictEqual(self.matching(u"http://www.example.com/api/videos"), {u"api": u"1"})
+        self.assertDictEqual(self.matching(u"http://www.example.com/apis"), {})
+        self.assertDictEqual(self.matching(u"http://www.example.com/dir"), {u"dir": u"2"})
+        self.assertDictEqual(self.matching(u"http://www.example.com/"), {})
+
+    def test_secure(self):
+        self.extract(u"https://www.example.com/", u"token=1; Secure")
+        self.assertDictEqual(self.matching(u"https://www.example.com/"), {u"token": u"1"})
+        self.assertDictEqual(self.matching(u"http://www.example.com/"), {})
+
+    def test_delete(self):
+        self.extract(u"http://www.example.com/", u"token=1; Max-Age=3600")
+        self.assertTrue(self.extract(u"http://www.example.com/", u"token=; Max-Age=0"))
+        self.assertDictEqual(self.matching(u"http://www.example.com/"), {})
+        self.assertEqual(len(urlquick.CookieJar(u"test")), 0)
+
+    def test_persisted(self):
+        self.extract(u"http://www.example.com/", u"session=1", u"login=2; Max-Age=3600")
+        self.assertDictEqual(urlquick.CookieJar(u"test").matching(self.request(u"http://www.example.com/")),
+                             {u"login": u"2"})
+
+    def test_session_cookies_not_saved(self):
+        self.extract(u"http://www.example.com/", u"session=1")
+        self.assertFalse(os.path.exists(self.jar.path()))
+
+
+class TestSessionCookies(ServerTestCase):
+    def setUp(self):
+        super(TestSessionCookies, self).setUp()
+        self.server.routes["/login"] = (302, [("Set-Cookie", "login=yes; Max-Age=3600"), ("Location", "/home")], b"")
+        self.server.routes["/home"] = (200, [], b"home")
+
+    def test_redirect(self):
+        session = urlquick.Session(name=u"test", max_age=-1)
+        session.cookies[u"user"] = u"set"
+        session.get(self.url("/login"))
+        self.assertEqual(self.server.requests[0][2]["cookie"], "user=set")
+        self.assertListEqual(sorted(self.server.requests[1][2]["cookie"].split("; ")), ["login=yes", "user=set"])
+
+    def test_persisted(self):
+        urlquick.Session(name=u"test", max_age=-1).get(self.url("/login"))
+        urlquick.Session(name=u"test", max_age=-1).get(self.url("/home"))
+        self.assertEqual(self.server.requests[-1][2]["cookie"], "login=yes")
+
+    def test_fork(self):
+        session = urlquick.Session(name=u"test", max_age=-1)
+        # noinspection PyProtectedMember
+        session._fork().get(self.url("/login"))
+        session.get(self.url("/home"))
+        self.assertEqual(self.server.requests[-1][2]["cookie"], "login=yes")
+
+
+class TestMirrors(ServerTestCase):
+    def setUp(self):
+        super(TestMirrors, self).setUp()
+        self.server.routes["/loop/video"] = (302, [("Location", "/loop/video")], b"")
+        self.server.routes["/broken/video"] = (500, [], b"broken")
+        self.server.routes["/good/video"] = (200, [], b"good")
+
+    def hedged(self, *mirrors):
+        """Send a hedged request from a separate thread, so the test fails instead of hanging."""
+        result = []
+
+        def run():
+            try:
+                result.append(self.session.get(u"video", mirrors=[self.url(m) for m in mirrors], hedge=True,
+                                               max_age=-1))
+            except Exception as e:
+                result.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), "hedged request did not return")
+        return result[0]
+
+    def test_hedged_error(self):
+        resp = self.hedged("/loop/", "/good/")
+        self.assertEqual(resp.content, b"good")
+
+    def test_hedged_error_and_server_error(self):
+        resp = self.hedged("/loop/", "/broken/")
+        self.assertEqual(resp.status_code, 500)
+
+    def test_hedged_all_failed(self):
+        self.assertIsInstance(self.hedged("/loop/", "/loop/"), urlquick.MaxRedirects)
+
+    def test_hedged_loser_aborted(self):
+        # The slow mirror never responds on its own, so the losing request would block until released
+        release = threading.Event()
+        self.server.routes["/slow/video"] = lambda handler: (release.wait(10), (200, [], b"slow"))[1]
+        forks, closed = [], threading.Event()
+        org_fork, org_delay = self.session._fork, urlquick.HEDGE_DELAY
+
+        def fork():
+            session = org_fork()
+            forks.append(session)
+            if len(forks) == 1:
+                org_close = session.close
+                session.close = lambda: (org_close(), closed.set())
+            return session
+
+        self.session._fork = fork
+        urlquick.HEDGE_DELAY = 0.05
+        try:
+            resp = self.hedged("/slow/", "/good/")
+            self.assertEqual(resp.content, b"good")
+            self.assertTrue(forks[0].aborted)
+            self.assertFalse(forks[1].aborted)
+            self.assertTrue(closed.wait(2), "losing request was not aborted")
+        finally:
+            urlquick.HEDGE_DELAY = org_delay
+            release.set()
+
+    def test_ranked(self):
+        stats = urlquick.MirrorStats()
+        stats.record(u"http://slow/", 2.0)
+        stats.record(u"http://fast/", 0.5)
+        stats.save()
+        self.assertListEqual(urlquick.MirrorStats().ranked([u"http://slow/", u"http://fast/"]),
+                             [u"http://fast/", u"http://slow/"])
+
+    def test_stats_save_throttled(self):
+        stats = urlquick.MirrorStats()
+        stats.record(u"http://slow/", 2.0)
+        stats.record(u"http://fast/", 0.5)
+        self.assertIsNone(urlquick.MirrorStats().get(u"http://fast/"))
+
+        # Changes since the last save are written when the session closes
+        self.session.mirror_stats = stats
+        self.session.close()
+        self.assertEqual(urlquick.MirrorStats().get(u"http://fast/")[0], 0.5)